@@ -1,120 +1,155 @@
-import asyncio
+import json
+import os
 import time
-from datetime import datetime
-from typing import Dict, Any, Optional, Callable
 import logging
-import time
-import gc
-import tkinter as tk
-from tkinter import scrolledtext, messagebox
 import queue
 import threading
-from threading import Thread
-from flask import Flask, request, jsonify
-import logging
-# 新增：导入MCP AI客户端
-from mcp_client_servers import MCPClientWrapper
-from pydub import AudioSegment
-from pydub.playback import play
-from playsound import playsound
+from concurrent.futures import Future
+from flask import Flask, Response, request, jsonify, stream_with_context
+import metrics
+import tracing
+# tkinter、MCP客户端、语音输出等较重的依赖在首次使用时才导入，
+# 只跑无界面会话或测试时不需要加载GUI/音频栈，也不会启动MCP服务器子进程
+from intervention_jobs import InterventionJobManager, QueueFullError
+from intervention_session import SessionManager, STATE_COUNSELLING, default_triage, format_event, greeting_speech
+from prewarm import Prewarmer, warm_user_context
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("LLMInterventionServer")
 
-# 初始化AI客户端（全局只初始化一次）
-mcp_ai_client = MCPClientWrapper()
+# 干预语音使用较快语速和确定性采样
+PLAY_VOICE_PARAMS = {"speed": 5, "top_k": 1, "refine_top_p": 0.1, "show_tqdm": False}
+
+_lazy_lock = threading.Lock()
+_mcp_ai_client = None
+_session_manager = None
+_prewarmer = None
+
+def get_mcp_client():
+    """AI客户端（全局只初始化一次），首次调用时才连接MCP服务器"""
+    global _mcp_ai_client
+    with _lazy_lock:
+        if _mcp_ai_client is None:
+            from mcp_client_servers import MCPClientWrapper
+            _mcp_ai_client = MCPClientWrapper()
+        return _mcp_ai_client
 
-# 用于主线程和GUI线程通信
-gui_result_queue = queue.Queue()
+def audio_output():
+    from audio_output import get_audio_output
+    return get_audio_output(tts_params=PLAY_VOICE_PARAMS)
 
-def play_voice(text):
-    import requests
-    import zipfile
-    import os
-    from io import BytesIO
-    import tempfile
+def play_voice(text, session_id=None, **kwargs):
+    """把语音交给共享的输出服务排队播放，不阻塞调用方；kwargs 透传给 speak（如 priority）"""
     print(f"准备播放语音: {text}")
-    chattts_service_host = os.environ.get("CHATTTS_SERVICE_HOST", "localhost")
-    chattts_service_port = os.environ.get("CHATTTS_SERVICE_PORT", "8000")
-    CHATTTS_URL = f"http://{chattts_service_host}:{chattts_service_port}/generate_voice"
-
-    body = {
-        "text": [text],
-        "stream": False,
-        "lang": None,
-        "skip_refine_text": True,
-        "refine_text_only": False,
-        "use_decoder": True,
-        "do_text_normalization": True,
-        "do_homophone_replacement": False,
-        "params_refine_text": {
-            "prompt": "",
-            "top_P": 0.1,
-            "top_K": 1,
-            "temperature": 0.01,
-            "repetition_penalty": 1,
-            "max_new_token": 384,
-            "min_new_token": 0,
-            "show_tqdm": False,
-            "ensure_non_empty": True,
-            "stream_batch": 24,
-        },
-        "params_infer_code": {
-            "prompt": "[speed_5]",
-            "top_P": 0.1,
-            "top_K": 1,
-            "temperature": 0.01,
-            "repetition_penalty": 1.05,
-            "max_new_token": 2048,
-            "min_new_token": 0,
-            "show_tqdm": False,
-            "ensure_non_empty": True,
-            "stream_batch": True,
-            "spk_emb": None,
-        }
-    }
+    with tracing.span("play_voice", session_id=session_id, chars=len(text)):
+        return audio_output().speak(text, session_id=session_id, **kwargs)
+
+
+def create_consulting(user_info):
+    from emotional_consulting import EmotionalConsultingSystem
+    from session_memory import get_session_memory
+    from session_store import get_session_store
+    from summary_jobs import get_summary_queue
+    return EmotionalConsultingSystem(
+        user_info, store=get_session_store(), memory=get_session_memory(), summarizer=get_summary_queue()
+    )
+
+def get_session_manager():
+    """会话引擎：Tk、Web、命令行前端共用"""
+    global _session_manager
+    with _lazy_lock:
+        if _session_manager is None:
+            _session_manager = SessionManager(
+                triage=default_triage(get_mcp_client),
+                consulting_factory=create_consulting,
+                speak=lambda text, session_id: play_voice(text, session_id=session_id),
+                barge_in=lambda session_id: audio_output().barge_in(session_id),
+            )
+        return _session_manager
+
+
+# Tk 不能跨线程使用：整个进程只有一个Tk线程和一个隐藏的根窗口，每次干预打开一个 Toplevel。
+# 其它线程（干预任务、会话事件循环）把界面操作 func(root) 放入 ui_queue，由Tk线程依次执行
+ui_queue = queue.Queue()
+_ui_thread = None
+
+def run_ui_loop():
+    """在当前线程运行Tk事件循环并处理 ui_queue；作为脚本启动时由主线程调用"""
+    import tkinter as tk
+
     try:
-        response = requests.post(CHATTTS_URL, json=body)
-        response.raise_for_status()
-        with zipfile.ZipFile(BytesIO(response.content), "r") as zip_ref:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                zip_ref.extractall(tmpdir)
-                # 找到第一个音频文件（优先mp3，其次wav）
-                audio_files = [f for f in os.listdir(tmpdir) if f.endswith(".mp3") or f.endswith(".wav")]
-                if audio_files:
-                    audio_path = os.path.join(tmpdir, audio_files[0])
-                    try:
-                        if audio_path.endswith(".mp3"):
-                            audio = AudioSegment.from_mp3(audio_path)
-                            play(audio)
-                        else:
-                            playsound(audio_path)
-                    except Exception as e:
-                        print(f"音频播放失败: {e}")
-                        try:
-                            if audio_path.endswith(".mp3"):
-                                audio = AudioSegment.from_mp3(audio_path)
-                                play(audio)
-                            else:
-                                audio = AudioSegment.from_wav(audio_path)
-                                play(audio)
-                        except Exception as e2:
-                            print(f"pydub 播放也失败: {e2}")
-    except Exception as e:
-        print(f"语音播放失败: {e}")
+        root = tk.Tk()
+    except tk.TclError as e:
+        # 没有图形界面：界面操作照常执行，在创建窗口时失败，干预任务不会一直等待
+        logger.error(f"无法启动Tk界面: {e}")
+        while True:
+            func = ui_queue.get()
+            try:
+                func(None)
+            except Exception:
+                pass
+    root.withdraw()
+
+    def pump():
+        try:
+            while True:
+                func = ui_queue.get_nowait()
+                try:
+                    func(root)
+                except Exception:
+                    logger.exception("界面操作失败")
+        except queue.Empty:
+            pass
+        root.after(50, pump)
+
+    root.after(0, pump)
+    root.mainloop()
+
+def call_in_ui(func):
+    """把 func(root) 交给Tk线程执行；没有Tk线程时（例如由WSGI服务器加载）启动一个专用线程"""
+    global _ui_thread
+    with _lazy_lock:
+        if _ui_thread is None:
+            _ui_thread = threading.Thread(target=run_ui_loop, name="tk-ui", daemon=True)
+            _ui_thread.start()
+    ui_queue.put(func)
 
 
 def run_intervention_gui(alert_data):
-    """弹出Tkinter窗口，收集用户输入，AI介入，返回结果"""
-    result = {}
-    root = tk.Tk()
-    root.title("EmoGuard - 情感关怀助手")
-    root.geometry("600x400")
-    root.configure(bg='#f0f0f0')
+    """在干预任务线程中运行：打开对话窗口，等待用户关闭后返回结果"""
+    session_manager = get_session_manager()
+    session = session_manager.create(alert_data)
+    try:
+        events = session_manager.call(session.start())
+        closed = Future()
+
+        def open_window(root):
+            try:
+                open_intervention_window(root, session, events, closed)
+            except Exception as e:
+                closed.set_exception(e)
+                raise
+
+        call_in_ui(open_window)
+        return closed.result()
+    finally:
+        session_manager.remove(session.id)
+
+
+def open_intervention_window(root, session, initial_events, closed):
+    """在Tk线程中创建对话窗口，收集用户输入并交给会话引擎处理；窗口关闭时把结果写入 closed"""
+    import tkinter as tk
+    from tkinter import scrolledtext, messagebox
+
+    session_manager = get_session_manager()
+    window = tk.Toplevel(root)
+    window.title("EmoGuard - 情感关怀助手")
+    window.geometry("600x400")
+    window.configure(bg='#f0f0f0')
 
     # 标题
     title_label = tk.Label(
-        root, 
+        window, 
         text="🤖 EmoGuard 情感关怀对话", 
         font=("Arial", 16, "bold"),
         bg='#f0f0f0',
@@ -124,7 +159,7 @@ def run_intervention_gui(alert_data):
 
     # 对话显示区域
     text_widget = scrolledtext.ScrolledText(
-        root,
+        window,
         wrap=tk.WORD,
         width=70,
         height=15,
@@ -133,14 +168,10 @@ def run_intervention_gui(alert_data):
         fg='#2c3e50'
     )
     text_widget.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
-    text_widget.config(state=tk.NORMAL)
-    # 初始提示
-    initial_message = "您好，我注意到您的心率异常（{}），请问您现在感觉如何？".format(alert_data.get('heart_rate', '未知'))
-    text_widget.insert(tk.END, f"情感助手: {initial_message}\n\n")
     text_widget.config(state=tk.DISABLED)
 
     # 输入区域
-    input_frame = tk.Frame(root, bg='#f0f0f0')
+    input_frame = tk.Frame(window, bg='#f0f0f0')
     input_frame.pack(fill=tk.X, padx=10, pady=10)
     input_label = tk.Label(
         input_frame,
@@ -156,97 +187,84 @@ def run_intervention_gui(alert_data):
     )
     entry_widget.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
 
-    # 新增：AI对话循环控制变量
-    continue_dialog = True
+    # 工作线程的结果和流式片段经 ui_queue 交回Tk线程处理；窗口关闭后到达的不再处理
+    pending = {"future": None, "streamed": False, "closed": False}
+
+    def in_window(func):
+        def run(root):
+            if not pending["closed"]:
+                func()
+        return run
+
+    def append(text):
+        text_widget.config(state=tk.NORMAL)
+        text_widget.insert(tk.END, text)
+        text_widget.see(tk.END)
+        text_widget.config(state=tk.DISABLED)
+
+    def render(events, skip_streamed=False):
+        for event in events:
+            if event["role"] == "user":
+                continue  # 用户输入已在发送时显示
+            if skip_streamed and event["role"] == "counsellor":
+                append("\n\n")  # 回复正文已流式显示
+                continue
+            append(format_event(event) + "\n\n")
+
+    def close():
+        pending["closed"] = True
+        window.destroy()
+        if not closed.done():
+            closed.set_result(session.result)
+
+    def set_busy(busy):
+        state = tk.DISABLED if busy else tk.NORMAL
+        send_button.config(state=state)
+        cancel_button.config(state=tk.NORMAL if busy else tk.DISABLED)
 
     def on_send(event=None):
-        nonlocal continue_dialog
         user_input = entry_widget.get().strip()
-        if user_input:
-            text_widget.config(state=tk.NORMAL)
-            text_widget.insert(tk.END, f"您: {user_input}\n\n")
-            text_widget.config(state=tk.DISABLED)
-            entry_widget.delete(0, tk.END)
-            # AI介入：调用MCP工具处理用户输入
-            ai_result = mcp_ai_client.process_user_input(user_input, alert_data)
-            ai_dict = ai_result.get("ai_response", {})
-            ai_response = ai_dict['result_str']
-            text_widget.config(state=tk.NORMAL)
-            text_widget.insert(tk.END, f"情感助手: {ai_response}\n\n")
-            text_widget.insert(tk.END, f"完整数据反馈: {ai_dict}\n\n")
-            if ai_dict['tool_results']:
-                for tool_res in ai_dict['tool_results']:
-                    if tool_res['tool_name'] == 'email_sender__send_fixed_email':
-                        text_widget.insert(tk.END, f"（系统已尝试发送邮件，结果：{tool_res['result']}）\n\n")
-                    elif tool_res['tool_name'] == 'email_sender__psychological_counseling_decision':
-                        text_widget.insert(tk.END, f"（系统心理疏导建议：{tool_res['result']}）\n\n")
-                        # 开始进行心理疏导对话
-                        from emotional_consulting import EmotionalConsultingSystem
-                        user_info = {
-                            'name': alert_data.get('user_name', '用户'),
-                            'age': alert_data.get('user_age', '未提供'),
-                            'topic': '心理疏导',
-                            'session_count': 1
-                        }
-                        consulting = EmotionalConsultingSystem(user_info)
-                        text_widget.config(state=tk.NORMAL)
-                        text_widget.insert(tk.END, f"\n【心理疏导对话已开启，您可以与李老师交流，输入'结束'或'终止'可随时退出】\n\n")
-                        text_widget.config(state=tk.DISABLED)
-                        # 事件驱动循环
-                        def on_psy_send(event=None):
-                            user_input_psy = entry_widget.get().strip()
-                            if user_input_psy:
-                                text_widget.config(state=tk.NORMAL)
-                                text_widget.insert(tk.END, f"您: {user_input_psy}\n\n")
-                                text_widget.config(state=tk.DISABLED)
-                                entry_widget.delete(0, tk.END)
-                                ai_psy_response = consulting.consult(user_input_psy)
-                                text_widget.config(state=tk.NORMAL)
-                                text_widget.insert(tk.END, f"李老师: {ai_psy_response}\n\n")
-                                #在此启动音频播放线程
-                                Thread(target=play_voice, args=(ai_psy_response,), daemon=True).start()
-                                text_widget.config(state=tk.DISABLED)
-                                text_widget.see(tk.END)
-                                if "结束" in user_input_psy or "终止" in user_input_psy or "结束" in ai_psy_response or "终止" in ai_psy_response:
-                                    text_widget.config(state=tk.NORMAL)
-                                    text_widget.insert(tk.END, "【心理疏导对话已结束】\n\n")
-                                    text_widget.config(state=tk.NORMAL)
-                                    text_widget.insert(tk.END, "\n" + "="*50 + "\n")
-                                    progress = consulting.get_session_progress()
-                                    text_widget.insert(tk.END, f"【咨询总结】: {progress}\n")
-                                    save_result = consulting.save_session_log()
-                                    text_widget.insert(tk.END, f"【会话记录】: {save_result}\n")
-                                    text_widget.config(state=tk.DISABLED)
-                                    text_widget.config(state=tk.DISABLED)
-                                    entry_widget.unbind('<Return>')
-                                    psy_send_button.config(state=tk.DISABLED)
-                        # 绑定新的回车事件
-                        entry_widget.unbind('<Return>')
-                        entry_widget.bind('<Return>', on_psy_send)
-                        psy_send_button = tk.Button(
-                            input_frame,
-                            text="发送（心理疏导）",
-                            command=on_psy_send,
-                            bg='#27ae60',
-                            fg='white',
-                            font=("Arial", 10, "bold")
-                        )
-                        psy_send_button.pack(side=tk.RIGHT)
-                        # 结束后可保存日志或做后续处理
-                        # consulting.save_session_log()
-
-            text_widget.see(tk.END)
-            text_widget.config(state=tk.DISABLED)
-            # 这里可以根据ai_response内容判断是否需要继续对话或调用工具
-            # 示例：如果AI建议终止，则结束对话
-            if "终止" in ai_response or "结束" in ai_response:
-                continue_dialog = False
-                result['user_input'] = user_input
-                result['ai_response'] = ai_response
-                root.quit()
-                root.destroy()
-            # 如果AI建议发送邮件或心理疏导，可在此处扩展相关逻辑
-            # 否则继续等待用户输入
+        if not user_input or session.ended or pending["future"] is not None:
+            return
+        entry_widget.delete(0, tk.END)
+        append(f"您: {user_input}\n\n")
+        streaming = session.state == STATE_COUNSELLING
+        if streaming:
+            append("李老师: ")
+        pending["streamed"] = streaming
+        future = session_manager.submit(session.send_message(
+            user_input,
+            on_delta=(lambda delta: ui_queue.put(in_window(lambda: append(delta)))) if streaming else None,
+        ))
+        pending["future"] = future
+        future.add_done_callback(lambda f: ui_queue.put(in_window(lambda: on_done(f))))
+        set_busy(True)
+
+    def on_cancel():
+        if pending["future"] is not None:
+            pending["future"].cancel()
+
+    def on_done(future):
+        pending["future"] = None
+        set_busy(False)
+        if future.cancelled():
+            append("\n（已取消本次回复）\n\n")
+            return
+        try:
+            events = future.result()
+        except Exception as e:
+            append(f"\n处理失败: {e}\n\n")
+            return
+        render(events, skip_streamed=pending["streamed"])
+        if session.state == STATE_COUNSELLING:
+            send_button.config(text="发送（心理疏导）", bg='#27ae60')
+        elif session.ended:
+            if session.result.get('counselling'):
+                # 疏导结束后保留窗口以便查看总结
+                entry_widget.unbind('<Return>')
+                send_button.config(state=tk.DISABLED)
+            else:
+                close()
 
     entry_widget.bind('<Return>', on_send)
     send_button = tk.Button(
@@ -257,36 +275,217 @@ def run_intervention_gui(alert_data):
         fg='white',
         font=("Arial", 10, "bold")
     )
+    cancel_button = tk.Button(
+        input_frame,
+        text="取消",
+        command=on_cancel,
+        state=tk.DISABLED,
+        font=("Arial", 10)
+    )
+    cancel_button.pack(side=tk.RIGHT)
     send_button.pack(side=tk.RIGHT)
 
     def on_close():
-        if messagebox.askokcancel("退出", "确定要结束这次关怀对话吗？"):
-            result['user_input'] = None
-            root.quit()
-            root.destroy()
+        if messagebox.askokcancel("退出", "确定要结束这次关怀对话吗？", parent=window):
+            on_cancel()
+            session_manager.submit(session.end())
+            session.result['user_input'] = None
+            close()
 
-    root.protocol("WM_DELETE_WINDOW", on_close)
-    root.mainloop()
-    gui_result_queue.put(result)
+    window.protocol("WM_DELETE_WINDOW", on_close)
+    render(initial_events)
 
-def start_gui_thread(alert_data):
-    gui_thread = threading.Thread(target=run_intervention_gui, args=(alert_data,), daemon=True)
-    gui_thread.start()
-    gui_thread.join()
-    # 获取结果
-    if not gui_result_queue.empty():
-        return gui_result_queue.get()
-    return {"user_input": None}
+# 干预会话在有界线程池中运行，/intervene 不再等待会话结束
+job_manager = InterventionJobManager(
+    run_intervention_gui,
+    max_workers=int(os.environ.get("INTERVENTION_MAX_WORKERS", "4")),
+    max_pending=int(os.environ.get("INTERVENTION_MAX_PENDING", "16")),
+)
 
 @app.route('/intervene', methods=['POST'])
 def intervene():
     alert_data = request.json or {}
     logger.info(f"收到干预请求: {alert_data}")
-    result = start_gui_thread(alert_data)
-    logger.info(f"用户干预结果: {result}")
-    return jsonify(result)
+    # 继续监控端的 trace，干预会话作为本 span 的子 span
+    alert_data.setdefault('traceparent', request.headers.get('traceparent'))
+    with tracing.span("intervene", parent=tracing.parent_from(alert_data)) as span:
+        alert_data['traceparent'] = span.traceparent
+        try:
+            job = job_manager.submit(alert_data)
+        except QueueFullError as e:
+            logger.warning(f"拒绝干预请求: {e}")
+            span.set_attribute("rejected", True)
+            return jsonify({"error": str(e)}), 429
+        span.set_attribute("job_id", job.id)
+    logger.info(f"干预任务已创建: {job.id}")
+    return jsonify({
+        "job_id": job.id,
+        "incident_id": span.incident_id,
+        "status": job.status,
+        "status_url": f"/intervene/{job.id}",
+        "events_url": f"/intervene/{job.id}/events",
+    }), 202
+
+@app.route('/intervene/<job_id>', methods=['GET'])
+def intervene_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/intervene/<job_id>/events', methods=['GET'])
+def intervene_events(job_id):
+    """SSE：推送任务状态变化，任务结束后关闭连接"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+
+    def generate():
+        sent = 0
+        while True:
+            events = job_manager.wait_events(job, sent)
+            for event in events:
+                payload = dict(job.to_dict(), seq=event["seq"], status=event["status"])
+                yield f"id: {event['seq']}\nevent: status\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            sent += len(events)
+            if job.done and sent >= len(job.events):
+                return
+            if not events:
+                yield ": keepalive\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+@app.route('/warmup', methods=['POST'])
+def warmup():
+    """
+    预热：提前连接MCP服务器、创建LLM客户端和会话引擎，让第一次干预不再承担初始化开销。
+    ?audio=1 同时初始化语音输出和TTS连接池，?gui=1 预先加载tkinter。
+    """
+    timeout = float(request.args.get("timeout", 30))
+    timings = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    mcp_ready = timed("mcp_client", lambda: get_mcp_client().ready.wait(timeout))
+    timed("session_manager", get_session_manager)
+
+    def llm_clients():
+        import emotional_consulting
+        emotional_consulting.get_client()
+        emotional_consulting.get_async_client()
+
+    errors = {}
+    try:
+        timed("llm_clients", llm_clients)
+    except ValueError as e:
+        errors["llm_clients"] = str(e)
+    if request.args.get("audio") == "1":
+        timed("audio_output", audio_output)
+    if request.args.get("gui") == "1":
+        timed("tkinter", lambda: __import__("tkinter"))
+
+    status = 200 if mcp_ready and not errors else 503
+    return jsonify({"ready": mcp_ready and not errors, "timings_ms": timings, "errors": errors}), status
+
+def _prewarm_mcp(alert_data):
+    if not get_mcp_client().prewarm(timeout=30):
+        raise TimeoutError("MCP服务器连接超时")
+
+def _prewarm_llm_clients(alert_data):
+    import emotional_consulting
+    emotional_consulting.get_client()
+    emotional_consulting.get_async_client()
+
+def _prewarm_greeting(alert_data):
+    audio_output().prerender(greeting_speech(alert_data), get_prewarmer().ttl)
+
+def get_prewarmer():
+    """告警预热：MCP工具列表、LLM客户端、会话引擎、开场白语音、用户记忆索引"""
+    global _prewarmer
+    with _lazy_lock:
+        if _prewarmer is None:
+            _prewarmer = Prewarmer({
+                "mcp_client": _prewarm_mcp,
+                "llm_clients": _prewarm_llm_clients,
+                "session_manager": lambda alert_data: get_session_manager(),
+                "greeting_audio": _prewarm_greeting,
+                "user_context": warm_user_context,
+            })
+        return _prewarmer
+
+@app.route('/prewarm', methods=['POST'])
+def prewarm():
+    """
+    告警预热：设备进入 warning 或心率快速上升时由监控端调用，立即返回，预热在后台进行。
+    同一设备 PREWARM_TTL 秒内只预热一次，期间没有升级为干预则预合成的语音被丢弃。
+    """
+    alert_data = request.json or {}
+    prewarmer = get_prewarmer()
+    started = prewarmer.submit(alert_data)
+    return jsonify({"prewarming": started, "ttl": prewarmer.ttl}), 202
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 抓取接口：干预任务、会话、LLM/TTS 延迟、语音队列、缓存命中等"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+# ---------- Web前端：无界面会话 ----------
+
+def session_payload(session, events):
+    return {
+        "session_id": session.id,
+        "state": session.state,
+        "events": events,
+        "result": session.result if session.ended else None,
+    }
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    session_manager = get_session_manager()
+    alert_data = request.json or {}
+    session = session_manager.create(alert_data)
+    events = session_manager.call(session.start())
+    return jsonify(session_payload(session, events)), 201
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    session_manager = get_session_manager()
+    session = session_manager.get(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    return jsonify(session_payload(session, session.events))
+
+@app.route('/sessions/<session_id>/messages', methods=['POST'])
+def send_session_message(session_id):
+    session_manager = get_session_manager()
+    session = session_manager.get(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    text = (request.json or {}).get("text", "")
+    events = session_manager.call(session.send_message(text))
+    return jsonify(session_payload(session, events))
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def end_session(session_id):
+    session_manager = get_session_manager()
+    session = session_manager.get(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    events = session_manager.call(session.end())
+    session_manager.remove(session_id)
+    return jsonify(session_payload(session, events))
 
 if __name__ == "__main__":
     logger.info("LLM_inter.py 以独立服务模式启动，监听 http://127.0.0.1:5005/intervene ...")
-    app.run(host="127.0.0.1", port=5005, debug=False)
+    # Flask 在后台线程处理请求，主线程运行唯一的Tk事件循环
+    _ui_thread = threading.current_thread()
+    threading.Thread(
+        target=app.run, kwargs={"host": "127.0.0.1", "port": 5005, "debug": False, "threaded": True}, daemon=True
+    ).start()
+    run_ui_loop()
 
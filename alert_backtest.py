@@ -0,0 +1,446 @@
+# 告警策略回测：把历史心率读数按设备并行回放给 analyze_heart_rate 和各个告警策略变体，
+# 统计告警数、检测时间和误报率，用来在历史数据上调阈值而不是凭经验
+#
+# 用法:
+#   python alert_backtest.py readings.jsonl --policy current --policy "strict:emergency=130,consecutive=2"
+#   python alert_backtest.py data/ --grid emergency=110,120,130 warning=95,100,105 --workers 8
+#   python alert_backtest.py --synthetic 200 --days 30 --export synthetic.jsonl
+#
+# 读数格式（JSONL 或 CSV）: device_id, timestamp（ISO 或秒）, current_heart_rate (或 heart_rate), 可选 label；
+# 也接受 HeartRateMonitor.history 的记录（{'timestamp', 'raw_data', 'analysis'}）。
+# label 为真的连续读数构成一次异常发作，有 label 时才能计算检测时间和误报。
+# 输入为目录或多个文件时按文件并行（同一设备的数据应在同一个文件中），单个文件按设备分块并行。
+import argparse
+import bisect
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from baseline import BaselineTable
+
+# (秒级时间戳, 心率, 是否处于标注的异常发作中)
+Reading = Tuple[float, float, bool]
+
+LEVELS = ("emergency", "warning")
+
+
+def _analyzer():
+    # 跳过 tracing 装饰器：回测每条读数都建 span 太慢，逻辑与线上完全相同
+    from motion_guard import HeartRateMonitor
+    return HeartRateMonitor.analyze_heart_rate.__wrapped__
+
+
+class ThresholdPolicy:
+    """
+    阈值告警策略：读数经 analyze_heart_rate 评估，风险等级属于 levels 时计数。
+
+    连续 consecutive 条读数达到告警等级才告警，两次告警至少间隔 cooldown 秒。
+    baseline 为 baseline.py 生成的基线文件时，有基线的设备按时段使用个人阈值。
+    默认参数等同于当前线上行为（每条 emergency/warning 读数都告警）。
+    """
+
+    def __init__(
+        self,
+        name: str = "current",
+        emergency: float = 120,
+        warning: float = 100,
+        bradycardia: float = 50,
+        levels: Sequence[str] = LEVELS,
+        consecutive: int = 1,
+        cooldown: float = 0,
+        baseline: Optional[str] = None,
+    ):
+        self.name = name
+        self.baseline_path = baseline
+        self.thresholds = SimpleNamespace(
+            emergency_threshold=emergency, warning_threshold=warning, bradycardia_threshold=bradycardia,
+            baseline=BaselineTable.load(baseline) if baseline else None, base_url=None,
+        )
+        self.levels = tuple(levels)
+        self.consecutive = consecutive
+        self.cooldown = cooldown
+        self._analyze = None
+        self.reset()
+
+    def reset(self):
+        self._streak = 0
+        self._last_alert = -math.inf
+
+    def step(self, timestamp: float, data: Dict[str, Any]) -> Optional[str]:
+        """处理一条读数，需要告警时返回风险等级"""
+        if self._analyze is None:
+            self._analyze = _analyzer()
+        risk = self._analyze(self.thresholds, data)['risk_level']
+        if risk not in self.levels:
+            self._streak = 0
+            return None
+        self._streak += 1
+        if self._streak >= self.consecutive and timestamp - self._last_alert >= self.cooldown:
+            self._last_alert = timestamp
+            return risk
+        return None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_analyze'] = None  # 子进程中重新获取
+        return state
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "emergency": self.thresholds.emergency_threshold,
+            "warning": self.thresholds.warning_threshold,
+            "bradycardia": self.thresholds.bradycardia_threshold,
+            "levels": "+".join(self.levels),
+            "consecutive": self.consecutive,
+            "cooldown": self.cooldown,
+            "baseline": self.baseline_path,
+        }
+
+
+POLICY_KEYS = {
+    "emergency": float, "warning": float, "bradycardia": float, "brady": float,
+    "consecutive": int, "cooldown": float, "levels": lambda v: tuple(v.split("+")), "baseline": str,
+}
+
+
+def parse_policy(spec: str) -> ThresholdPolicy:
+    """解析 "名称:emergency=130,warning=105,consecutive=2,cooldown=300,levels=emergency"；名称可省略"""
+    name, _, params = spec.partition(":") if ":" in spec else ("", "", spec)
+    kwargs: Dict[str, Any] = {}
+    for part in filter(None, (p.strip() for p in params.split(","))):
+        key, _, value = part.partition("=")
+        if key not in POLICY_KEYS:
+            if key == "current" and not value:
+                continue
+            raise ValueError(f"未知的策略参数: {key}")
+        kwargs["bradycardia" if key == "brady" else key] = POLICY_KEYS[key](value)
+    return ThresholdPolicy(name or params or "current", **kwargs)
+
+
+def grid_policies(axes: List[str]) -> List[ThresholdPolicy]:
+    """--grid emergency=110,120 warning=95,100 展开为笛卡尔积"""
+    if not axes:
+        return []
+    names, values = [], []
+    for axis in axes:
+        key, _, options = axis.partition("=")
+        names.append(key)
+        values.append(options.split(","))
+    return [
+        parse_policy(",".join(f"{k}={v}" for k, v in zip(names, combo)))
+        for combo in itertools.product(*values)
+    ]
+
+
+# ---------- 读取历史数据 ----------
+
+def _timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _label(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() not in ("", "0", "false", "normal", "no")
+    return bool(value)
+
+
+def _parse_record(record: Dict[str, Any], default_device: str) -> Tuple[str, Reading]:
+    if "raw_data" in record:  # HeartRateMonitor.history 的记录
+        raw = record["raw_data"]
+        device = str(raw.get("device_id", default_device))
+        ts = raw.get("received_timestamp") or record["timestamp"]
+        return device, (_timestamp(ts), float(raw["current_heart_rate"]), _label(raw.get("label")))
+    hr = record.get("current_heart_rate", record.get("heart_rate"))
+    device = str(record.get("device_id", default_device))
+    return device, (_timestamp(record["timestamp"]), float(hr), _label(record.get("label")))
+
+
+def load_readings(path: str) -> Dict[str, List[Reading]]:
+    """读取一个 JSONL / JSON / CSV 文件，按设备分组并按时间排序"""
+    devices: Dict[str, List[Reading]] = {}
+    default_device = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            records: Iterable[Dict[str, Any]] = csv.DictReader(f)
+        elif path.endswith(".json"):
+            data = json.load(f)
+            records = data if isinstance(data, list) else data.get("history", [])
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            try:
+                device, reading = _parse_record(record, default_device)
+            except (KeyError, TypeError, ValueError):
+                continue  # 缺字段或格式错误的行跳过
+            devices.setdefault(device, []).append(reading)
+    for readings in devices.values():
+        readings.sort(key=lambda r: r[0])
+    return devices
+
+
+def input_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith((".jsonl", ".json", ".csv"))
+            )
+        else:
+            files.append(path)
+    return files
+
+
+# ---------- 合成数据 ----------
+
+def synthesize(devices: int, days: float, interval: float = 5, seed: int = 0) -> Dict[str, List[Reading]]:
+    """
+    生成带标注的历史读数：昼夜节律的静息心率（部分为运动员）、每天0~2次运动（生理性心率升高，不标注），
+    以及平均每3天一次的心动过速或心动过缓发作（标注为异常）。
+    """
+    result = {}
+    steps = int(days * 86400 / interval)
+    # 从本地时间的零点开始，运动时段和昼夜节律与按时段统计的基线对齐
+    start = (int(time.time()) // 86400 - math.ceil(days)) * 86400 - time.localtime().tm_gmtoff
+    for d in range(devices):
+        rng = random.Random(f"{seed}:{d}")
+        # 约五分之一是静息心率偏低的运动员，夜间会低于全局的心动过缓阈值
+        baseline = rng.uniform(50, 58) if rng.random() < 0.2 else rng.uniform(62, 80)
+        events = []  # (开始, 结束, 目标心率, 是否异常)
+        for day in range(math.ceil(days)):
+            day_start = start + day * 86400
+            for _ in range(rng.choice((0, 1, 1, 2))):
+                at = day_start + rng.uniform(6, 21) * 3600
+                events.append((at, at + rng.uniform(20, 60) * 60, baseline + rng.uniform(50, 90), False))
+            if rng.random() < 1 / 3:
+                at = day_start + rng.uniform(0, 86400)
+                level = rng.uniform(125, 165) if rng.random() < 0.6 else rng.uniform(36, 47)
+                events.append((at, at + rng.uniform(2, 20) * 60, level, True))
+        events.sort()
+        readings = []
+        hr = baseline
+        for i in range(steps):
+            t = start + i * interval
+            hour = ((t - start) % 86400) / 3600
+            target = baseline - 5 * math.cos((hour - 3) / 24 * 2 * math.pi) - 3  # 凌晨3点最低
+            label = False
+            for ev_start, ev_end, level, abnormal in events:
+                if ev_start > t:
+                    break
+                if t < ev_end:
+                    target, label = level, abnormal
+            hr += (target - hr) * 0.3 + rng.gauss(0, 1.5)
+            readings.append((t, round(hr, 1), label))
+        result[str(d)] = readings
+    return result
+
+
+def export_readings(devices: Dict[str, List[Reading]], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for device, readings in devices.items():
+            for t, hr, label in readings:
+                f.write(json.dumps({"device_id": device, "timestamp": t, "current_heart_rate": hr, "label": int(label)}) + "\n")
+
+
+# ---------- 回放 ----------
+
+def episodes_of(readings: List[Reading]) -> List[Tuple[float, float]]:
+    """连续的标注读数合并为发作区间 (开始, 结束)"""
+    episodes = []
+    start = None
+    last = None
+    for t, _, label in readings:
+        if label and start is None:
+            start = t
+        elif not label and start is not None:
+            episodes.append((start, last))
+            start = None
+        last = t
+    if start is not None:
+        episodes.append((start, last))
+    return episodes
+
+
+def empty_stats() -> Dict[str, Any]:
+    return {"readings": 0, "alerts": 0, "true_alerts": 0, "false_alerts": 0,
+            "episodes": 0, "detected": 0, "latencies": [], "device_seconds": 0.0}
+
+
+def evaluate_devices(devices: Dict[str, List[Reading]], policies: List[ThresholdPolicy], grace: float) -> List[Dict[str, Any]]:
+    """对一组设备运行所有策略，返回与 policies 一一对应的统计"""
+    results = [empty_stats() for _ in policies]
+    for device, readings in devices.items():
+        if not readings:
+            continue
+        samples = [{'device_id': device, 'current_heart_rate': hr, 'received_timestamp': t} for t, hr, _ in readings]
+        episodes = episodes_of(readings)
+        starts = [s for s, _ in episodes]
+        span = readings[-1][0] - readings[0][0]
+        for policy, stats in zip(policies, results):
+            policy.reset()
+            first_alert: Dict[int, float] = {}
+            for (t, _, _), data in zip(readings, samples):
+                if policy.step(t, data) is None:
+                    continue
+                stats["alerts"] += 1
+                # 落在某次发作（含结束后 grace 秒）内的告警算真告警
+                i = bisect.bisect_right(starts, t) - 1
+                if i >= 0 and t <= episodes[i][1] + grace:
+                    stats["true_alerts"] += 1
+                    first_alert.setdefault(i, t)
+                else:
+                    stats["false_alerts"] += 1
+            stats["readings"] += len(readings)
+            stats["episodes"] += len(episodes)
+            stats["detected"] += len(first_alert)
+            stats["latencies"].extend(t - episodes[i][0] for i, t in first_alert.items())
+            stats["device_seconds"] += span
+    return results
+
+
+def _evaluate_file(path: str, policies: List[ThresholdPolicy], grace: float) -> List[Dict[str, Any]]:
+    return evaluate_devices(load_readings(path), policies, grace)
+
+
+def _merge(total: List[Dict[str, Any]], part: List[Dict[str, Any]]):
+    for t, p in zip(total, part):
+        for key, value in p.items():
+            t[key] += value
+
+
+def _chunks(devices: Dict[str, List[Reading]], n: int) -> List[Dict[str, List[Reading]]]:
+    items = sorted(devices.items(), key=lambda kv: -len(kv[1]))
+    chunks: List[Dict[str, List[Reading]]] = [{} for _ in range(max(1, n))]
+    sizes = [0] * len(chunks)
+    for device, readings in items:
+        i = sizes.index(min(sizes))  # 按读数量均衡分配
+        chunks[i][device] = readings
+        sizes[i] += len(readings)
+    return [c for c in chunks if c]
+
+
+def backtest(
+    policies: List[ThresholdPolicy],
+    devices: Optional[Dict[str, List[Reading]]] = None,
+    files: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    grace: float = 60,
+) -> List[Dict[str, Any]]:
+    """按设备（已加载的数据）或按文件并行回放，返回每个策略的汇总报告"""
+    workers = workers or os.cpu_count() or 1
+    totals = [empty_stats() for _ in policies]
+    started = time.perf_counter()
+    if workers == 1:
+        parts = [evaluate_devices(devices, policies, grace)] if devices is not None else [
+            _evaluate_file(path, policies, grace) for path in files or []
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            if devices is not None:
+                futures = [pool.submit(evaluate_devices, chunk, policies, grace) for chunk in _chunks(devices, workers)]
+            else:
+                futures = [pool.submit(_evaluate_file, path, policies, grace) for path in files or []]
+            parts = [f.result() for f in futures]
+    for part in parts:
+        _merge(totals, part)
+    wall = time.perf_counter() - started
+    return [report(policy, stats, wall) for policy, stats in zip(policies, totals)]
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def report(policy: ThresholdPolicy, stats: Dict[str, Any], wall: float) -> Dict[str, Any]:
+    device_days = stats["device_seconds"] / 86400 or None
+    labelled = stats["episodes"] > 0
+    ttd50 = _percentile(stats["latencies"], 0.5)
+    ttd95 = _percentile(stats["latencies"], 0.95)
+    return {
+        "policy": policy.name,
+        **policy.describe(),
+        "readings": stats["readings"],
+        "alerts": stats["alerts"],
+        "alerts_per_device_day": round(stats["alerts"] / device_days, 2) if device_days else None,
+        "episodes": stats["episodes"],
+        "detected": stats["detected"],
+        "recall": round(stats["detected"] / stats["episodes"], 3) if labelled else None,
+        "ttd_p50_s": round(ttd50, 1) if ttd50 is not None else None,
+        "ttd_p95_s": round(ttd95, 1) if ttd95 is not None else None,
+        "false_alerts": stats["false_alerts"] if labelled else None,
+        "false_per_device_day": round(stats["false_alerts"] / device_days, 2) if labelled and device_days else None,
+        "precision": round(stats["true_alerts"] / stats["alerts"], 3) if labelled and stats["alerts"] else None,
+        # 回放速度：数据覆盖的设备时长 / 实际耗时
+        "x_realtime": round(stats["device_seconds"] / wall) if wall else None,
+    }
+
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = ["policy", "alerts", "alerts_per_device_day", "episodes", "recall", "ttd_p50_s", "ttd_p95_s",
+               "false_per_device_day", "precision"]
+    width = max(12, max(len(r["policy"]) for r in results) + 2)
+    print(f"{'policy':<{width}}" + "".join(f"{c:>22}" for c in columns[1:]))
+    for r in results:
+        print(f"{r['policy']:<{width}}" + "".join(f"{'-' if r.get(c) is None else r[c]:>22}" for c in columns[1:]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="告警策略回测")
+    parser.add_argument("inputs", nargs="*", help="读数文件或目录（.jsonl/.json/.csv）")
+    parser.add_argument("--policy", action="append", default=[], help="策略，如 current 或 strict:emergency=130,consecutive=2")
+    parser.add_argument("--grid", nargs="+", default=[], help="参数网格，如 emergency=110,120,130 warning=95,100")
+    parser.add_argument("--grace", type=float, default=60, help="发作结束后多少秒内的告警仍算命中")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认CPU核数")
+    parser.add_argument("--synthetic", type=int, default=0, help="不读文件，生成该数量设备的合成数据")
+    parser.add_argument("--days", type=float, default=7, help="合成数据的天数")
+    parser.add_argument("--interval", type=float, default=5, help="合成数据的采样间隔（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--export", help="把合成数据写入 JSONL 后退出")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args(argv)
+
+    policies = [parse_policy(spec) for spec in args.policy] + grid_policies(args.grid)
+    if not any(p.name == "current" for p in policies):
+        policies.insert(0, ThresholdPolicy())  # 始终与线上默认策略对比
+
+    devices = files = None
+    if args.synthetic:
+        devices = synthesize(args.synthetic, args.days, args.interval, args.seed)
+        if args.export:
+            export_readings(devices, args.export)
+            print(f"已写入 {sum(map(len, devices.values()))} 条读数: {args.export}")
+            return
+    else:
+        files = input_files(args.inputs)
+        if not files:
+            parser.error("需要读数文件或 --synthetic")
+        if len(files) == 1:
+            devices = load_readings(files[0])
+
+    results = backtest(policies, devices=devices, files=files if devices is None else None,
+                       workers=args.workers, grace=args.grace)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"{results[0]['readings']} 条读数，回放速度 {results[0]['x_realtime']}x 实时")
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
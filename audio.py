@@ -1,85 +1,78 @@
 # 新版客户端，兼容 main.py FastAPI 服务参数和响应格式
 import os
-import requests
-import zipfile
-from io import BytesIO
+import wave
 
-CHATTTS_SERVICE_HOST = os.environ.get("CHATTTS_SERVICE_HOST", "localhost")
-CHATTTS_SERVICE_PORT = os.environ.get("CHATTTS_SERVICE_PORT", "8000")
-CHATTTS_URL = f"http://{CHATTTS_SERVICE_HOST}:{CHATTTS_SERVICE_PORT}/generate_voice"
+from tts_client import TTSClient, extract_zip, SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS
+
+tts = TTSClient(manual_seed=12345678)
+
+TEST_TEXTS = [
+    "四川美食确实以辣闻名，但也有不辣的选择。",
+    "比如甜水面、赖汤圆、蛋烘糕、叶儿粑等，这些小吃口味温和，甜而不腻，也很受欢迎。",
+]
 
 def get_body(stream_mode):
-    return {
-        "text": [
-            "四川美食确实以辣闻名，但也有不辣的选择。",
-            "比如甜水面、赖汤圆、蛋烘糕、叶儿粑等，这些小吃口味温和，甜而不腻，也很受欢迎。",
-        ],
-        "stream": stream_mode,
-        "lang": None,
-        "skip_refine_text": True,
-        "refine_text_only": False,
-        "use_decoder": True,
-        "do_text_normalization": True,
-        "do_homophone_replacement": False,
-        "params_refine_text": {
-            "prompt": "",
-            "top_P": 0.7,
-            "top_K": 20,
-            "temperature": 0.01,
-            "repetition_penalty": 1,
-            "max_new_token": 384,
-            "min_new_token": 0,
-            "show_tqdm": True,
-            "ensure_non_empty": True,
-            "stream_batch": 24,
-        },
-        "params_infer_code": {
-            "prompt": "[speed_2]",
-            "top_P": 0.1,
-            "top_K": 20,
-            "temperature": 0.01,
-            "repetition_penalty": 1.05,
-            "max_new_token": 2048,
-            "min_new_token": 0,
-            "show_tqdm": True,
-            "ensure_non_empty": True,
-            "stream_batch": True,
-            "spk_emb": None,
-            "manual_seed": 12345678,
-        }
-    }
+    return tts.build_body(TEST_TEXTS, stream=stream_mode)
 
 def save_zip_response(response, out_dir):
-    os.makedirs(out_dir, exist_ok=True)
-    with zipfile.ZipFile(BytesIO(response.content), "r") as zip_ref:
-        zip_ref.extractall(out_dir)
+    extract_zip(response.content, out_dir)
     print(f"Extracted files to {out_dir}")
 
+class StreamingWavWriter:
+    """
+    边接收边写WAV：先写文件头，按采样对齐追加PCM，关闭时回填数据长度。
+    内存占用只与单个块大小有关，与音频总时长无关。
+    """
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE, sample_width=SAMPLE_WIDTH, channels=CHANNELS):
+        self.path = path
+        self.frame_size = sample_width * channels
+        self._pending = b""  # 跨块边界被截断的半个采样
+        self._wav = wave.open(path, "wb")
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(sample_width)
+        self._wav.setframerate(sample_rate)
+        self.frames_written = 0
+
+    def write(self, chunk):
+        """追加一块PCM数据，不完整的采样留到下一块拼接"""
+        if self._pending:
+            chunk = self._pending + chunk
+        usable = len(chunk) - len(chunk) % self.frame_size
+        self._pending = chunk[usable:]
+        if usable:
+            # writeframesraw 只追加数据，不回写文件头
+            self._wav.writeframesraw(chunk[:usable])
+            self.frames_written += usable // self.frame_size
+
+    def close(self):
+        if self._pending:
+            print(f"丢弃末尾不完整的采样: {len(self._pending)} 字节")
+            self._pending = b""
+        # wave 在关闭时回填RIFF和data块长度
+        self._wav.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
 def save_stream_response(response, out_dir):
     os.makedirs(out_dir, exist_ok=True)
-    import numpy as np
-    from scipy.io import wavfile
-    # 收集所有PCM块
-    audio_chunks = []
-    for chunk in response.iter_content(chunk_size=8192):
-        arr = np.frombuffer(chunk, dtype=np.int16)
-        if arr.size > 0:
-            audio_chunks.append(arr)
-    if audio_chunks:
-        audio_all = np.concatenate(audio_chunks)
-    else:
-        audio_all = np.array([], dtype=np.int16)
     out_path = os.path.join(out_dir, "audio_stream.wav")
-    # 保存为WAV文件，采样率假定为24000（与服务端一致）
-    wavfile.write(out_path, 24000, audio_all)
-    print(f"Saved stream audio to {out_path}")
+    # 采样率假定为24000（与服务端一致）
+    with StreamingWavWriter(out_path) as writer:
+        for chunk in response.iter_content(chunk_size=8192):
+            if chunk:
+                writer.write(chunk)
+    print(f"Saved stream audio to {out_path} ({writer.frames_written} frames)")
 
 
 def test_api(stream_mode):
-    body = get_body(stream_mode)
     print(f"Testing stream={stream_mode}")
-    response = requests.post(CHATTTS_URL, json=body, stream=stream_mode)
-    response.raise_for_status()
+    response = tts.post(TEST_TEXTS, stream=stream_mode)
     out_dir = f"./output_stream_{stream_mode}/"
     #print("Response status:", response.status_code)
     #print("Response headers:", response.headers)
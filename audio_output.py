@@ -0,0 +1,429 @@
+# 全进程共享的语音输出服务：优先级队列 + 混音器，支持打断（barge-in）、压低低优先级语音（ducking）和有界队列
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+
+import metrics
+import tracing
+from tts_client import TTSClient, get_default_client, SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS
+
+# 优先级：数值越大越优先
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+FRAMES_PER_CHUNK = 1024
+
+SPEECH_DROPPED = metrics.Counter("audio_speech_dropped_total", "Speech requests dropped before playback", ["reason"])
+FIRST_AUDIO = metrics.Histogram("audio_first_audio_seconds", "Time from a speech request to its first audible frame")
+QUEUE_DEPTH = metrics.Gauge("audio_queue_depth", "Speech requests waiting for a voice")
+ACTIVE_VOICES = metrics.Gauge("audio_active_voices", "Speech requests currently synthesizing or playing")
+PRERENDERED = metrics.Counter("audio_prerendered_total", "Pre-rendered speech by outcome", ["result"])
+
+
+class PyAudioSink:
+    """通过PyAudio播放PCM，write 按音频时长阻塞，天然控制混音节奏"""
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        import pyaudio
+
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=self.audio.get_format_from_width(SAMPLE_WIDTH),
+            channels=channels,
+            rate=sample_rate,
+            output=True,
+            frames_per_buffer=FRAMES_PER_CHUNK,
+        )
+
+    def write(self, pcm: bytes):
+        self.stream.write(pcm)
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio.terminate()
+
+
+class NullSink:
+    """丢弃音频的输出端（无声卡环境、基准测试），realtime=True 时按音频时长等待"""
+
+    def __init__(self, realtime=False, sample_rate=SAMPLE_RATE):
+        self.realtime = realtime
+        self.bytes_per_second = sample_rate * SAMPLE_WIDTH * CHANNELS
+        self.bytes_written = 0
+
+    def write(self, pcm: bytes):
+        self.bytes_written += len(pcm)
+        if self.realtime:
+            time.sleep(len(pcm) / self.bytes_per_second)
+
+    def close(self):
+        pass
+
+
+class SpeechRequest:
+    """一条待播放的语音，由调用方持有以便等待或取消"""
+
+    def __init__(self, text: str, priority: int, session_id: Optional[str], seq: int):
+        self.text = text
+        self.priority = priority
+        self.session_id = session_id
+        self.seq = seq
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.first_audio_at: Optional[float] = None
+        self.error: Optional[Exception] = None
+        # 提交时所在的 trace，播放结束后补记一个 span
+        self.trace_parent = tracing.current_span()
+
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.fetch_done = threading.Event()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待播放结束（或被取消）"""
+        return self.done.wait(timeout)
+
+    def take(self, max_bytes: int) -> bytes:
+        """从缓冲区取出不超过 max_bytes 的整采样数据"""
+        with self.lock:
+            n = min(max_bytes, len(self.buffer))
+            n -= n % SAMPLE_WIDTH
+            data = bytes(self.buffer[:n])
+            del self.buffer[:n]
+            return data
+
+    @property
+    def finished(self) -> bool:
+        return self.fetch_done.is_set() and not self.buffer
+
+
+class PrerenderedSpeech:
+    """提前合成的一段语音；合成过程中即可被播放请求边合成边读取"""
+
+    def __init__(self, text: str, ttl: float):
+        self.text = text
+        self.expires_at = time.time() + ttl
+        self.pcm = bytearray()
+        self.ready = threading.Event()
+        self.error: Optional[Exception] = None
+        self.used = False
+
+
+class AudioOutputService:
+    """
+    单一的语音输出通道。
+
+    - 请求按优先级排队，同优先级按先后顺序依次播放，不再互相重叠；
+    - 更高优先级的语音可以立即插入播放，正在播放的低优先级语音被压低音量；
+    - barge_in 取消某个会话排队中和正在播放的语音，尚未合成的请求不会再发起TTS；
+    - 队列有上限，满时淘汰最低优先级中最旧的请求，过期请求在开始合成前丢弃；
+    - prerender 提前合成预计要说的话，ttl 内 speak 同样的文本时直接播放，不再等待TTS。
+    """
+
+    def __init__(
+        self,
+        tts_client: Optional[TTSClient] = None,
+        sink=None,
+        max_queue: int = 8,
+        max_voices: int = 2,
+        duck_gain: float = 0.3,
+        max_age: Optional[float] = 30.0,
+        tts_params: Optional[dict] = None,
+    ):
+        self.tts = tts_client or get_default_client()
+        self._sink = sink
+        self.max_queue = max_queue
+        self.max_voices = max_voices
+        self.duck_gain = duck_gain
+        self.max_age = max_age
+        self.tts_params = tts_params or {}
+
+        self._prerendered: Dict[str, PrerenderedSpeech] = {}
+        self._pending: List[tuple] = []  # (-priority, seq, request)
+        self._active: List[SpeechRequest] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self._mixer_thread = threading.Thread(target=self._mix_loop, name="audio-output-mixer", daemon=True)
+        self._mixer_thread.start()
+
+    @property
+    def sink(self):
+        # 延迟打开声卡，只排队不播放时不需要PyAudio
+        if self._sink is None:
+            self._sink = PyAudioSink()
+        return self._sink
+
+    # ---------- 对外接口 ----------
+
+    def speak(self, text: str, priority: int = PRIORITY_NORMAL, session_id: Optional[str] = None) -> Optional[SpeechRequest]:
+        """提交一条语音，队列已满且优先级不够时返回 None"""
+        request = SpeechRequest(text, priority, session_id, next(self._seq))
+        with self._cond:
+            self._drop_cancelled_locked()
+            if len(self._pending) >= self.max_queue and not self._evict_locked(priority):
+                SPEECH_DROPPED.labels("queue_full").inc()
+                print(f"语音队列已满，丢弃: {text[:20]}")
+                request.done.set()
+                return None
+            heapq.heappush(self._pending, (-priority, request.seq, request))
+            self._cond.notify()
+        return request
+
+    def prerender(self, text: str, ttl: float) -> bool:
+        """
+        在调用线程中提前合成 text，ttl 秒内有效；已有未过期的同一文本时只延长有效期，返回 False。
+        合成失败时丢弃，之后的 speak 照常请求TTS。
+        """
+        with self._cond:
+            self._purge_prerendered_locked()
+            entry = self._prerendered.get(text)
+            if entry is not None:
+                entry.expires_at = max(entry.expires_at, time.time() + ttl)
+                return False
+            entry = self._prerendered[text] = PrerenderedSpeech(text, ttl)
+        try:
+            for chunk in self.tts.iter_stream(text, **self.tts_params):
+                entry.pcm.extend(chunk)
+        except Exception as e:
+            entry.error = e
+            PRERENDERED.labels("failed").inc()
+            print(f"语音预合成失败: {e}")
+            with self._cond:
+                if self._prerendered.get(text) is entry:
+                    del self._prerendered[text]
+        finally:
+            entry.ready.set()
+        return entry.error is None
+
+    def prerendered_count(self) -> int:
+        with self._cond:
+            self._purge_prerendered_locked()
+            return len(self._prerendered)
+
+    def barge_in(self, session_id: Optional[str] = None) -> int:
+        """取消指定会话（None 表示全部）排队中和正在播放的语音，返回取消条数"""
+        cancelled = 0
+        with self._cond:
+            for _, _, request in self._pending:
+                if session_id is None or request.session_id == session_id:
+                    request.cancel()
+                    cancelled += 1
+            for request in self._active:
+                if session_id is None or request.session_id == session_id:
+                    request.cancel()
+                    cancelled += 1
+            self._drop_cancelled_locked()
+            self._cond.notify()
+        return cancelled
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def active_count(self) -> int:
+        with self._cond:
+            return len(self._active)
+
+    def shutdown(self):
+        self.barge_in()
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._mixer_thread.join(timeout=2)
+        if self._sink is not None:
+            self._sink.close()
+
+    # ---------- 调度 ----------
+
+    def _purge_prerendered_locked(self):
+        now = time.time()
+        for text in [t for t, e in self._prerendered.items() if e.expires_at < now]:
+            if not self._prerendered.pop(text).used:
+                PRERENDERED.labels("expired").inc()
+
+    def _take_prerendered(self, text: str) -> Optional[PrerenderedSpeech]:
+        with self._cond:
+            self._purge_prerendered_locked()
+            entry = self._prerendered.get(text)
+            if entry is not None:
+                entry.used = True
+                PRERENDERED.labels("used").inc()
+            return entry
+
+    def _drop_cancelled_locked(self):
+        kept = []
+        for item in self._pending:
+            if item[2].cancelled.is_set():
+                item[2].done.set()
+            else:
+                kept.append(item)
+        if len(kept) != len(self._pending):
+            self._pending = kept
+            heapq.heapify(self._pending)
+
+    def _evict_locked(self, priority: int) -> bool:
+        """为新请求腾出位置：淘汰优先级更低的请求中最旧的一条"""
+        lowest = min(self._pending, key=lambda item: (-item[0], item[1]))
+        if -lowest[0] >= priority:
+            return False
+        self._pending.remove(lowest)
+        heapq.heapify(self._pending)
+        SPEECH_DROPPED.labels("evicted").inc()
+        lowest[2].cancel()
+        lowest[2].done.set()
+        return True
+
+    def _admit_locked(self):
+        """把可以开始播放的请求从队列移到活动列表，并启动其合成"""
+        now = time.time()
+        while self._pending:
+            neg_priority, _, request = self._pending[0]
+            if request.cancelled.is_set() or (self.max_age is not None and now - request.created_at > self.max_age):
+                heapq.heappop(self._pending)
+                if not request.cancelled.is_set():
+                    SPEECH_DROPPED.labels("expired").inc()
+                request.cancel()
+                request.done.set()
+                continue
+            if self._active:
+                # 同级或更低优先级排队等待，只有更高优先级才能插入
+                if len(self._active) >= self.max_voices:
+                    break
+                if -neg_priority <= max(v.priority for v in self._active):
+                    break
+            heapq.heappop(self._pending)
+            request.started_at = now
+            self._active.append(request)
+            threading.Thread(target=self._fetch, args=(request,), daemon=True).start()
+
+    def _copy_prerendered(self, request: SpeechRequest, entry: PrerenderedSpeech) -> bool:
+        """把预合成的音频（可能仍在合成中）复制到请求缓冲区；预合成失败且未复制任何数据时返回 False"""
+        offset = 0
+        while not request.cancelled.is_set():
+            finished = entry.ready.is_set()
+            chunk = bytes(entry.pcm[offset:])
+            if chunk:
+                offset += len(chunk)
+                with request.lock:
+                    request.buffer.extend(chunk)
+            elif finished:
+                break
+            else:
+                entry.ready.wait(0.02)
+        if entry.error is not None and offset == 0:
+            return False
+        request.error = entry.error
+        return True
+
+    def _fetch(self, request: SpeechRequest):
+        """流式拉取PCM到请求缓冲区，被取消时立即关闭连接；有预合成的音频时直接使用"""
+        try:
+            entry = self._take_prerendered(request.text)
+            if entry is not None and self._copy_prerendered(request, entry):
+                return
+            for chunk in self.tts.iter_stream(request.text, **self.tts_params):
+                if request.cancelled.is_set():
+                    break
+                with request.lock:
+                    request.buffer.extend(chunk)
+        except Exception as e:
+            request.error = e
+            print(f"语音合成失败: {e}")
+        finally:
+            request.fetch_done.set()
+
+    def _record_playback(self, voice: SpeechRequest):
+        if voice.first_audio_at is not None:
+            FIRST_AUDIO.observe(voice.first_audio_at - voice.created_at)
+        if voice.trace_parent is None:
+            return
+        now = time.time()
+        attributes = {
+            "session_id": voice.session_id,
+            "priority": voice.priority,
+            "cancelled": voice.cancelled.is_set(),
+            "queue_wait_ms": round(((voice.started_at or now) - voice.created_at) * 1000, 1),
+        }
+        if voice.first_audio_at is not None:
+            attributes["first_audio_ms"] = round((voice.first_audio_at - voice.created_at) * 1000, 1)
+        tracing.record_span("tts.playback", voice.created_at, now, parent=voice.trace_parent, **attributes)
+
+    def _mix(self, voices: List[SpeechRequest]) -> bytes:
+        """取出每路语音的下一块并混音，低优先级语音按 duck_gain 压低"""
+        max_bytes = FRAMES_PER_CHUNK * SAMPLE_WIDTH * CHANNELS
+        top = max(v.priority for v in voices)
+        parts = []
+        for voice in voices:
+            data = voice.take(max_bytes)
+            if data:
+                if voice.first_audio_at is None:
+                    voice.first_audio_at = time.time()
+                parts.append((data, 1.0 if voice.priority >= top else self.duck_gain))
+        if not parts:
+            return b""
+        if len(parts) == 1 and parts[0][1] == 1.0:
+            return parts[0][0]
+
+        import numpy as np
+
+        length = max(len(data) for data, _ in parts) // SAMPLE_WIDTH
+        mixed = np.zeros(length, dtype=np.float32)
+        for data, gain in parts:
+            samples = np.frombuffer(data, dtype=np.int16)
+            mixed[:samples.size] += samples * gain
+        return np.clip(mixed, -32768, 32767).astype(np.int16).tobytes()
+
+    def _mix_loop(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                self._admit_locked()
+                if not self._active:
+                    self._cond.wait(timeout=0.1)
+                    continue
+                voices = list(self._active)
+
+            live = [v for v in voices if not v.cancelled.is_set()]
+            chunk = self._mix(live) if live else b""
+            if chunk:
+                try:
+                    self.sink.write(chunk)
+                except Exception as e:
+                    print(f"音频输出失败: {e}")
+                    for voice in voices:
+                        voice.cancel()
+            else:
+                time.sleep(0.005)
+
+            with self._cond:
+                for voice in voices:
+                    if voice.cancelled.is_set() or voice.finished:
+                        voice.done.set()
+                        self._active.remove(voice)
+                        self._record_playback(voice)
+
+
+_service: Optional[AudioOutputService] = None
+_service_lock = threading.Lock()
+QUEUE_DEPTH.set_function(lambda: _service.queue_depth() if _service is not None else 0)
+ACTIVE_VOICES.set_function(lambda: _service.active_count() if _service is not None else 0)
+
+
+def get_audio_output(**kwargs) -> AudioOutputService:
+    """进程内唯一的语音输出服务，首次调用时按参数创建"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = AudioOutputService(**kwargs)
+        return _service
@@ -1,4 +1,3 @@
-import os
 import requests
 import pyaudio
 import threading
@@ -7,15 +6,10 @@ from queue import Queue
 import numpy as np
 import io
 import wave
-import json
 
-# 配置参数
-CHATTTS_SERVICE_HOST = os.environ.get("CHATTTS_SERVICE_HOST", "localhost")
-CHATTTS_SERVICE_PORT = os.environ.get("CHATTTS_SERVICE_PORT", "8000")
-CHATTTS_URL = f"http://{CHATTTS_SERVICE_HOST}:{CHATTTS_SERVICE_PORT}/generate_voice"
+from tts_client import TTSClient, SAMPLE_RATE
 
 # 音频参数
-SAMPLE_RATE = 24000
 CHUNK_SIZE = 1024
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
@@ -93,46 +87,12 @@ class AudioStreamPlayer:
 class TTSStreamClient:
     def __init__(self):
         self.player = AudioStreamPlayer()
+        self.tts = TTSClient(manual_seed=12345678)
         self.is_running = False
         
     def get_tts_request_body(self, text):
         """生成TTS请求体"""
-        return {
-            "text": [text],
-            "stream": True,
-            "lang": None,
-            "skip_refine_text": True,
-            "refine_text_only": False,
-            "use_decoder": True,
-            "do_text_normalization": True,
-            "do_homophone_replacement": False,
-            "params_refine_text": {
-                "prompt": "",
-                "top_P": 0.7,
-                "top_K": 20,
-                "temperature": 0.01,
-                "repetition_penalty": 1,
-                "max_new_token": 384,
-                "min_new_token": 0,
-                "show_tqdm": True,
-                "ensure_non_empty": True,
-                "stream_batch": 24,
-            },
-            "params_infer_code": {
-                "prompt": "[speed_2]",
-                "top_P": 0.1,
-                "top_K": 20,
-                "temperature": 0.01,
-                "repetition_penalty": 1.05,
-                "max_new_token": 2048,
-                "min_new_token": 0,
-                "show_tqdm": True,
-                "ensure_non_empty": True,
-                "stream_batch": True,
-                "spk_emb": None,
-                "manual_seed": 12345678,
-            }
-        }
+        return self.tts.build_body(text, stream=True)
     
     def process_stream_response(self, response):
         """处理流式响应并播放音频 - 收集完整音频后再播放"""
@@ -224,12 +184,10 @@ class TTSStreamClient:
     def request_and_play(self, text):
         """请求TTS服务并播放音频"""
         try:
-            body = self.get_tts_request_body(text)
             print(f"请求TTS服务: {text}")
             
-            # 设置较长的超时时间
-            response = requests.post(CHATTTS_URL, json=body, stream=True, timeout=60)
-            response.raise_for_status()
+            # 复用连接池，超时时间沿用客户端默认的60秒
+            response = self.tts.post(text, stream=True)
             
             # 检查响应内容类型
             content_type = response.headers.get('Content-Type', '')
@@ -0,0 +1,245 @@
+# 个人心率基线：离线批处理按用户、按时段统计历史读数的静息和活动心率分布，
+# 生成每个用户每个时段的告警阈值查找表；监控端按 (用户, 时段) 直接取阈值，O(1)
+#
+# 用法:
+#   python baseline.py readings.jsonl data/ --out baselines.json     # 读数格式同 alert_backtest.py
+#   python baseline.py --synthetic 200 --days 30 --out baselines.json
+#   python alert_backtest.py readings.jsonl --policy "personal:baseline=baselines.json"
+#
+# 个人阈值只在全局阈值基础上放宽、且有上限：运动员不会因日常运动反复告警，
+# 但再高的个人活动心率也不会让明显的心动过速漏报。历史不足的时段退回全天统计，再不足则用全局阈值。
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+BASELINE_PATH = os.environ.get("BASELINE_PATH", "baselines.json")
+
+BUCKET_HOURS = 4          # 每天分为 24 / BUCKET_HOURS 个时段
+MIN_SAMPLES = 100         # 时段内少于该读数数时用全天统计
+RELOAD_INTERVAL = 60      # 秒，检查基线文件是否被批处理更新的间隔
+
+# 统计的分位数：p01/p05 描述静息下限，p50 为典型静息心率，p95/p99 描述日常活动上限
+QUANTILES = (0.01, 0.05, 0.5, 0.95, 0.99)
+MARGIN = 5                # BPM，个人分布之外留出的余量
+MAX_WARNING = 130         # 个人警告阈值上限
+MAX_EMERGENCY = 160       # 个人紧急阈值上限
+MIN_BRADYCARDIA = 38      # 个人心动过缓阈值下限
+
+# (紧急, 警告, 心动过缓)
+Thresholds = Tuple[float, float, float]
+
+
+class BaselineTable:
+    """
+    个人阈值查找表：{用户: (各时段的 (紧急, 警告, 心动过缓))}。
+
+    指定 path 时每 RELOAD_INTERVAL 秒检查一次文件修改时间，批处理重新生成后自动换用新表。
+    """
+
+    def __init__(
+        self,
+        users: Dict[str, Tuple[Thresholds, ...]],
+        bucket_hours: int = BUCKET_HOURS,
+        utc_offset: float = 0,
+        path: Optional[str] = None,
+    ):
+        self.users = users
+        self.bucket_seconds = bucket_hours * 3600
+        self.utc_offset = utc_offset
+        self.path = path
+        self._mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+        self._next_check = time.monotonic() + RELOAD_INTERVAL
+
+    @classmethod
+    def load(cls, path: str) -> "BaselineTable":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        users = {
+            user: tuple(tuple(t) for t in entry["thresholds"])
+            for user, entry in data["users"].items()
+        }
+        return cls(users, data["bucket_hours"], data.get("utc_offset", 0), path)
+
+    def lookup(self, user: Optional[str], timestamp: Optional[float] = None) -> Optional[Thresholds]:
+        """用户在该时刻所属时段的 (紧急, 警告, 心动过缓) 阈值；没有该用户的基线时返回 None"""
+        if self.path is not None and time.monotonic() >= self._next_check:
+            self._maybe_reload()
+        buckets = self.users.get(user)
+        if buckets is None:
+            return None
+        t = time.time() if timestamp is None else timestamp
+        return buckets[int((t + self.utc_offset) % 86400 // self.bucket_seconds)]
+
+    def _maybe_reload(self):
+        self._next_check = time.monotonic() + RELOAD_INTERVAL
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return
+            fresh = BaselineTable.load(self.path)
+        except (OSError, ValueError, KeyError):
+            return  # 文件正在被替换或损坏时继续用旧表
+        self.users, self.bucket_seconds, self.utc_offset = fresh.users, fresh.bucket_seconds, fresh.utc_offset
+        self._mtime = mtime
+
+    def __len__(self):
+        return len(self.users)
+
+    def __getstate__(self):
+        # 回测时随策略发到子进程，不需要在子进程中重新加载
+        state = dict(self.__dict__)
+        state['path'] = None
+        return state
+
+
+_table: Optional[BaselineTable] = None
+_table_loaded = False
+_lock = threading.Lock()
+
+
+def get_baseline_table() -> Optional[BaselineTable]:
+    """进程内共享的基线表；BASELINE_PATH 不存在时返回 None（全部用户使用全局阈值）"""
+    global _table, _table_loaded
+    with _lock:
+        if not _table_loaded:
+            _table_loaded = True
+            if os.path.exists(BASELINE_PATH):
+                _table = BaselineTable.load(BASELINE_PATH)
+        return _table
+
+
+# ---------- 批处理 ----------
+
+def _group_quantiles(np, groups, values, n_groups: int, quantiles: Sequence[float]):
+    """
+    按组计算分位数（取不超过该位置的读数），整体一次排序，不按组循环。
+    返回 (每组读数数, n_groups x len(quantiles) 的分位数，无数据的组为 NaN)
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    result = np.full((n_groups, len(quantiles)), np.nan)
+    has = counts > 0
+    for j, q in enumerate(quantiles):
+        result[has, j] = sorted_values[starts[has] + np.floor(q * (counts[has] - 1)).astype(np.int64)]
+    return counts, result
+
+
+def compute_baselines(
+    devices: Dict[str, List[Tuple[float, float, bool]]],
+    bucket_hours: int = BUCKET_HOURS,
+    utc_offset: Optional[float] = None,
+    min_samples: int = MIN_SAMPLES,
+    emergency: float = 120,
+    warning: float = 100,
+    bradycardia: float = 50,
+) -> Dict:
+    """
+    由按设备分组的 (时间戳, 心率, 是否标注异常) 读数计算基线，返回可写入 JSON 的字典。
+    标注为异常的读数不计入基线。
+    """
+    import numpy as np
+
+    if utc_offset is None:
+        utc_offset = time.localtime().tm_gmtoff
+    n_buckets = 24 // bucket_hours
+    users = [user for user, readings in devices.items() if readings]
+    if not users:
+        return {"generated_at": datetime.now().isoformat(), "bucket_hours": bucket_hours,
+                "utc_offset": utc_offset, "users": {}}
+
+    arrays = [np.asarray(devices[user], dtype=np.float64).reshape(-1, 3) for user in users]
+    user_index = np.repeat(np.arange(len(users)), [len(a) for a in arrays])
+    data = np.concatenate(arrays)
+    keep = data[:, 2] == 0
+    user_index, timestamps, rates = user_index[keep], data[keep, 0], data[keep, 1]
+    bucket = ((timestamps + utc_offset) % 86400 // (bucket_hours * 3600)).astype(np.int64)
+
+    # 每个 (用户, 时段) 一组，另外每个用户一组全天统计
+    bucket_counts, bucket_q = _group_quantiles(np, user_index * n_buckets + bucket, rates, len(users) * n_buckets, QUANTILES)
+    day_counts, day_q = _group_quantiles(np, user_index, rates, len(users), QUANTILES)
+    bucket_counts = bucket_counts.reshape(len(users), n_buckets)
+    bucket_q = bucket_q.reshape(len(users), n_buckets, len(QUANTILES))
+    sparse = bucket_counts < min_samples
+    stats = np.where(sparse[..., None], day_q[:, None, :], bucket_q)
+
+    p01, p95, p99 = stats[..., 0], stats[..., 3], stats[..., 4]
+    warn = np.clip(p95 + MARGIN, warning, max(warning, MAX_WARNING))
+    emerg = np.clip(np.maximum(p99 + MARGIN, warn + 10), emergency, max(emergency, MAX_EMERGENCY))
+    brady = np.clip(p01 - MARGIN, min(bradycardia, MIN_BRADYCARDIA), bradycardia)
+    thresholds = np.round(np.stack([emerg, warn, brady], axis=-1), 1)
+
+    result = {}
+    for i, user in enumerate(users):
+        if day_counts[i] < min_samples:
+            continue  # 历史太少，使用全局阈值
+        result[user] = {
+            "samples": int(day_counts[i]),
+            "thresholds": thresholds[i].tolist(),
+            "stats": np.round(stats[i], 1).tolist(),
+            "bucket_samples": bucket_counts[i].tolist(),
+        }
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "bucket_hours": bucket_hours,
+        "utc_offset": utc_offset,
+        "quantiles": list(QUANTILES),
+        "defaults": {"emergency": emergency, "warning": warning, "bradycardia": bradycardia},
+        "users": result,
+    }
+
+
+def save_baselines(baselines: Dict, path: str):
+    """先写临时文件再替换，监控进程不会读到写了一半的文件"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def main(argv=None):
+    from alert_backtest import input_files, load_readings, synthesize
+
+    parser = argparse.ArgumentParser(description="计算个人心率基线和阈值")
+    parser.add_argument("inputs", nargs="*", help="读数文件或目录（格式同 alert_backtest.py）")
+    parser.add_argument("--out", default=BASELINE_PATH)
+    parser.add_argument("--bucket-hours", type=int, default=BUCKET_HOURS, choices=[1, 2, 3, 4, 6, 8, 12, 24])
+    parser.add_argument("--min-samples", type=int, default=MIN_SAMPLES)
+    parser.add_argument("--emergency", type=float, default=120, help="全局紧急阈值，个人阈值不低于它")
+    parser.add_argument("--warning", type=float, default=100, help="全局警告阈值，个人阈值不低于它")
+    parser.add_argument("--bradycardia", type=float, default=50, help="全局心动过缓阈值，个人阈值不高于它")
+    parser.add_argument("--synthetic", type=int, default=0, help="不读文件，用该数量设备的合成数据")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        devices = synthesize(args.synthetic, args.days, seed=args.seed)
+    else:
+        files = input_files(args.inputs)
+        if not files:
+            parser.error("需要读数文件或 --synthetic")
+        devices = {}
+        for path in files:
+            for user, readings in load_readings(path).items():
+                devices.setdefault(user, []).extend(readings)
+
+    started = time.perf_counter()
+    baselines = compute_baselines(
+        devices, args.bucket_hours, min_samples=args.min_samples,
+        emergency=args.emergency, warning=args.warning, bradycardia=args.bradycardia,
+    )
+    elapsed = time.perf_counter() - started
+    save_baselines(baselines, args.out)
+    readings = sum(len(r) for r in devices.values())
+    print(f"{len(baselines['users'])}/{len(devices)} 个用户生成了个人基线，"
+          f"{readings} 条读数用时 {elapsed:.2f}s: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
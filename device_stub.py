@@ -0,0 +1,229 @@
+# 本地模拟心率设备：同时提供 HTTP 轮询、SSE 和 WebSocket 三种接口，用于测试设备传输层和监控程序
+#
+# 用法:
+#   python device_stub.py --port 8080 --rate 2
+#   python motion_guard.py 指向 http://127.0.0.1:8080 即可；多设备时路径为 /devices/<id>/heart-rate
+#
+# 控制接口（POST /control 或 /devices/<id>/control，JSON）:
+#   {"target": 130, "duration": 20}   心率在 duration 秒内升到 target 后回落
+#   {"disconnect": true}              断开所有推送连接（测试重连和续传）
+#   {"drop_every": 5}                 每5个样本丢一个（测试缺口检测）
+#   {"restart": true}                 模拟设备重启：序号从0开始、清空缓冲区并断开推送连接
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from aiohttp import WSMsgType, web
+
+KEEPALIVE_SECONDS = 10
+
+
+class SimulatedDevice:
+    """按固定频率产生带递增序号的心率样本，保留最近的样本供断线续传"""
+
+    def __init__(self, device_id: str, rate: float = 1.0, baseline: float = 75, noise: float = 1.5, buffer: int = 600):
+        self.device_id = device_id
+        self.rate = rate
+        self.baseline = baseline
+        self.noise = noise
+        self.heart_rate = baseline
+        self.seq = 0
+        self.drop_every = 0
+        self.samples: deque = deque(maxlen=buffer)
+        self.subscribers: List[asyncio.Queue] = []
+        self._target: Optional[float] = None
+        self._target_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_running(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def set_target(self, target: float, duration: float):
+        self._target = target
+        self._target_until = time.time() + duration
+
+    def disconnect_all(self):
+        for queue in list(self.subscribers):
+            queue.put_nowait(None)
+
+    def restart(self):
+        self.seq = 0
+        self.samples.clear()
+        self.disconnect_all()
+
+    def latest(self) -> Dict[str, Any]:
+        return self.samples[-1] if self.samples else self._sample()
+
+    def since(self, seq: int) -> List[Dict[str, Any]]:
+        return [s for s in self.samples if s['seq'] > seq]
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def _sample(self) -> Dict[str, Any]:
+        status = "normal"
+        if self.heart_rate >= 120 or self.heart_rate < 50:
+            status = "abnormal"
+        elif self.heart_rate >= 100:
+            status = "elevated"
+        return {
+            'device_id': self.device_id,
+            'seq': self.seq,
+            'current_heart_rate': round(self.heart_rate, 1),
+            'status': status,
+            'timestamp': datetime.now().isoformat(),
+        }
+
+    def _step(self):
+        target = self.baseline
+        if self._target is not None:
+            if time.time() < self._target_until:
+                target = self._target
+            else:
+                self._target = None
+        # 向目标值回归的随机游走
+        self.heart_rate += (target - self.heart_rate) * 0.2 + random.gauss(0, self.noise)
+        self.seq += 1
+
+    async def _run(self):
+        while True:
+            self._step()
+            if self.drop_every and self.seq % self.drop_every == 0:
+                await asyncio.sleep(1 / self.rate)
+                continue
+            sample = self._sample()
+            self.samples.append(sample)
+            for queue in list(self.subscribers):
+                if not queue.full():
+                    queue.put_nowait(sample)
+            await asyncio.sleep(1 / self.rate)
+
+
+class DeviceStubServer:
+    def __init__(self, rate: float = 1.0, baseline: float = 75):
+        self.rate = rate
+        self.baseline = baseline
+        self.devices: Dict[str, SimulatedDevice] = {}
+
+    def device(self, request: web.Request) -> SimulatedDevice:
+        device_id = request.match_info.get("device_id", "0")
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.devices[device_id] = SimulatedDevice(device_id, self.rate, self.baseline)
+        device.ensure_running()
+        return device
+
+    async def heart_rate(self, request: web.Request) -> web.Response:
+        return web.json_response(self.device(request).latest())
+
+    async def stream(self, request: web.Request) -> web.StreamResponse:
+        """SSE：按 Last-Event-ID 补发缓冲区中的样本，之后实时推送"""
+        device = self.device(request)
+        queue = device.subscribe()
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await resp.prepare(request)
+        try:
+            last = request.headers.get("Last-Event-ID")
+            backlog = device.since(int(last)) if last and last.isdigit() else []
+            for sample in backlog:
+                await resp.write(self._sse(sample))
+            sent = backlog[-1]['seq'] if backlog else -1
+            while True:
+                try:
+                    sample = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    await resp.write(b": keepalive\n\n")
+                    continue
+                if sample is None:
+                    break
+                if sample['seq'] > sent:
+                    await resp.write(self._sse(sample))
+        except ConnectionResetError:
+            pass
+        finally:
+            device.unsubscribe(queue)
+        return resp
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        device = self.device(request)
+        ws = web.WebSocketResponse(heartbeat=KEEPALIVE_SECONDS)
+        await ws.prepare(request)
+        queue = device.subscribe()
+        try:
+            last = request.query.get("last_seq")
+            backlog = device.since(int(last)) if last and last.isdigit() else []
+            for sample in backlog:
+                await ws.send_str(json.dumps(sample))
+            sent = backlog[-1]['seq'] if backlog else -1
+            reader = asyncio.ensure_future(ws.receive())
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, reader}, return_when=asyncio.FIRST_COMPLETED)
+                if reader in done:
+                    getter.cancel()
+                    if reader.result().type in (WSMsgType.CLOSE, WSMsgType.CLOSED, WSMsgType.ERROR):
+                        break
+                    reader = asyncio.ensure_future(ws.receive())
+                    continue
+                sample = getter.result()
+                if sample is None:
+                    break
+                if sample['seq'] > sent:
+                    await ws.send_str(json.dumps(sample))
+            reader.cancel()
+        finally:
+            device.unsubscribe(queue)
+            await ws.close()
+        return ws
+
+    async def control(self, request: web.Request) -> web.Response:
+        device = self.device(request)
+        body = await request.json()
+        if "target" in body:
+            device.set_target(float(body["target"]), float(body.get("duration", 30)))
+        if "drop_every" in body:
+            device.drop_every = int(body["drop_every"])
+        if body.get("restart"):
+            device.restart()
+        if body.get("disconnect"):
+            device.disconnect_all()
+        return web.json_response({"device_id": device.device_id, "seq": device.seq, "heart_rate": device.heart_rate})
+
+    @staticmethod
+    def _sse(sample: Dict[str, Any]) -> bytes:
+        return f"id: {sample['seq']}\ndata: {json.dumps(sample)}\n\n".encode("utf-8")
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        for prefix in ("", "/devices/{device_id}"):
+            app.router.add_get(f"{prefix}/heart-rate", self.heart_rate)
+            app.router.add_get(f"{prefix}/heart-rate/stream", self.stream)
+            app.router.add_get(f"{prefix}/heart-rate/ws", self.websocket)
+            app.router.add_post(f"{prefix}/control", self.control)
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟心率设备")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rate", type=float, default=1.0, help="每秒样本数")
+    parser.add_argument("--baseline", type=float, default=75)
+    args = parser.parse_args(argv)
+    web.run_app(DeviceStubServer(args.rate, args.baseline).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# 设备传输层：HTTP轮询（原有方式，作为兜底）和推送订阅（SSE / WebSocket）。
+# 推送模式下设备每产生一个样本就立即送达，断线自动重连并按序号续传，序号不连续时记录缺口
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import aiohttp
+
+import metrics
+
+logger = logging.getLogger("DeviceTransport")
+
+POLL_LATENCY = metrics.Histogram(
+    "device_poll_seconds", "Device heart-rate poll latency",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+FETCH_ERRORS = metrics.Counter("device_fetch_errors_total", "Failed device polls by reason", ["reason"])
+STREAM_RECONNECTS = metrics.Counter("device_stream_reconnects_total", "Push subscription reconnects", ["mode"])
+STREAM_MISSED = metrics.Counter("device_stream_missed_samples_total", "Samples lost in sequence gaps", ["mode"])
+STREAM_RESETS = metrics.Counter("device_stream_resets_total", "Device sequence restarts detected", ["mode"])
+STREAM_FALLBACKS = metrics.Counter("device_stream_fallbacks_total", "Push subscriptions given up in favour of polling", ["mode"])
+
+MODE_POLL = "poll"
+MODE_SSE = "sse"
+MODE_WEBSOCKET = "websocket"
+
+
+class TransportUnavailable(Exception):
+    """推送连接连续失败，调用方应回退到轮询"""
+
+
+def stamp(data: Dict[str, Any]) -> Dict[str, Any]:
+    """补充本地接收时间，与轮询得到的数据格式一致"""
+    data['received_timestamp'] = time.time()
+    data['local_timestamp'] = datetime.now().isoformat()
+    return data
+
+
+class PollingTransport:
+    """GET {base_url}/heart-rate，每次调用拉取一个样本"""
+
+    mode = MODE_POLL
+
+    def __init__(self, base_url: str, session: Callable[[], aiohttp.ClientSession]):
+        self.endpoint = f"{base_url}/heart-rate"
+        self.session = session
+
+    async def fetch(self) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            async with self.session().get(self.endpoint) as response:
+                if response.status == 200:
+                    data = stamp(await response.json())
+                    POLL_LATENCY.observe(time.perf_counter() - start)
+                    return data
+                FETCH_ERRORS.labels("http_status").inc()
+                logger.error(f"API响应错误: {response.status}")
+                return None
+        except asyncio.TimeoutError:
+            FETCH_ERRORS.labels("timeout").inc()
+            logger.error("设备请求超时")
+            return None
+        except aiohttp.ClientError as e:
+            FETCH_ERRORS.labels("network").inc()
+            logger.error(f"网络请求错误: {e}")
+            return None
+        except json.JSONDecodeError as e:
+            FETCH_ERRORS.labels("decode").inc()
+            logger.error(f"JSON解析错误: {e}")
+            return None
+
+
+class StreamingTransport:
+    """
+    推送订阅的公共部分：重连、续传和缺口检测。
+
+    子类实现 _stream(last_seq)，逐个产出设备样本（含递增的 seq）。
+    连接断开或超过 idle_timeout 秒没有数据时按指数退避重连，并带上最后收到的 seq；
+    连续 max_failures 次连不上时抛出 TransportUnavailable。
+    设备重启后 seq 从头开始：重连后的第一个样本小于 last_seq，或序号倒退超过 reset_threshold 时，
+    视为序号重置，按新序号继续，而不是把之后的样本都当作重复丢弃。
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        session: Callable[[], aiohttp.ClientSession],
+        idle_timeout: float = 15,
+        reconnect_delay: float = 0.5,
+        max_reconnect_delay: float = 10,
+        max_failures: int = 5,
+        reset_threshold: int = 100,
+        on_gap: Optional[Callable[[int, int], Any]] = None,
+    ):
+        self.base_url = base_url
+        self.session = session
+        self.idle_timeout = idle_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_failures = max_failures
+        self.reset_threshold = reset_threshold
+        self.on_gap = on_gap
+        self.last_seq: Optional[int] = None
+        self.gaps = 0
+        self.missed = 0
+        self.reconnects = 0
+        self.resets = 0
+        self._new_connection = False
+
+    async def samples(self) -> AsyncIterator[Dict[str, Any]]:
+        failures = 0
+        delay = self.reconnect_delay
+        while True:
+            received = False
+            self._new_connection = True
+            try:
+                async for data in self._with_idle_timeout(self._stream(self.last_seq)):
+                    received = True
+                    failures = 0
+                    delay = self.reconnect_delay
+                    if self._accept(data):
+                        yield stamp(data)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, ValueError) as e:
+                logger.warning(f"{self.mode} 订阅中断: {e}")
+            if not received:
+                failures += 1
+                if failures >= self.max_failures:
+                    STREAM_FALLBACKS.labels(self.mode).inc()
+                    raise TransportUnavailable(f"{self.mode} 连续 {failures} 次连接失败")
+            self.reconnects += 1
+            STREAM_RECONNECTS.labels(self.mode).inc()
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _with_idle_timeout(self, stream: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(iterator.__anext__(), self.idle_timeout)
+                except StopAsyncIteration:
+                    return
+                yield data
+        finally:
+            await iterator.aclose()
+
+    def _accept(self, data: Dict[str, Any]) -> bool:
+        """检查序号：重复的丢弃，跳号的记录缺口，设备重启导致的序号重置按新序号继续"""
+        seq = data.get('seq')
+        if seq is None:
+            return True
+        seq = int(seq)
+        new_connection, self._new_connection = self._new_connection, False
+        if self.last_seq is not None:
+            if seq < self.last_seq and (new_connection or self.last_seq - seq > self.reset_threshold):
+                self.resets += 1
+                STREAM_RESETS.labels(self.mode).inc()
+                logger.warning(f"设备序号重置: {self.last_seq} -> {seq}，按新序号继续")
+            elif seq <= self.last_seq:
+                return False
+            if seq > self.last_seq + 1:
+                self.gaps += 1
+                self.missed += seq - self.last_seq - 1
+                STREAM_MISSED.labels(self.mode).inc(seq - self.last_seq - 1)
+                logger.warning(f"样本缺口: {self.last_seq + 1} ~ {seq - 1}")
+                if self.on_gap is not None:
+                    self.on_gap(self.last_seq + 1, seq - 1)
+        self.last_seq = seq
+        return True
+
+    def _stream(self, last_seq: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class SSETransport(StreamingTransport):
+    """GET {base_url}/heart-rate/stream（text/event-stream），重连时发送 Last-Event-ID"""
+
+    mode = MODE_SSE
+
+    async def _stream(self, last_seq: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        headers = {"Accept": "text/event-stream"}
+        if last_seq is not None:
+            headers["Last-Event-ID"] = str(last_seq)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+        async with self.session().get(f"{self.base_url}/heart-rate/stream", headers=headers, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+            event_id, data_lines = None, []
+            async for raw in resp.content:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if not line:
+                    # 空行结束一个事件
+                    if data_lines:
+                        data = json.loads("\n".join(data_lines))
+                        if event_id is not None:
+                            data.setdefault('seq', int(event_id))
+                        yield data
+                    event_id, data_lines = None, []
+                elif line.startswith(":"):
+                    continue  # 心跳注释
+                elif line.startswith("id:"):
+                    event_id = line[3:].strip()
+                elif line.startswith("data:"):
+                    data_lines.append(line[5:].lstrip())
+
+
+class WebSocketTransport(StreamingTransport):
+    """{base_url}/heart-rate/ws，每条文本消息一个JSON样本；重连时以 ?last_seq= 续传"""
+
+    mode = MODE_WEBSOCKET
+
+    async def _stream(self, last_seq: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        url = f"{self.base_url}/heart-rate/ws"
+        if last_seq is not None:
+            url += f"?last_seq={last_seq}"
+        async with self.session().ws_connect(url, heartbeat=self.idle_timeout / 2) as ws:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    yield json.loads(msg.data)
+                elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+
+
+def make_transport(mode: str, base_url: str, session: Callable[[], aiohttp.ClientSession], **kwargs):
+    if mode == MODE_POLL:
+        return PollingTransport(base_url, session)
+    if mode == MODE_SSE:
+        return SSETransport(base_url, session, **kwargs)
+    if mode == MODE_WEBSOCKET:
+        return WebSocketTransport(base_url, session, **kwargs)
+    raise ValueError(f"未知的设备传输方式: {mode}")
@@ -1,29 +1,79 @@
+import asyncio
 import os
+import threading
+import time
+import uuid
 from datetime import datetime
-import json
 
-from openai import OpenAI
 from dotenv import load_dotenv
 
+import llm_resilience
+import metrics
+import session_log
+import session_store
+import summary_jobs
+import tracing
+
 # 从.env文件加载环境变量
 load_dotenv()
 
-# 初始化OpenAI客户端（假设使用DeepSeek API）
-# 请确保已设置环境变量 DEEPSEEK_API_KEY
-api_key = os.getenv("DEEPSEEK_API_KEY")
-if not api_key:
-    raise ValueError("DEEPSEEK_API_KEY environment variable is not set. Please set it in your .env file or environment.")
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"  # DeepSeek API地址
+
+# OpenAI客户端（假设使用DeepSeek API）在第一次咨询时才创建，
+# 导入本模块不需要API密钥，也不加载openai；429 重试由 llm_scheduler 统一处理，
+# 截止时间、对冲和降级由 llm_resilience 处理
+_client = None
+_async_client = None
+
+
+def _get_api_key():
+    # 请确保已设置环境变量 DEEPSEEK_API_KEY
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        raise ValueError("DEEPSEEK_API_KEY environment variable is not set. Please set it in your .env file or environment.")
+    return api_key
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=_get_api_key(), base_url=DEEPSEEK_BASE_URL, max_retries=0)
+    return _client
+
 
-client = OpenAI(
-    api_key=api_key,
-    base_url="https://api.deepseek.com"  # DeepSeek API地址
-)
+def get_async_client():
+    """异步客户端，供ASGI服务在事件循环内调用"""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=_get_api_key(), base_url=DEEPSEEK_BASE_URL, max_retries=0)
+    return _async_client
 
 class EmotionalConsultingSystem:
-    def __init__(self, user_info):
+    def __init__(self, user_info, log_dir=None, store=None, memory=None, summarizer=None):
+        # 有会话索引时从历史记录补全咨询次数和历次摘要；
+        # 启用记忆检索时历史摘要不再整体放进提示词，而是每轮按相关性检索
+        self.store = store
+        self.memory = memory
+        # 有后台摘要队列时，摘要不再阻塞对话轮次和会话结束
+        self.summarizer = summarizer
+        if store is not None:
+            user_info = store.seed_user_info(user_info, summaries=0 if memory is not None else 3)
+        user_info = dict(user_info)
+        self.past_summaries = user_info.pop('past_summaries', [])
         self.user_info = user_info
+        self.latest_summary = None
+        # 后台摘要线程只把上下文摘要放进队列，下一轮开始时由对话线程写入系统提示词
+        self._summary_lock = threading.Lock()
+        self._pending_summaries = []
+        self.session_id = uuid.uuid4().hex
         self.session_history = []
         self.session_start_time = datetime.now()
+        # 会话日志在第一轮对话时创建，每轮追加一行
+        self.log_dir = log_dir or session_log.LOG_DIR
+        self._log_writer = None
+        self._saved_path = None
         
         self.consulting_framework = """
         情感咨询五步法：
@@ -58,6 +108,12 @@ class EmotionalConsultingSystem:
         - 保持对话的连续性和进展性
         - 适时总结咨询进展
         """
+        if self.past_summaries:
+            history = "\n".join(
+                f"        - {item.get('start_time', '')[:10]}（{item.get('topic') or '咨询'}）：{item['summary']}"
+                for item in self.past_summaries
+            )
+            self.system_prompt += f"\n        # 历次咨询摘要\n{history}\n"
         
         self.messages = [
             {"role": "system", "content": self.system_prompt}
@@ -72,40 +128,159 @@ class EmotionalConsultingSystem:
         notes_section = f"\n# 本次咨询重点记忆\n{notes}"
         self.messages[0]['content'] += notes_section
     
+    def _prompt_messages(self):
+        """发送给模型的消息：相关历史记忆作为临时系统消息插入，不写入 self.messages"""
+        user = session_store.user_key(self.user_info)
+        if self.memory is None or user is None or self.messages[-1]['role'] != 'user':
+            return self.messages
+        try:
+            section = self.memory.prompt_section(user, self.messages[-1]['content'])
+        except Exception as e:
+            print(f"检索历史记忆时出错: {e}")
+            return self.messages
+        if section is None:
+            return self.messages
+        return [self.messages[0], {"role": "system", "content": section}] + self.messages[1:]
+    
+    def _completion_kwargs(self, stream=False):
+        return dict(
+            model="deepseek-chat",
+            messages=self._prompt_messages(),
+            temperature=0.7,
+            max_tokens=2000,
+            stream=stream
+        )
+    
+    def _finish_turn(self, user_input, ai_response):
+        """记录一轮完整对话并管理上下文长度"""
+        self.messages.append({"role": "assistant", "content": ai_response})
+        
+        # 记录对话历史
+        turn = {
+            "timestamp": datetime.now().isoformat(),
+            "user": user_input,
+            "assistant": ai_response
+        }
+        self.session_history.append(turn)
+        try:
+            self.log_writer().append_turn(turn)
+        except (OSError, ValueError) as e:
+            print(f"写入会话日志时出错: {e}")
+        
+        # 管理上下文长度
+        self.manage_context()
+        return ai_response
+    
+    def _fail_turn(self, e):
+        error_msg = f"咨询系统暂时无法响应，请稍后再试。错误：{str(e)}"
+        self.messages.append({"role": "assistant", "content": error_msg})
+        return error_msg
+    
     def consult(self, user_input):
         """执行咨询对话"""
         
         # 添加用户输入
+        self._apply_pending_summaries()
         self.messages.append({"role": "user", "content": user_input})
         
+        with tracing.span("consult", session_id=self.session_id) as span:
+            try:
+                response = llm_resilience.complete(get_client(), "consult", **self._completion_kwargs())
+                return self._finish_turn(user_input, response.choices[0].message.content)
+            except Exception as e:
+                span.record_exception(e)
+                return self._fail_turn(e)
+    
+    async def aconsult(self, user_input):
+        """异步执行咨询对话，供运行在事件循环中的服务使用"""
+        self._apply_pending_summaries()
+        self.messages.append({"role": "user", "content": user_input})
+        
+        with tracing.span("consult", session_id=self.session_id) as span:
+            try:
+                response = await llm_resilience.acomplete(get_async_client(), "consult", **self._completion_kwargs())
+                return self._finish_turn(user_input, response.choices[0].message.content)
+            except Exception as e:
+                span.record_exception(e)
+                return self._fail_turn(e)
+    
+    def _discard_message(self, message):
+        """撤回本轮追加的消息：按对象查找，撤回时后续轮次可能已经追加了新消息"""
+        for i in range(len(self.messages) - 1, -1, -1):
+            if self.messages[i] is message:
+                del self.messages[i]
+                return
+    
+    def consult_stream(self, user_input, cancel_event=None):
+        """流式执行咨询对话，逐段产出回复文本；cancel_event 被设置时放弃本轮"""
+        self._apply_pending_summaries()
+        user_message = {"role": "user", "content": user_input}
+        self.messages.append(user_message)
+        parts = []
+        # 生成器跨 yield 执行，span 不设为当前上下文，手动结束
+        span = tracing.start_span("consult", session_id=self.session_id, stream=True)
+        started = time.perf_counter()
+        
         try:
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=self.messages,
-                temperature=0.7,
-                max_tokens=2000,
-                stream=False
-            )
-            
-            ai_response = response.choices[0].message.content
-            self.messages.append({"role": "assistant", "content": ai_response})
-            
-            # 记录对话历史
-            self.session_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "user": user_input,
-                "assistant": ai_response
-            })
-            
-            # 管理上下文长度
-            self.manage_context()
-            
-            return ai_response
-            
+            stream = llm_resilience.complete(get_client(), "consult", **self._completion_kwargs(stream=True))
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    stream.close()
+                    # 未完成的一轮不进入上下文和会话记录
+                    self._discard_message(user_message)
+                    span.set_attribute("cancelled", True)
+                    return
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        span.add_event("first_token")
+                        metrics.LLM_FIRST_TOKEN.labels("consult").observe(time.perf_counter() - started)
+                    parts.append(delta)
+                    yield delta
         except Exception as e:
-            error_msg = f"咨询系统暂时无法响应，请稍后再试。错误：{str(e)}"
-            self.messages.append({"role": "assistant", "content": error_msg})
-            return error_msg
+            span.record_exception(e)
+            metrics.LLM_ERRORS.labels("consult").inc()
+            yield self._fail_turn(e)
+            return
+        finally:
+            metrics.LLM_LATENCY.labels("consult").observe(time.perf_counter() - started)
+            span.end()
+        
+        self._finish_turn(user_input, "".join(parts))
+    
+    async def aconsult_stream(self, user_input):
+        """异步流式咨询对话；调用方取消时本轮不进入上下文"""
+        self._apply_pending_summaries()
+        user_message = {"role": "user", "content": user_input}
+        self.messages.append(user_message)
+        parts = []
+        span = tracing.start_span("consult", session_id=self.session_id, stream=True)
+        started = time.perf_counter()
+        
+        try:
+            stream = await llm_resilience.acomplete(get_async_client(), "consult", **self._completion_kwargs(stream=True))
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        span.add_event("first_token")
+                        metrics.LLM_FIRST_TOKEN.labels("consult").observe(time.perf_counter() - started)
+                    parts.append(delta)
+                    yield delta
+        except (asyncio.CancelledError, GeneratorExit):
+            self._discard_message(user_message)
+            span.set_attribute("cancelled", True)
+            raise
+        except Exception as e:
+            span.record_exception(e)
+            metrics.LLM_ERRORS.labels("consult").inc()
+            yield self._fail_turn(e)
+            return
+        finally:
+            metrics.LLM_LATENCY.labels("consult").observe(time.perf_counter() - started)
+            span.end()
+        
+        self._finish_turn(user_input, "".join(parts))
     
     def manage_context(self):
         """智能管理上下文，保留重要信息"""
@@ -127,60 +302,75 @@ class EmotionalConsultingSystem:
     
     def create_session_summary(self):
         """创建会话摘要以保持长期记忆"""
+        if self.summarizer is not None:
+            self.summarizer.submit(summary_jobs.KIND_CONTEXT, self.session_id, list(self.session_history), self._on_context_summary)
+            return
         try:
-            summary_prompt = {
-                "role": "user",
-                "content": "请用300字左右总结当前咨询会话的核心内容，包括用户的主要问题、情绪状态、重要事件和已讨论的解决方案。保持客观专业。"
-            }
-            
-            temp_messages = [self.messages[0], summary_prompt]
-            
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=temp_messages,
-                temperature=0.3,
-                max_tokens=500
-            )
-            
-            summary = response.choices[0].message.content
-            # 将摘要添加到系统提示词中
-            self.add_consulting_notes(f"\n会话摘要（{datetime.now().strftime('%H:%M')}）: {summary}")
-            
+            summary = summary_jobs.summarize(get_client(), summary_jobs.KIND_CONTEXT, summary_jobs.transcript(self.session_history), max_tokens=500)
+            self._on_context_summary(summary)
         except Exception as e:
             print(f"创建摘要时出错: {e}")
     
+    def _on_context_summary(self, summary):
+        # 可能在后台摘要线程中调用，此时对话线程可能正在读取 self.messages，只登记摘要
+        with self._summary_lock:
+            self._pending_summaries.append((datetime.now(), summary))
+        if self.summarizer is None:
+            self._apply_pending_summaries()
+    
+    def _apply_pending_summaries(self):
+        """在对话线程中把已完成的上下文摘要添加到系统提示词"""
+        with self._summary_lock:
+            pending, self._pending_summaries = self._pending_summaries, []
+        for finished_at, summary in pending:
+            self.latest_summary = summary
+            self.add_consulting_notes(f"\n会话摘要（{finished_at.strftime('%H:%M')}）: {summary}")
+    
     def get_session_progress(self):
-        """获取咨询进展摘要"""
-        summary_prompt = """
-        作为情感咨询师，请用专业且温暖的语言总结：
-        1. 当前咨询的主要进展和突破
-        2. 用户的核心情感问题和模式
-        3. 已经讨论的有效解决方案
-        4. 下一步的具体咨询建议和行动计划
-        
-        请以咨询报告的形式呈现，保持条理清晰。
         """
-        
-        return self.consult(summary_prompt)
+        获取咨询进展摘要。
+        有后台摘要队列时不调用LLM：返回最近一次上下文摘要或提示文字，
+        完整的咨询报告在会话保存后由后台生成，之后用 get_session_report() 从会话索引库读取。
+        """
+        if self.summarizer is not None:
+            self._apply_pending_summaries()
+            return self.latest_summary or "咨询报告正在后台生成，完成后会保存到会话记录中。"
+        try:
+            progress = summary_jobs.summarize(get_client(), summary_jobs.KIND_REPORT, summary_jobs.transcript(self.session_history))
+        except Exception as e:
+            return f"生成咨询总结时出错：{str(e)}"
+        self.latest_summary = progress
+        return progress
+    
+    def get_session_report(self):
+        """会话索引库中的咨询报告；后台报告尚未生成时返回 None"""
+        if self.store is None:
+            return None
+        return self.store.get_summary(self.session_id)
+    
+    def log_writer(self):
+        """当前会话的追加日志"""
+        if self._log_writer is None:
+            path = os.path.join(self.log_dir, session_log.session_basename(self.session_start_time, self.session_id) + ".jsonl")
+            self._log_writer = session_log.SessionLogWriter(path, self.session_id, self.user_info, self.session_start_time)
+        return self._log_writer
     
     def save_session_log(self, filename=None):
-        """保存会话日志到文件"""
-        if filename is None:
-            timestamp = self.session_start_time.strftime("%Y%m%d_%H%M%S")
-            filename = f"consulting_session_{timestamp}.json"
-        
-        session_data = {
-            "user_info": self.user_info,
-            "start_time": self.session_start_time.isoformat(),
-            "end_time": datetime.now().isoformat(),
-            "session_history": self.session_history,
-            "total_turns": len(self.session_history)
-        }
-        
+        """结束会话日志并压缩为完整的JSON文件"""
+        if self._saved_path is not None:
+            return f"会话已保存到: {self._saved_path}"
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(session_data, f, ensure_ascii=False, indent=2)
-            return f"会话已保存到: {filename}"
+            writer = self.log_writer()
+            writer.close()
+            self._saved_path = session_log.compact(writer.path, filename)
+            deferred = self.summarizer is not None and bool(self.session_history)
+            if self.store is not None:
+                # 后台生成报告时先不写摘要，报告完成后写入，get_session_report() 据此判断是否就绪
+                summary = None if deferred else self.latest_summary
+                self.store.add_session(session_log.read_session(self._saved_path), summary, self._saved_path)
+            if deferred:
+                self.summarizer.submit(summary_jobs.KIND_REPORT, self.session_id, list(self.session_history))
+            return f"会话已保存到: {self._saved_path}"
         except Exception as e:
             return f"保存会话时出错: {str(e)}"
 
@@ -0,0 +1,226 @@
+# 模拟大量心率设备：每个设备按脚本化的场景（静息、运动爬升、心动过速、心动过缓、掉线、慢响应）
+# 在 /devices/<id>/heart-rate 返回读数，用于监控程序的压力测试和告警检测延迟测量
+#
+# 用法:
+#   python fleet_sim.py --devices 2000 --port 8090
+#   python fleet_sim.py --devices 10000 --processes 4 --mix resting=0.7,tachycardia=0.2,slow=0.1
+#   curl localhost:8090/fleet          # 设备清单：场景和异常开始时间
+#
+# 读数是时间的确定函数（按 seed 和设备号生成参数），不需要每个设备一个后台任务；
+# --processes 多个进程共用端口（SO_REUSEPORT），各进程生成的设备参数完全一致
+import argparse
+import asyncio
+import multiprocessing as mp
+import random
+import signal
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+PROFILES = ("resting", "exercise", "tachycardia", "bradycardia", "dropout", "slow")
+DEFAULT_MIX = "resting=0.6,exercise=0.15,tachycardia=0.08,bradycardia=0.05,dropout=0.07,slow=0.05"
+# 有明确开始时间、监控应当告警的场景
+EVENT_PROFILES = ("tachycardia", "bradycardia")
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """解析 "resting=0.6,slow=0.1" 形式的场景比例"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in PROFILES:
+            raise ValueError(f"未知场景: {name}，可选 {', '.join(PROFILES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class FleetDevice:
+    """单个模拟设备：场景参数在创建时确定，读数随时间变化"""
+
+    def __init__(
+        self,
+        device_id: str,
+        profile: str,
+        rng: random.Random,
+        started_at: float,
+        onset_range=(10.0, 30.0),
+        event_duration: float = 60.0,
+        slow_delay: float = 0.5,
+    ):
+        self.device_id = device_id
+        self.profile = profile
+        self.started_at = started_at
+        self.baseline = rng.uniform(60, 80)
+        self.noise = rng.uniform(0.5, 2.0)
+        self.phase = rng.uniform(0, 240)  # 运动周期、掉线窗口的相位
+        self.onset_at: Optional[float] = None
+        self.event_end_at: Optional[float] = None
+        if profile in EVENT_PROFILES:
+            self.onset_at = started_at + rng.uniform(*onset_range)
+            self.event_end_at = self.onset_at + event_duration
+        self.event_level = rng.uniform(135, 160) if profile == "tachycardia" else rng.uniform(38, 45)
+        self.slow_delay = slow_delay
+        self.seq = 0
+        self._rng = rng
+
+    def heart_rate(self, now: float) -> float:
+        hr = self.baseline
+        if self.profile == "exercise":
+            # 240秒一个周期：爬升60秒到峰值，保持30秒，回落60秒，休息90秒
+            t = (now - self.started_at + self.phase) % 240
+            peak = self.baseline + 80
+            if t < 60:
+                hr = self.baseline + (peak - self.baseline) * t / 60
+            elif t < 90:
+                hr = peak
+            elif t < 150:
+                hr = peak - (peak - self.baseline) * (t - 90) / 60
+        elif self.onset_at is not None and self.onset_at <= now < self.event_end_at:
+            hr = self.event_level
+        return hr + self._rng.gauss(0, self.noise)
+
+    def offline(self, now: float) -> bool:
+        """dropout 场景：每30秒中有8秒不可用"""
+        return self.profile == "dropout" and (now - self.started_at + self.phase) % 30 < 8
+
+    def delay(self) -> float:
+        if self.profile != "slow":
+            return 0.0
+        # 大多数请求慢 slow_delay 左右，少数长尾
+        return self.slow_delay * (6 if self._rng.random() < 0.05 else self._rng.uniform(0.5, 1.5))
+
+    def sample(self, now: float) -> Dict[str, Any]:
+        self.seq += 1
+        hr = self.heart_rate(now)
+        status = "normal"
+        if hr >= 120 or hr < 50:
+            status = "abnormal"
+        elif hr >= 100:
+            status = "elevated"
+        return {
+            "device_id": self.device_id,
+            "seq": self.seq,
+            "current_heart_rate": round(hr, 1),
+            "status": status,
+            "profile": self.profile,
+            "timestamp": datetime.fromtimestamp(now).isoformat(),
+        }
+
+    def manifest(self) -> Dict[str, Any]:
+        return {
+            "device_id": self.device_id,
+            "profile": self.profile,
+            "onset_at": self.onset_at,
+            "event_end_at": self.event_end_at,
+        }
+
+
+class FleetSimulator:
+    def __init__(
+        self,
+        devices: int,
+        mix: Optional[Dict[str, float]] = None,
+        seed: int = 0,
+        started_at: Optional[float] = None,
+        **device_options,
+    ):
+        self.started_at = started_at or time.time()
+        mix = mix or parse_mix(DEFAULT_MIX)
+        names, weights = list(mix), list(mix.values())
+        self.devices: Dict[str, FleetDevice] = {}
+        for i in range(devices):
+            rng = random.Random(f"{seed}:{i}")
+            profile = rng.choices(names, weights)[0]
+            self.devices[str(i)] = FleetDevice(str(i), profile, rng, self.started_at, **device_options)
+        self.requests = 0
+        self.errors = 0
+
+    async def heart_rate(self, request: web.Request) -> web.Response:
+        device = self.devices.get(request.match_info["device_id"])
+        if device is None:
+            raise web.HTTPNotFound()
+        self.requests += 1
+        delay = device.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        now = time.time()
+        if device.offline(now):
+            self.errors += 1
+            return web.json_response({"error": "device offline"}, status=503)
+        return web.json_response(device.sample(now))
+
+    async def manifest(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "started_at": self.started_at,
+            "devices": [d.manifest() for d in self.devices.values()],
+        })
+
+    async def stats(self, request: web.Request) -> web.Response:
+        """本进程的请求计数（多进程时每次请求可能落到不同进程）"""
+        return web.json_response({"requests": self.requests, "errors": self.errors, "uptime": time.time() - self.started_at})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/devices/{device_id}/heart-rate", self.heart_rate)
+        app.router.add_get("/fleet", self.manifest)
+        app.router.add_get("/fleet/stats", self.stats)
+        return app
+
+
+def serve(args, started_at: float, reuse_port: bool):
+    simulator = FleetSimulator(
+        args.devices,
+        parse_mix(args.mix),
+        seed=args.seed,
+        started_at=started_at,
+        onset_range=(args.onset_min, args.onset_max),
+        event_duration=args.event_duration,
+        slow_delay=args.slow_delay,
+    )
+    web.run_app(
+        simulator.app(), host=args.host, port=args.port,
+        reuse_port=reuse_port or None, access_log=None, print=None,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟心率设备集群")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="场景比例，如 resting=0.6,tachycardia=0.2")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--processes", type=int, default=1, help="服务进程数（共用端口）")
+    parser.add_argument("--onset-min", type=float, default=10, help="异常最早在启动后几秒开始")
+    parser.add_argument("--onset-max", type=float, default=30)
+    parser.add_argument("--event-duration", type=float, default=60, help="心动过速/过缓持续秒数")
+    parser.add_argument("--slow-delay", type=float, default=0.5, help="slow 场景的典型响应延迟（秒）")
+    args = parser.parse_args(argv)
+
+    started_at = time.time()
+    print(f"模拟 {args.devices} 台设备: http://{args.host}:{args.port}/devices/<0..{args.devices - 1}>", flush=True)
+    if args.processes <= 1:
+        serve(args, started_at, reuse_port=False)
+        return
+    ctx = mp.get_context("spawn")
+    workers = [ctx.Process(target=serve, args=(args, started_at, True), daemon=True) for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    # 被 terminate 时也要停掉服务进程，否则它们会继续占用端口
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# 干预服务的ASGI版本：会话、MCP客户端和异步LLM客户端共用同一个事件循环，
+# 每个会话只占用一个协程，单个进程即可同时维持大量进行中的干预
+#
+# 启动:
+#   python intervention_asgi.py
+#   python intervention_asgi.py --port 5005 --workers 4      # 4个单工作进程实例，端口 5005~5008
+#   uvicorn intervention_asgi:app --host 0.0.0.0 --port 5005 --timeout-graceful-shutdown 30
+#
+# 会话只保存在进程内存中，每个进程单独监听一个端口，不能用 uvicorn --workers 共用端口：
+# 查询会话状态和发送消息的请求会落到不知道该会话的进程上（404）。
+# 多进程扩展时每个实例的会话ID以实例名开头（INTERVENTION_INSTANCE，如 w0-...），
+# 反向代理按路径中的会话ID前缀转发到对应实例，新会话轮流分配（配置示例见 README）。
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+import tracing
+from intervention_session import SessionManager, greeting_speech, mcp_triage
+from mcp_client_servers import DEFAULT_SERVER_PATHS, MCPClient
+from prewarm import Prewarmer, warm_user_context
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("LLMInterventionASGI")
+
+MAX_SESSIONS = int(os.environ.get("INTERVENTION_MAX_SESSIONS", "500"))
+SPEAK = os.environ.get("INTERVENTION_SPEAK", "0") == "1"
+INSTANCE = os.environ.get("INTERVENTION_INSTANCE", "")
+
+
+def create_consulting(user_info):
+    from emotional_consulting import EmotionalConsultingSystem
+    from session_memory import get_session_memory
+    from session_store import get_session_store
+    from summary_jobs import get_summary_queue
+    return EmotionalConsultingSystem(
+        user_info, store=get_session_store(), memory=get_session_memory(), summarizer=get_summary_queue()
+    )
+
+
+def audio_output():
+    from audio_output import get_audio_output
+    return get_audio_output(tts_params={"speed": 5, "top_k": 1, "refine_top_p": 0.1, "show_tqdm": False})
+
+
+def voice_callbacks():
+    """服务端默认不播放语音，INTERVENTION_SPEAK=1 时接入本机语音输出服务"""
+    if not SPEAK:
+        return None, None
+    output = audio_output()
+    return (lambda text, session_id: output.speak(text, session_id=session_id)), output.barge_in
+
+
+def create_prewarmer(mcp_client) -> Prewarmer:
+    """MCP服务器已在启动时连接，预热只刷新工具列表缓存；不播放语音时不预合成开场白"""
+
+    async def mcp_tools(alert_data):
+        await mcp_client.list_all_tools()
+
+    def llm_client(alert_data):
+        import emotional_consulting
+        emotional_consulting.get_async_client()
+
+    steps = {"mcp_tools": mcp_tools, "llm_client": llm_client, "user_context": warm_user_context}
+    prewarmer = Prewarmer(steps)
+    if SPEAK:
+        steps["greeting_audio"] = lambda alert_data: audio_output().prerender(greeting_speech(alert_data), prewarmer.ttl)
+    return prewarmer
+
+
+@asynccontextmanager
+async def lifespan(app):
+    mcp_client = MCPClient()
+    await mcp_client.connect_to_servers(DEFAULT_SERVER_PATHS)
+    speak, barge_in = voice_callbacks()
+    app.state.mcp_client = mcp_client
+    app.state.prewarmer = create_prewarmer(mcp_client)
+    app.state.sessions = SessionManager(
+        triage=mcp_triage(mcp_client),
+        consulting_factory=create_consulting,
+        speak=speak,
+        barge_in=barge_in,
+        loop=asyncio.get_running_loop(),
+        id_prefix=f"{INSTANCE}-" if INSTANCE else "",
+    )
+    logger.info(f"干预服务已启动 (pid={os.getpid()}, instance={INSTANCE or '-'})")
+    try:
+        yield
+    finally:
+        # 优雅关闭：保存所有进行中的会话，再断开MCP服务器
+        logger.info(f"正在关闭，结束 {app.state.sessions.active_count()} 个进行中的会话")
+        await app.state.sessions.end_all()
+        # 等待后台摘要写完再退出
+        from summary_jobs import get_summary_queue
+        await asyncio.get_running_loop().run_in_executor(None, get_summary_queue().shutdown, True, 30)
+        await mcp_client.cleanup()
+
+
+def session_payload(session, events):
+    return {
+        "session_id": session.id,
+        "job_id": session.id,
+        "state": session.state,
+        "events": events,
+        "result": session.result if session.ended else None,
+    }
+
+
+def not_found():
+    return JSONResponse({"error": "session not found"}, status_code=404)
+
+
+async def intervene(request: Request):
+    """开始一次干预会话并立即返回，后续通过 /sessions 或 SSE 交互"""
+    sessions = request.app.state.sessions
+    if sessions.active_count() >= MAX_SESSIONS:
+        return JSONResponse({"error": "too many active interventions"}, status_code=429)
+    alert_data = await request.json()
+    logger.info(f"收到干预请求: {alert_data}")
+    alert_data.setdefault("traceparent", request.headers.get("traceparent"))
+    with tracing.span("intervene", parent=tracing.parent_from(alert_data)) as span:
+        alert_data["traceparent"] = span.traceparent
+        session = sessions.create(alert_data)
+        events = await session.start()
+    payload = session_payload(session, events)
+    payload.update({
+        "incident_id": span.incident_id,
+        "status": "running",
+        "status_url": f"/intervene/{session.id}",
+        "events_url": f"/intervene/{session.id}/events",
+    })
+    return JSONResponse(payload, status_code=202)
+
+
+async def intervene_status(request: Request):
+    session = request.app.state.sessions.get(request.path_params["session_id"])
+    if session is None:
+        return not_found()
+    payload = session_payload(session, session.events)
+    payload["status"] = "completed" if session.ended else "running"
+    return JSONResponse(payload)
+
+
+async def intervene_events(request: Request):
+    """SSE：推送会话事件，会话结束后关闭连接"""
+    session = request.app.state.sessions.get(request.path_params["session_id"])
+    if session is None:
+        return not_found()
+
+    async def generate():
+        sent = 0
+        while True:
+            events = await session.wait_events(sent)
+            for event in events:
+                yield f"id: {sent}\nevent: {event['kind']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                sent += 1
+            if session.ended and sent >= len(session.events):
+                yield f"event: end\ndata: {json.dumps(session.result, ensure_ascii=False)}\n\n"
+                return
+            if not events:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+async def create_session(request: Request):
+    sessions = request.app.state.sessions
+    if sessions.active_count() >= MAX_SESSIONS:
+        return JSONResponse({"error": "too many active interventions"}, status_code=429)
+    session = sessions.create(await request.json())
+    return JSONResponse(session_payload(session, await session.start()), status_code=201)
+
+
+async def get_session(request: Request):
+    session = request.app.state.sessions.get(request.path_params["session_id"])
+    if session is None:
+        return not_found()
+    return JSONResponse(session_payload(session, session.events))
+
+
+async def send_session_message(request: Request):
+    """发送用户消息；?stream=1 时以SSE逐段推送疏导回复，最后推送完整事件"""
+    session = request.app.state.sessions.get(request.path_params["session_id"])
+    if session is None:
+        return not_found()
+    text = (await request.json()).get("text", "")
+    if request.query_params.get("stream") not in ("1", "true"):
+        return JSONResponse(session_payload(session, await session.send_message(text)))
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_turn():
+        try:
+            events = await session.send_message(text, on_delta=queue.put_nowait)
+            await queue.put(("done", session_payload(session, events)))
+        except Exception as e:
+            await queue.put(("error", {"error": str(e)}))
+
+    async def generate():
+        task = asyncio.create_task(run_turn())
+        try:
+            while True:
+                item = await queue.get()
+                if isinstance(item, str):
+                    yield f"event: delta\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+                    continue
+                kind, payload = item
+                yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                return
+        finally:
+            # 客户端断开时取消正在生成的回复
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+async def end_session(request: Request):
+    sessions = request.app.state.sessions
+    session = sessions.get(request.path_params["session_id"])
+    if session is None:
+        return not_found()
+    events = await session.end()
+    sessions.remove(session.id)
+    return JSONResponse(session_payload(session, events))
+
+
+async def health(request: Request):
+    return JSONResponse({
+        "status": "ok",
+        "pid": os.getpid(),
+        "instance": INSTANCE or None,
+        "active_sessions": request.app.state.sessions.active_count(),
+        "mcp_servers": list(request.app.state.mcp_client.sessions.keys()),
+    })
+
+
+async def warmup(request: Request):
+    """预热LLM客户端（MCP服务器已在启动时连接）"""
+    try:
+        import emotional_consulting
+        emotional_consulting.get_async_client()
+    except ValueError as e:
+        return JSONResponse({"ready": False, "error": str(e)}, status_code=503)
+    return JSONResponse({"ready": True, "mcp_servers": list(request.app.state.mcp_client.sessions.keys())})
+
+
+async def prewarm(request: Request):
+    """告警预热：立即返回，预热任务在事件循环中进行，同一设备 PREWARM_TTL 秒内只预热一次"""
+    alert_data = await request.json()
+    prewarmer = request.app.state.prewarmer
+    task = prewarmer.asubmit(alert_data)
+    return JSONResponse({"prewarming": task is not None, "ttl": prewarmer.ttl}, status_code=202)
+
+
+async def metrics_endpoint(request: Request):
+    return Response(metrics.REGISTRY.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+routes = [
+    Route("/intervene", intervene, methods=["POST"]),
+    Route("/intervene/{session_id}", intervene_status, methods=["GET"]),
+    Route("/intervene/{session_id}/events", intervene_events, methods=["GET"]),
+    Route("/sessions", create_session, methods=["POST"]),
+    Route("/sessions/{session_id}", get_session, methods=["GET"]),
+    Route("/sessions/{session_id}", end_session, methods=["DELETE"]),
+    Route("/sessions/{session_id}/messages", send_session_message, methods=["POST"]),
+    Route("/health", health, methods=["GET"]),
+    Route("/warmup", warmup, methods=["POST"]),
+    Route("/prewarm", prewarm, methods=["POST"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan)
+
+
+def run_instances(args) -> int:
+    """
+    启动 args.workers 个单工作进程实例，实例 i 监听 port + i、实例名 w<i>；
+    前面的反向代理按会话ID前缀转发，见 README。收到 SIGTERM 时转给所有实例并等待它们优雅关闭；
+    终端的 Ctrl-C 本身会发给整个进程组，这里不再重复转发（uvicorn 收到第二次 SIGINT 会立即退出）。
+    """
+    processes = []
+    for i in range(args.workers):
+        env = dict(os.environ, INTERVENTION_INSTANCE=f"w{i}")
+        command = [
+            sys.executable, os.path.abspath(__file__), "--host", args.host, "--port", str(args.port + i),
+            "--graceful-timeout", str(args.graceful_timeout),
+        ]
+        processes.append(subprocess.Popen(command, env=env))
+        logger.info(f"实例 w{i}: http://{args.host}:{args.port + i} (pid={processes[-1].pid})")
+
+    def forward(signum, frame):
+        for proc in processes:
+            if proc.poll() is None:
+                proc.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    return max(proc.wait() for proc in processes)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="干预服务（ASGI）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="大于1时启动多个单工作进程实例，分别监听 port ~ port+workers-1，需在前面按会话ID前缀路由")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="关闭时等待进行中请求的秒数")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers 至少为1")
+    if args.workers > 1:
+        sys.exit(run_instances(args))
+
+    uvicorn.run(
+        "intervention_asgi:app",
+        host=args.host,
+        port=args.port,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level="info",
+    )
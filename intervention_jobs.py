@@ -0,0 +1,205 @@
+# 干预任务管理：/intervene 立即返回任务ID，干预会话在有界线程池中执行，
+# 状态可通过轮询、SSE 或 webhook 回调获取
+#
+# 回调地址只能是 INTERVENTION_CALLBACK_URLS（逗号分隔的URL前缀）允许的地址：
+# 任务状态包含告警数据和对话结果，不能按请求方给出的任意地址从服务端发出
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import metrics
+
+logger = logging.getLogger("InterventionJobs")
+
+CALLBACK_URLS = [u.strip() for u in os.environ.get("INTERVENTION_CALLBACK_URLS", "").split(",") if u.strip()]
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+TERMINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+JOBS = metrics.Gauge("intervention_jobs", "Intervention jobs waiting or running", ["status"])
+JOBS_FINISHED = metrics.Counter("intervention_jobs_finished_total", "Finished intervention jobs", ["status"])
+JOBS_REJECTED = metrics.Counter("intervention_jobs_rejected_total", "Interventions rejected because the queue was full")
+JOB_QUEUE_WAIT = metrics.Histogram("intervention_job_queue_seconds", "Time intervention jobs wait for a worker")
+JOB_DURATION = metrics.Histogram(
+    "intervention_job_seconds", "Intervention session duration",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+
+
+class QueueFullError(Exception):
+    """排队中的干预任务已达上限"""
+
+
+def callback_allowed(url: str, allowed: Sequence[str]) -> bool:
+    """url 的协议和主机端口与某个允许的前缀完全相同，且路径在该前缀之下"""
+    target = urlsplit(url)
+    if ".." in target.path.split("/"):
+        return False
+    for prefix in allowed:
+        base = urlsplit(prefix)
+        path = base.path.rstrip("/")
+        if (target.scheme, target.netloc) == (base.scheme, base.netloc) and (
+            target.path == path or target.path.startswith(path + "/")
+        ):
+            return True
+    return False
+
+
+class InterventionJob:
+    def __init__(self, alert_data: Dict[str, Any], callback_url: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.alert_data = alert_data
+        self.callback_url = callback_url
+        self.status = STATUS_QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # 状态变化事件，供SSE按序号增量读取
+        self.events: List[Dict[str, Any]] = []
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class InterventionJobManager:
+    """
+    有界的干预任务执行器。
+
+    runner(alert_data) 在工作线程中运行一次完整的干预会话并返回结果字典。
+    同时运行的会话数不超过 max_workers，排队数不超过 max_pending，超出时 submit 抛出 QueueFullError。
+    告警中的 callback_url 不在 callback_urls 允许范围内时忽略（默认不允许任何回调）。
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Dict[str, Any]], Dict[str, Any]],
+        max_workers: int = 4,
+        max_pending: int = 16,
+        retention: float = 3600,
+        callback_timeout: float = 10,
+        callback_urls: Optional[Sequence[str]] = None,
+    ):
+        self.runner = runner
+        self.callback_urls = list(CALLBACK_URLS if callback_urls is None else callback_urls)
+        self.max_pending = max_pending
+        self.retention = retention
+        self.callback_timeout = callback_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="intervention")
+        # 回调单线程按序发送，不占用请求线程和会话线程
+        self._callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intervention-callback")
+        self.jobs: Dict[str, InterventionJob] = {}
+        self._cond = threading.Condition()
+
+    def submit(self, alert_data: Dict[str, Any]) -> InterventionJob:
+        with self._cond:
+            self._prune_locked()
+            queued = sum(1 for job in self.jobs.values() if job.status == STATUS_QUEUED)
+            if queued >= self.max_pending:
+                JOBS_REJECTED.inc()
+                raise QueueFullError(f"已有 {queued} 个干预任务在排队")
+            job = InterventionJob(alert_data, self._callback_url(alert_data))
+            self.jobs[job.id] = job
+            self._set_status_locked(job, STATUS_QUEUED)
+        self._notify_callback(job)
+        self.executor.submit(self._run, job)
+        return job
+
+    def _callback_url(self, alert_data: Dict[str, Any]) -> Optional[str]:
+        url = alert_data.pop("callback_url", None)
+        if not url:
+            return None
+        if not isinstance(url, str) or not callback_allowed(url, self.callback_urls):
+            logger.warning(f"忽略不在 INTERVENTION_CALLBACK_URLS 中的回调地址: {url}")
+            return None
+        return url
+
+    def get(self, job_id: str) -> Optional[InterventionJob]:
+        with self._cond:
+            return self.jobs.get(job_id)
+
+    def active_count(self) -> int:
+        with self._cond:
+            return sum(1 for job in self.jobs.values() if job.status == STATUS_RUNNING)
+
+    def wait_events(self, job: InterventionJob, after: int, timeout: float = 15) -> List[Dict[str, Any]]:
+        """阻塞直到任务产生第 after 条之后的事件或超时，返回新事件"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(job.events) > after or job.done, timeout=timeout)
+            return job.events[after:]
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        self._callback_executor.shutdown(wait=wait)
+
+    def _run(self, job: InterventionJob):
+        with self._cond:
+            job.started_at = time.time()
+            self._set_status_locked(job, STATUS_RUNNING)
+        self._notify_callback(job)
+        try:
+            result = self.runner(job.alert_data)
+            with self._cond:
+                job.result = result
+                job.finished_at = time.time()
+                self._set_status_locked(job, STATUS_COMPLETED)
+        except Exception as e:
+            logger.exception(f"干预任务 {job.id} 失败")
+            with self._cond:
+                job.error = str(e)
+                job.finished_at = time.time()
+                self._set_status_locked(job, STATUS_FAILED)
+        self._notify_callback(job)
+
+    def _set_status_locked(self, job: InterventionJob, status: str):
+        if job.events:
+            JOBS.labels(job.status).dec()
+        if status in TERMINAL_STATUSES:
+            JOBS_FINISHED.labels(status).inc()
+            JOB_DURATION.observe(job.finished_at - job.started_at)
+        else:
+            JOBS.labels(status).inc()
+        if status == STATUS_RUNNING:
+            JOB_QUEUE_WAIT.observe(job.started_at - job.created_at)
+        job.status = status
+        job.events.append({"seq": len(job.events), "status": status, "time": time.time()})
+        self._cond.notify_all()
+
+    def _prune_locked(self):
+        """清理超过保留时间的已结束任务"""
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self.jobs.values() if j.done and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _notify_callback(self, job: InterventionJob):
+        if job.callback_url:
+            self._callback_executor.submit(self._post_callback, job.callback_url, job.to_dict())
+
+    def _post_callback(self, url: str, payload: Dict[str, Any]):
+        import requests
+
+        try:
+            requests.post(url, json=payload, timeout=self.callback_timeout)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"回调 {url} 失败: {e}")
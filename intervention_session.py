@@ -0,0 +1,443 @@
+# 与界面无关的干预会话引擎：状态机驱动 “分诊 → 心理疏导 → 结束” 流程，
+# Tk、Web、命令行前端都只负责把用户输入交给会话并渲染返回的事件
+import asyncio
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import metrics
+import tracing
+
+STATE_NEW = "new"
+STATE_TRIAGE = "triage"
+STATE_COUNSELLING = "counselling"
+STATE_ENDED = "ended"
+
+END_WORDS = ("结束", "终止")
+
+TOOL_EMAIL = "email_sender__send_fixed_email"
+TOOL_COUNSELLING = "email_sender__psychological_counseling_decision"
+
+SESSIONS_STARTED = metrics.Counter("intervention_sessions_total", "Intervention sessions started")
+SESSIONS_ACTIVE = metrics.Gauge("intervention_sessions_active", "Intervention sessions not yet ended")
+_managers = weakref.WeakSet()
+SESSIONS_ACTIVE.set_function(lambda: sum(m.active_count() for m in list(_managers)))
+
+
+def make_event(role: str, text: str, kind: str = "message") -> Dict[str, str]:
+    """
+    会话事件。role: assistant（情感助手）/ counsellor（李老师）/ user / system；
+    kind: message / notice / debug / summary
+    """
+    return {"role": role, "kind": kind, "text": text}
+
+
+def has_end_word(*texts: str) -> bool:
+    return any(word in text for text in texts for word in END_WORDS)
+
+
+def alert_user_id(alert_data: Dict[str, Any]) -> Optional[str]:
+    """
+    告警对应的稳定用户标识：告警中的 user_id，没有时用设备ID（device:<id>）。
+    都没有时返回 None，该会话不读取也不合并任何历史记录。
+    """
+    if alert_data.get('user_id'):
+        return str(alert_data['user_id'])
+    device_id = alert_data.get('device_id') or (alert_data.get('raw_data') or {}).get('device_id')
+    return f"device:{device_id}" if device_id else None
+
+
+def initial_message(alert_data: Dict[str, Any]) -> str:
+    return "您好，我注意到您的心率异常（{}），请问您现在感觉如何？".format(alert_data.get('heart_rate', '未知'))
+
+
+def greeting_speech(alert_data: Dict[str, Any]) -> str:
+    """开场白的语音版本，不含心率数值：告警预热时提前合成的音频在升级为紧急干预后仍然适用"""
+    name = alert_data.get('user_name')
+    return "{}您好，我注意到您的心率有些异常，请问您现在感觉如何？".format(f"{name}，" if name else "")
+
+
+class InterventionSession:
+    """
+    一次干预会话的状态机。
+
+    triage(user_input, alert_data) 为异步调用，返回 MCPClient.process_query 的结果字典；
+    consulting_factory(user_info) 创建 EmotionalConsultingSystem；
+    speak / barge_in 可选，用于语音输出，无语音的服务端部署可不传。
+    阻塞的咨询调用在线程池 executor 中执行（不传时用事件循环的默认线程池），不占用事件循环。
+    """
+
+    def __init__(
+        self,
+        alert_data: Dict[str, Any],
+        triage: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        consulting_factory: Callable[[Dict[str, Any]], Any],
+        speak: Optional[Callable[[str, str], Any]] = None,
+        barge_in: Optional[Callable[[str], Any]] = None,
+        session_id: Optional[str] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self.id = session_id or uuid.uuid4().hex
+        self.executor = executor
+        self.alert_data = alert_data
+        self.triage = triage
+        self.consulting_factory = consulting_factory
+        self.speak = speak
+        self.barge_in = barge_in
+
+        self.state = STATE_NEW
+        self.consulting = None
+        self.events: List[Dict[str, str]] = []
+        self.result: Dict[str, Any] = {}
+        self.last_activity = time.time()
+        # 告警方传来的 traceparent / incident_id，会话各轮次都挂在这条 trace 下
+        self.trace_parent = tracing.parent_from(alert_data)
+        # 同一会话的消息按顺序处理（锁在事件循环中首次使用时创建）
+        self._lock: Optional[asyncio.Lock] = None
+        # 有新事件时唤醒等待者（SSE推送）
+        self._waiters: List[asyncio.Future] = []
+
+    @property
+    def ended(self) -> bool:
+        return self.state == STATE_ENDED
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _emit(self, out: List[Dict[str, str]], role: str, text: str, kind: str = "message"):
+        event = make_event(role, text, kind)
+        self.events.append(event)
+        out.append(event)
+        self.last_activity = time.time()
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_events(self, after: int, timeout: float = 15) -> List[Dict[str, str]]:
+        """等待第 after 条之后的新事件（会话结束或超时时可能返回空列表）"""
+        if len(self.events) <= after and not self.ended:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.events[after:]
+
+    async def start(self) -> List[Dict[str, str]]:
+        """开始会话，返回开场白"""
+        out: List[Dict[str, str]] = []
+        if self.state != STATE_NEW:
+            return out
+        self.state = STATE_TRIAGE
+        with tracing.span("intervention.start", parent=self.trace_parent, session_id=self.id):
+            self._emit(out, "assistant", initial_message(self.alert_data))
+            if self.speak:
+                self.speak(greeting_speech(self.alert_data), self.id)
+        return out
+
+    async def send_message(self, text: str, on_delta: Optional[Callable[[str], Any]] = None) -> List[Dict[str, str]]:
+        """
+        处理一条用户输入，返回本轮产生的事件。
+        on_delta 可选：疏导阶段回复以流式生成，每段文本到达时在工作线程中回调。
+        取消该协程会中止正在生成的回复。
+        """
+        text = text.strip()
+        async with self.lock:
+            out: List[Dict[str, str]] = []
+            if not text or self.ended:
+                return out
+            if self.state == STATE_NEW:
+                out.extend(await self.start())
+            if self.barge_in:
+                self.barge_in(self.id)
+            self._emit(out, "user", text)
+            with tracing.span("intervention.turn", parent=self.trace_parent, session_id=self.id, state=self.state):
+                if self.state == STATE_TRIAGE:
+                    await self._triage_turn(text, out)
+                elif self.state == STATE_COUNSELLING:
+                    await self._counselling_turn(text, out, on_delta)
+            return out
+
+    async def end(self) -> List[Dict[str, str]]:
+        """用户主动结束会话"""
+        async with self.lock:
+            out: List[Dict[str, str]] = []
+            if self.ended:
+                return out
+            if self.state == STATE_COUNSELLING and self.consulting is not None:
+                with tracing.span("intervention.end", parent=self.trace_parent, session_id=self.id):
+                    save_result = await self._run_blocking(self.consulting.save_session_log)
+                self._emit(out, "system", f"【会话记录】: {save_result}", "summary")
+            self.result.setdefault('user_input', None)
+            self.state = STATE_ENDED
+            self._wake_waiters()
+            if self.barge_in:
+                self.barge_in(self.id)
+            return out
+
+    async def _run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, tracing.wrap(func), *args)
+
+    async def _triage_turn(self, text: str, out: List[Dict[str, str]]):
+        ai_dict = await self.triage(text, self.alert_data)
+        if isinstance(ai_dict, str):
+            # 未连接MCP服务器等情况下只返回提示文本
+            ai_dict = {"result_str": ai_dict, "tool_results": []}
+        ai_response = ai_dict['result_str']
+        self._emit(out, "assistant", ai_response)
+        self._emit(out, "system", f"完整数据反馈: {ai_dict}", "debug")
+        for tool_res in ai_dict.get('tool_results') or []:
+            if tool_res['tool_name'] == TOOL_EMAIL:
+                self._emit(out, "system", f"（系统已尝试发送邮件，结果：{tool_res['result']}）", "notice")
+            elif tool_res['tool_name'] == TOOL_COUNSELLING:
+                self._emit(out, "system", f"（系统心理疏导建议：{tool_res['result']}）", "notice")
+                await self._start_counselling(out)
+        if has_end_word(ai_response):
+            self.result['user_input'] = text
+            self.result['ai_response'] = ai_response
+            self.state = STATE_ENDED
+
+    async def _start_counselling(self, out: List[Dict[str, str]]):
+        if self.consulting is not None:
+            return
+        user_info = {
+            'name': self.alert_data.get('user_name', '用户'),
+            'age': self.alert_data.get('user_age', '未提供'),
+            'topic': '心理疏导',
+            'session_count': 1
+        }
+        user_id = alert_user_id(self.alert_data)
+        if user_id:
+            user_info['user_id'] = user_id
+        self.consulting = await self._run_blocking(self.consulting_factory, user_info)
+        # 咨询报告在后台生成后写入会话索引库，以此ID读取（python session_store.py report <id>）
+        self.result['consulting_session_id'] = getattr(self.consulting, 'session_id', None)
+        self.state = STATE_COUNSELLING
+        self._emit(out, "system", "【心理疏导对话已开启，您可以与李老师交流，输入'结束'或'终止'可随时退出】", "notice")
+
+    async def _counselling_turn(self, text: str, out: List[Dict[str, str]], on_delta=None):
+        if on_delta is None:
+            if hasattr(self.consulting, "aconsult"):
+                reply = await self.consulting.aconsult(text)
+            else:
+                reply = await self._run_blocking(self.consulting.consult, text)
+        else:
+            reply = await self._stream_reply(text, on_delta, out)
+            if reply is None:
+                return
+        self._emit(out, "counsellor", reply)
+        if self.speak:
+            self.speak(reply, self.id)
+        if has_end_word(text, reply):
+            await self._finish_counselling(text, reply, out)
+
+    async def _stream_reply(self, text: str, on_delta, out: List[Dict[str, str]]) -> Optional[str]:
+        if hasattr(self.consulting, "aconsult_stream"):
+            # 原生异步流式接口，取消直接作用于协程
+            parts = []
+            try:
+                async for delta in self.consulting.aconsult_stream(text):
+                    parts.append(delta)
+                    on_delta(delta)
+            except asyncio.CancelledError:
+                self._emit(out, "system", "（已取消本次回复）", "notice")
+                raise
+            return "".join(parts)
+
+        cancel_event = threading.Event()
+
+        def run():
+            parts = []
+            for delta in self.consulting.consult_stream(text, cancel_event):
+                parts.append(delta)
+                on_delta(delta)
+            return None if cancel_event.is_set() else "".join(parts)
+
+        try:
+            return await self._run_blocking(run)
+        except asyncio.CancelledError:
+            # 通知工作线程停止读取流，本轮回复作废
+            cancel_event.set()
+            self._emit(out, "system", "（已取消本次回复）", "notice")
+            raise
+
+    async def _finish_counselling(self, text: str, reply: str, out: List[Dict[str, str]]):
+        self._emit(out, "system", "【心理疏导对话已结束】", "notice")
+        progress = await self._run_blocking(self.consulting.get_session_progress)
+        if progress is not None:
+            self._emit(out, "system", f"【咨询总结】: {progress}", "summary")
+        save_result = await self._run_blocking(self.consulting.save_session_log)
+        self._emit(out, "system", f"【会话记录】: {save_result}", "summary")
+        self.result['user_input'] = text
+        self.result['ai_response'] = reply
+        self.result['counselling'] = True
+        self.state = STATE_ENDED
+
+
+class SessionManager:
+    """
+    管理多个并发会话，所有会话共享一个后台事件循环。
+
+    异步调用方直接 await 会话方法；同步前端（Tk、Flask）通过 submit 拿到 concurrent.futures.Future。
+    """
+
+    def __init__(self, triage, consulting_factory, speak=None, barge_in=None, max_workers: int = 8,
+                 loop: Optional[asyncio.AbstractEventLoop] = None, retention: float = 3600, id_prefix: str = ""):
+        self.triage = triage
+        # 多个服务进程并列部署时，会话ID以进程的实例名开头，反向代理据此把请求路由回创建会话的进程
+        self.id_prefix = id_prefix
+        self.retention = retention
+        self.consulting_factory = consulting_factory
+        self.speak = speak
+        self.barge_in = barge_in
+        self.sessions: Dict[str, InterventionSession] = {}
+        self._lock = threading.Lock()
+        # 传入 loop 时与调用方（如ASGI服务）共用事件循环，否则自建后台循环
+        self.loop = loop or asyncio.new_event_loop()
+        # 阻塞的LLM调用都在这个线程池中执行，事件循环和界面线程不会被占用；
+        # 共用调用方的事件循环时不替换它的默认线程池
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="intervention-worker")
+        if loop is None:
+            self.loop.set_default_executor(self.executor)
+            threading.Thread(target=self._run_loop, name="intervention-sessions", daemon=True).start()
+        _managers.add(self)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def create(self, alert_data: Dict[str, Any]) -> InterventionSession:
+        session = InterventionSession(
+            alert_data,
+            triage=self.triage,
+            consulting_factory=self.consulting_factory,
+            speak=self.speak,
+            barge_in=self.barge_in,
+            session_id=f"{self.id_prefix}{uuid.uuid4().hex}" if self.id_prefix else None,
+            executor=self.executor,
+        )
+        with self._lock:
+            # 清理已结束且长时间无活动的会话
+            cutoff = time.time() - self.retention
+            for stale in [s.id for s in self.sessions.values() if s.ended and s.last_activity < cutoff]:
+                del self.sessions[stale]
+            self.sessions[session.id] = session
+        SESSIONS_STARTED.inc()
+        return session
+
+    def get(self, session_id: str) -> Optional[InterventionSession]:
+        with self._lock:
+            return self.sessions.get(session_id)
+
+    def remove(self, session_id: str):
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(1 for s in self.sessions.values() if not s.ended)
+
+    async def end_all(self):
+        """结束所有未结束的会话（服务关闭时保存会话记录）"""
+        with self._lock:
+            sessions = [s for s in self.sessions.values() if not s.ended]
+        await asyncio.gather(*(s.end() for s in sessions), return_exceptions=True)
+
+    def submit(self, coro) -> Future:
+        """在会话事件循环中执行协程（供同步前端调用）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro, timeout: Optional[float] = None):
+        return self.submit(coro).result(timeout)
+
+
+# ---------- 命令行前端 ----------
+
+ROLE_LABELS = {"assistant": "情感助手", "counsellor": "李老师", "user": "您"}
+
+
+def format_event(event: Dict[str, str]) -> str:
+    label = ROLE_LABELS.get(event["role"])
+    return f"{label}: {event['text']}" if label else event["text"]
+
+
+async def run_cli(session: InterventionSession, show_debug: bool = False):
+    """终端交互：读取标准输入直到会话结束"""
+    loop = asyncio.get_running_loop()
+
+    def show(events):
+        for event in events:
+            if event["kind"] != "debug" or show_debug:
+                print(format_event(event) + "\n")
+
+    show(await session.start())
+    while not session.ended:
+        try:
+            text = await loop.run_in_executor(None, input, "> ")
+        except (EOFError, KeyboardInterrupt):
+            show(await session.end())
+            break
+        try:
+            show(await session.send_message(text))
+        except Exception as e:
+            # 分诊超时或失败时会话仍在分诊阶段，可以重新输入
+            print(f"处理失败: {e}\n")
+    return session.result
+
+
+def default_triage(get_wrapper: Callable[[], Any]):
+    """
+    把 MCPClientWrapper 的同步接口包装成会话所需的异步分诊函数。
+    get_wrapper 在第一次分诊时才被调用，便于延迟连接MCP服务器。
+    """
+
+    async def triage(user_input: str, alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        wrapper = get_wrapper()
+        ai_result = await loop.run_in_executor(None, tracing.wrap(wrapper.process_user_input), user_input, alert_data)
+        return ai_result.get("ai_response", {})
+
+    return triage
+
+
+def mcp_triage(mcp_client):
+    """直接在当前事件循环上调用 MCPClient（与ASGI服务共用循环）"""
+    from mcp_client_servers import build_triage_query
+
+    async def triage(user_input: str, alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await mcp_client.process_query(build_triage_query(user_input, alert_data))
+
+    return triage
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from mcp_client_servers import MCPClientWrapper
+    from emotional_consulting import EmotionalConsultingSystem
+
+    parser = argparse.ArgumentParser(description="命令行干预会话")
+    parser.add_argument("--heart-rate", default="未知")
+    parser.add_argument("--user-name", default="用户")
+    parser.add_argument("--debug", action="store_true", help="显示完整的AI返回数据")
+    args = parser.parse_args()
+
+    wrapper = MCPClientWrapper()
+    session = InterventionSession(
+        {"heart_rate": args.heart_rate, "user_name": args.user_name},
+        triage=default_triage(lambda: wrapper),
+        consulting_factory=EmotionalConsultingSystem,
+    )
+    print(asyncio.run(run_cli(session, show_debug=args.debug)))
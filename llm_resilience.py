@@ -0,0 +1,381 @@
+# LLM调用的截止时间、对冲请求和降级：分诊和疏导的一次慢响应不再拖住整个干预。
+#
+# - 每个调用点有截止时间（非流式为完整响应，流式为第一段文字）；
+# - 主请求超过该调用点近期 p95 延迟仍未返回时，再发一个相同的对冲请求，先返回的胜出；
+# - 截止时间到仍无结果时，改用备用的 OpenAI 兼容服务（LLM_FALLBACK_BASE_URL），
+#   再失败则疏导返回预设的安抚话术，干预流程不中断；分诊没有预设话术，按出错处理。
+#
+# 用法（参数与 llm_scheduler.complete 相同，主请求和对冲请求都经过全局调度器）:
+#   response = llm_resilience.complete(get_client(), "consult", model=..., messages=...)
+#   stream = await llm_resilience.acomplete(async_client, "consult", stream=True, ...)
+#
+# 配置:
+#   LLM_DEADLINES="triage=8,consult=12"   调用点截止秒数
+#   LLM_HEDGE_CALLS="triage,consult"       允许对冲的调用点（摘要不对冲，避免浪费额度）
+#   LLM_FALLBACK_BASE_URL / LLM_FALLBACK_API_KEY / LLM_FALLBACK_MODEL / LLM_FALLBACK_DEADLINE
+#   本地测试可用 llm_stub.py 作为主服务或备用服务
+import asyncio
+import collections
+import os
+import threading
+import time
+from concurrent import futures
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+import llm_scheduler
+import metrics
+
+
+def _parse_pairs(text: str) -> Dict[str, float]:
+    pairs = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, value = part.partition("=")
+        pairs[name.strip()] = float(value)
+    return pairs
+
+
+DEADLINES = {"triage": 8.0, "consult": 12.0, "summary": 120.0, "summary_batch": 180.0}
+DEADLINES.update(_parse_pairs(os.environ.get("LLM_DEADLINES", "")))
+DEFAULT_DEADLINE = 30.0
+HEDGE_CALLS = set(filter(None, os.environ.get("LLM_HEDGE_CALLS", "triage,consult").split(",")))
+
+FALLBACK_BASE_URL = os.environ.get("LLM_FALLBACK_BASE_URL")
+FALLBACK_API_KEY = os.environ.get("LLM_FALLBACK_API_KEY", "none")
+FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL")  # 默认与主请求相同
+FALLBACK_DEADLINE = float(os.environ.get("LLM_FALLBACK_DEADLINE", "6"))
+
+HEDGE_MIN_DELAY = 0.3      # 秒，对冲延迟下限
+HEDGE_MAX_FRACTION = 0.8   # 对冲延迟不超过截止时间的该比例
+HEDGE_MIN_SAMPLES = 20     # 延迟样本不足时按截止时间的一半对冲
+LATENCY_WINDOW = 200
+# 流式请求的HTTP超时按每次读取计，读到开头之后胜出的流还要继续读完，超时不低于该值
+STREAM_READ_TIMEOUT = 5.0
+
+# 截止时间内没有任何结果时的兜底回复；没有兜底的调用点直接抛出 TimeoutError 或最后一次的错误。
+# 分诊不设兜底：预设话术不带工具调用，既不会发出紧急邮件也不会转入疏导，只会掩盖故障
+CANNED = {
+    "consult": "抱歉让您久等了，我一直在听。我们先一起慢慢吸气，再慢慢呼气，重复几次。您愿意再多说一点刚才的感受吗？",
+}
+
+HEDGES = metrics.Counter("llm_hedged_requests_total", "Hedged duplicate LLM requests sent by call site", ["call"])
+HEDGE_WINS = metrics.Counter("llm_hedge_wins_total", "Hedged LLM requests that returned first by call site", ["call"])
+FALLBACKS = metrics.Counter(
+    "llm_fallbacks_total", "LLM calls answered by the secondary endpoint or a canned reply", ["call", "kind"]
+)
+
+
+class LatencyWindow:
+    """调用点最近若干次成功请求的延迟，用于计算对冲延迟"""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples: Dict[str, collections.deque] = collections.defaultdict(lambda: collections.deque(maxlen=size))
+        self._lock = threading.Lock()
+
+    def record(self, call: str, seconds: float):
+        with self._lock:
+            self._samples[call].append(seconds)
+
+    def p95(self, call: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples[call])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+
+LATENCIES = LatencyWindow()
+
+
+def hedge_delay(call: str, deadline: float) -> Optional[float]:
+    """何时发出对冲请求；该调用点不对冲时返回 None"""
+    if call not in HEDGE_CALLS:
+        return None
+    p95 = LATENCIES.p95(call)
+    delay = deadline / 2 if p95 is None else p95
+    return min(max(delay, HEDGE_MIN_DELAY), deadline * HEDGE_MAX_FRACTION)
+
+
+# ---------- 兜底回复 ----------
+
+def _canned_response(text: str):
+    message = SimpleNamespace(role="assistant", content=text, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+
+def _canned_chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason="stop")])
+
+
+def _canned(call: str, request: Dict[str, Any], waited: float):
+    # 兜底回复和超时都不是成功的调用
+    metrics.LLM_ERRORS.labels(call).inc()
+    if call not in CANNED:
+        raise TimeoutError(f"LLM调用 {call} 超过截止时间 {waited:.1f}s")
+    FALLBACKS.labels(call, "canned").inc()
+    if request.get("stream"):
+        return _SyncStream(None, [_canned_chunk(CANNED[call])])
+    return _canned_response(CANNED[call])
+
+
+async def _acanned(call: str, request: Dict[str, Any], waited: float):
+    result = _canned(call, request, waited)
+    return _AsyncStream(None, result.head) if isinstance(result, _SyncStream) else result
+
+
+# ---------- 流式：以第一段文字为准 ----------
+
+def _has_content(chunk) -> bool:
+    choices = getattr(chunk, "choices", None)
+    return bool(choices) and bool(getattr(choices[0].delta, "content", None))
+
+
+class _SyncStream:
+    """已读到第一段文字的流：先产出缓存的开头，再继续读原始流"""
+
+    def __init__(self, stream, head):
+        self.stream = stream
+        self.head = head
+
+    def __iter__(self):
+        yield from self.head
+        if self.stream is not None:
+            yield from self.stream
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+
+class _AsyncStream:
+    def __init__(self, stream, head):
+        self.stream = stream
+        self.head = head
+
+    async def __aiter__(self):
+        for chunk in self.head:
+            yield chunk
+        if self.stream is not None:
+            async for chunk in self.stream:
+                yield chunk
+
+    async def close(self):
+        if self.stream is not None:
+            await self.stream.close()
+
+
+def _read_head(stream):
+    head = []
+    for chunk in stream:
+        head.append(chunk)
+        if _has_content(chunk):
+            break
+    return _SyncStream(stream, head)
+
+
+async def _aread_head(stream):
+    head = []
+    async for chunk in stream:
+        head.append(chunk)
+        if _has_content(chunk):
+            break
+    return _AsyncStream(stream, head)
+
+
+def _discard(result):
+    """对冲中落败的流式结果要关闭连接"""
+    if isinstance(result, _SyncStream):
+        try:
+            result.close()
+        except Exception:
+            pass
+
+
+async def _adiscard(result):
+    if isinstance(result, _AsyncStream):
+        try:
+            await result.close()
+        except Exception:
+            pass
+
+
+# ---------- 备用服务 ----------
+
+_fallback_clients: Dict[str, Any] = {}
+_fallback_lock = threading.Lock()
+
+
+def _fallback_client(asynchronous: bool):
+    if not FALLBACK_BASE_URL:
+        return None
+    key = "async" if asynchronous else "sync"
+    with _fallback_lock:
+        if key not in _fallback_clients:
+            from openai import AsyncOpenAI, OpenAI
+            cls = AsyncOpenAI if asynchronous else OpenAI
+            _fallback_clients[key] = cls(
+                api_key=FALLBACK_API_KEY, base_url=FALLBACK_BASE_URL, max_retries=0, timeout=FALLBACK_DEADLINE
+            )
+        return _fallback_clients[key]
+
+
+def _fallback_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(request, model=FALLBACK_MODEL) if FALLBACK_MODEL else request
+
+
+def _bounded(client, expires: float, stream: bool = False):
+    """
+    让单次尝试的HTTP超时不超过调用的截止时间：落败的对冲请求和超时的尝试随之结束，
+    不会按客户端默认的10分钟超时一直占着连接和线程。在线程池中排队到截止时间的尝试不再发出。
+    """
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("等待发出请求时已超过截止时间")
+    if stream:
+        remaining = max(remaining, STREAM_READ_TIMEOUT)
+    with_options = getattr(client, "with_options", None)
+    return with_options(timeout=remaining) if with_options is not None else client
+
+
+# ---------- 同步 ----------
+
+# 同步调用的主请求和对冲请求在线程中执行；落败的请求无法中断，结果到达后丢弃，
+# 最迟在截止时间（流式为 STREAM_READ_TIMEOUT）后因HTTP超时结束，释放线程
+_executor = futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+
+def _attempt(client, call: str, request: Dict[str, Any], expires: float):
+    started = time.perf_counter()
+    result = llm_scheduler.complete(_bounded(client, expires, bool(request.get("stream"))), call, **request)
+    if request.get("stream"):
+        result = _read_head(result)
+    LATENCIES.record(call, time.perf_counter() - started)
+    return result
+
+
+def complete(client, call: str, **request):
+    """在截止时间内返回 client 的结果（必要时对冲），否则返回备用服务或兜底回复"""
+    deadline = DEADLINES.get(call, DEFAULT_DEADLINE)
+    hedge_at = hedge_delay(call, deadline)
+    started = time.monotonic()
+    expires = started + deadline
+    pending = {_executor.submit(_attempt, client, call, request, expires)}
+    hedge = None
+    error: Optional[BaseException] = None
+    winner = None
+    done = set()
+    while pending:
+        now = time.monotonic() - started
+        timeout = deadline - now if hedge is not None or hedge_at is None else hedge_at - now
+        done, pending = futures.wait(pending, timeout=max(0.0, timeout), return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                winner = future
+                break
+            error = future.exception()
+        if winner is not None:
+            break
+        elapsed = time.monotonic() - started
+        if hedge is None and hedge_at is not None and (elapsed >= hedge_at or not pending):
+            # 主请求慢或已经失败：发出对冲请求
+            HEDGES.labels(call).inc()
+            hedge = _executor.submit(_attempt, client, call, request, expires)
+            pending.add(hedge)
+        elif elapsed >= deadline:
+            break
+    for future in done:
+        if future is not winner and future.exception() is None:
+            _discard(future.result())
+    for future in pending:
+        future.add_done_callback(lambda f: _discard(f.result()) if f.exception() is None else None)
+    if winner is not None:
+        if winner is hedge:
+            HEDGE_WINS.labels(call).inc()
+        return winner.result()
+    fallback = _fallback_client(asynchronous=False)
+    if fallback is not None:
+        try:
+            with metrics.llm_call(f"{call}_fallback"):
+                result = fallback.chat.completions.create(**_fallback_request(request))
+                if request.get("stream"):
+                    result = _read_head(result)
+            FALLBACKS.labels(call, "secondary").inc()
+            return result
+        except Exception as e:
+            error = e
+    if call not in CANNED and error is not None:
+        raise error
+    return _canned(call, request, time.monotonic() - started)
+
+
+# ---------- 异步 ----------
+
+async def _aattempt(client, call: str, request: Dict[str, Any], expires: float):
+    started = time.perf_counter()
+    result = await llm_scheduler.acomplete(_bounded(client, expires, bool(request.get("stream"))), call, **request)
+    if request.get("stream"):
+        try:
+            result = await _aread_head(result)
+        except asyncio.CancelledError:
+            await result.close()  # 对冲落败或超时，断开流
+            raise
+    LATENCIES.record(call, time.perf_counter() - started)
+    return result
+
+
+async def acomplete(client, call: str, **request):
+    """complete 的异步版本，client 为 AsyncOpenAI；落败的请求会被取消"""
+    deadline = DEADLINES.get(call, DEFAULT_DEADLINE)
+    hedge_at = hedge_delay(call, deadline)
+    started = time.monotonic()
+    expires = started + deadline
+    pending = {asyncio.ensure_future(_aattempt(client, call, request, expires))}
+    hedge = None
+    error: Optional[BaseException] = None
+    winner = None
+    done = set()
+    try:
+        while pending:
+            now = time.monotonic() - started
+            timeout = deadline - now if hedge is not None or hedge_at is None else hedge_at - now
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, timeout), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    break
+                error = task.exception()
+            if winner is not None:
+                break
+            elapsed = time.monotonic() - started
+            if hedge is None and hedge_at is not None and (elapsed >= hedge_at or not pending):
+                HEDGES.labels(call).inc()
+                hedge = asyncio.ensure_future(_aattempt(client, call, request, expires))
+                pending.add(hedge)
+            elif elapsed >= deadline:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if task is not winner and not task.cancelled() and task.exception() is None:
+                await _adiscard(task.result())
+    if winner is not None:
+        if winner is hedge:
+            HEDGE_WINS.labels(call).inc()
+        return winner.result()
+    fallback = _fallback_client(asynchronous=True)
+    if fallback is not None:
+        try:
+            with metrics.llm_call(f"{call}_fallback"):
+                result = await asyncio.wait_for(
+                    fallback.chat.completions.create(**_fallback_request(request)), FALLBACK_DEADLINE
+                )
+                if request.get("stream"):
+                    result = await asyncio.wait_for(_aread_head(result), FALLBACK_DEADLINE)
+            FALLBACKS.labels(call, "secondary").inc()
+            return result
+        except Exception as e:
+            error = e
+    if call not in CANNED and error is not None:
+        raise error
+    return await _acanned(call, request, time.monotonic() - started)
@@ -0,0 +1,326 @@
+# 全局LLM请求调度：进程内所有 DeepSeek 调用（分诊、疏导、摘要）共用请求数和 token 数两个令牌桶，
+# 按优先级排队：紧急分诊 > 实时疏导 > 会话摘要。低优先级只能用到桶的一部分，
+# 告警高峰时后台摘要不会把额度用光，也不会排在紧急分诊前面。
+#
+# 用法:
+#   response = llm_scheduler.complete(get_client(), "consult", model=..., messages=...)
+#   response = await llm_scheduler.acomplete(async_client, "triage", model=..., messages=...)
+#
+# 调用方可能在不同线程和不同事件循环中（MCP事件循环线程、摘要线程、ASGI服务），
+# 调度器用线程锁保护，异步等待者通过 call_soon_threadsafe 唤醒。
+# 收到 429 时按 Retry-After 暂停所有请求后重试；openai 客户端自身的重试应关闭（max_retries=0）。
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+EMERGENCY, COUNSELLING, SUMMARY = 0, 1, 2
+PRIORITY_NAMES = ("emergency", "counselling", "summary")
+
+# metrics.llm_call 的调用点名称 → 优先级
+CALL_PRIORITY = {
+    "triage": EMERGENCY,
+    "consult": COUNSELLING,
+    "summary": SUMMARY,
+    "summary_batch": SUMMARY,
+}
+
+# 各优先级取用后桶内至少要剩下的比例：紧急分诊可以用尽，疏导留10%，摘要留30%
+RESERVE = (0.0, 0.1, 0.3)
+
+REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "240"))
+TOKENS_PER_MINUTE = float(os.environ.get("LLM_TOKENS_PER_MINUTE", "400000"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+
+DEFAULT_COMPLETION_TOKENS = 500  # 请求未指定 max_tokens 时按该输出长度预估
+
+QUEUE_WAIT = metrics.Histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for the rate limiter by priority", ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+QUEUED = metrics.Gauge("llm_queued_requests", "LLM calls waiting for the rate limiter by priority", ["priority"])
+RATE_LIMITED = metrics.Counter("llm_rate_limited_total", "LLM calls rejected with 429 by call site", ["call"])
+TOKENS = metrics.Counter("llm_tokens_total", "Tokens used by LLM calls by call site", ["call"])
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每秒补充 rate；取用可以使余量为负（按实际用量补扣时）"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, reserve: float, now: float) -> float:
+        """取用 amount 后仍剩 reserve 比例还需要等待的秒数"""
+        self._refill(now)
+        floor = reserve * self.capacity
+        # 超过可用额度的大请求按可用额度计，避免永远等不到
+        amount = min(amount, self.capacity - floor)
+        missing = amount + floor - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "event", "loop", "future", "granted", "cancelled")
+
+    def __init__(self, priority: int, seq: int, tokens: float, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.loop = loop
+        self.event = None if loop is not None else threading.Event()
+        self.future = loop.create_future() if loop is not None else None
+        self.granted = False
+        self.cancelled = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    """
+    按优先级分配请求数和 token 额度。
+
+    等待者按 (优先级, 到达顺序) 排队，只放行队首：高优先级到达后立刻排到所有低优先级前面。
+    队首暂时拿不到额度时，等待者按预计可用的时间自行醒来重新分配，不需要后台线程。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.max_retries = max_retries
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- 额度 ----------
+
+    def _wait_time(self, waiter: _Waiter, now: float) -> float:
+        reserve = RESERVE[waiter.priority]
+        return max(
+            self._paused_until - now,
+            self.requests.wait_time(1, reserve, now),
+            self.tokens.wait_time(waiter.tokens, reserve, now),
+        )
+
+    def _dispatch_locked(self) -> float:
+        """依次放行队首能拿到额度的等待者，返回队首还需等待的秒数（队列为空时为0）"""
+        now = time.monotonic()
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.cancelled:
+                heapq.heappop(self._waiters)
+                continue
+            wait = self._wait_time(waiter, now)
+            if wait > 0:
+                return wait
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            waiter.wake()
+        return 0.0
+
+    def _enqueue(self, waiter: _Waiter) -> float:
+        with self._lock:
+            heapq.heappush(self._waiters, waiter)
+            return self._dispatch_locked()
+
+    def _retry_dispatch(self) -> float:
+        with self._lock:
+            return self._dispatch_locked()
+
+    @staticmethod
+    def _poll_interval(wait: float) -> float:
+        # 额度可能因用量结算提前变多，最多等1秒就重新检查
+        return min(max(wait, 0.005), 1.0)
+
+    def acquire(self, priority: int, tokens: float) -> float:
+        """阻塞直到拿到一次请求和 tokens 个 token 的额度，返回排队秒数"""
+        started = time.perf_counter()
+        waiter = _Waiter(priority, next(self._seq), tokens)
+        wait = self._enqueue(waiter)
+        while not waiter.event.wait(self._poll_interval(wait)):
+            wait = self._retry_dispatch()
+        return self._record_wait(priority, started)
+
+    async def aacquire(self, priority: int, tokens: float) -> float:
+        """acquire 的异步版本；被取消时退出队列，已分配的额度退还"""
+        started = time.perf_counter()
+        waiter = _Waiter(priority, next(self._seq), tokens, asyncio.get_running_loop())
+        wait = self._enqueue(waiter)
+        try:
+            while not waiter.granted:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), self._poll_interval(wait))
+                except asyncio.TimeoutError:
+                    wait = self._retry_dispatch()
+        except asyncio.CancelledError:
+            with self._lock:
+                waiter.cancelled = True
+                if waiter.granted:
+                    # 额度已经分配但调用方不再发出请求：退还后放行后面的等待者
+                    self.requests.take(-1)
+                    self.tokens.take(-waiter.tokens)
+                    self._dispatch_locked()
+            raise
+        return self._record_wait(priority, started)
+
+    @staticmethod
+    def _record_wait(priority: int, started: float) -> float:
+        waited = time.perf_counter() - started
+        QUEUE_WAIT.labels(PRIORITY_NAMES[priority]).observe(waited)
+        return waited
+
+    def settle(self, estimated: float, actual: float):
+        """按实际 token 用量修正预扣的额度"""
+        with self._lock:
+            self.tokens.take(actual - estimated)
+            self._dispatch_locked()
+
+    def pause(self, seconds: float):
+        """服务端限流（429）时，seconds 秒内不放行任何请求"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def queued(self) -> Dict[str, int]:
+        counts = dict.fromkeys(PRIORITY_NAMES, 0)
+        with self._lock:
+            for waiter in self._waiters:
+                if not waiter.cancelled:
+                    counts[PRIORITY_NAMES[waiter.priority]] += 1
+        return counts
+
+
+_scheduler: Optional[LLMScheduler] = None
+_lock = threading.Lock()
+QUEUED.set_function(lambda: _scheduler.queued() if _scheduler is not None else {})
+
+
+def get_scheduler() -> LLMScheduler:
+    """进程内共享的调度器，额度由 LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE 配置"""
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+
+# ---------- 调用封装 ----------
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """粗略预估一次请求的 token 数：提示词按每2个字符1个token，加上最大输出长度"""
+    chars = 0
+    for message in request.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        chars += len(content) if isinstance(content, str) else 0
+    if request.get("tools"):
+        chars += len(json.dumps(request["tools"], ensure_ascii=False))
+    return chars // 2 + (request.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """429 错误返回建议等待的秒数（无 Retry-After 时为0），其它错误返回 None"""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after") or 0)
+    except ValueError:
+        return 0.0
+
+
+def _backoff(error: Exception, attempt: int) -> Optional[float]:
+    delay = retry_after(error)
+    if delay is None:
+        return None
+    return delay or min(2 ** attempt, 30)
+
+
+def _settle(scheduler: LLMScheduler, call: str, estimated: int, response):
+    usage = getattr(response, "usage", None)
+    actual = getattr(usage, "total_tokens", None)
+    if isinstance(actual, (int, float)):
+        TOKENS.labels(call).inc(actual)
+        scheduler.settle(estimated, actual)
+
+
+def complete(client, call: str, priority: Optional[int] = None, **request):
+    """
+    经调度器调用 client.chat.completions.create(**request)，429 时按 Retry-After 重试。
+    非流式调用同时记录 metrics.llm_call；流式调用的耗时和首 token 由调用方记录。
+    """
+    scheduler = get_scheduler()
+    priority = CALL_PRIORITY.get(call, COUNSELLING) if priority is None else priority
+    estimated = estimate_tokens(request)
+    for attempt in itertools.count():
+        scheduler.acquire(priority, estimated)
+        try:
+            if request.get("stream"):
+                return client.chat.completions.create(**request)
+            with metrics.llm_call(call):
+                response = client.chat.completions.create(**request)
+            _settle(scheduler, call, estimated, response)
+            return response
+        except Exception as e:
+            delay = _backoff(e, attempt)
+            if delay is None or attempt >= scheduler.max_retries:
+                raise
+            RATE_LIMITED.labels(call).inc()
+            scheduler.pause(delay)
+
+
+async def acomplete(client, call: str, priority: Optional[int] = None, **request):
+    """complete 的异步版本，client 为 AsyncOpenAI"""
+    scheduler = get_scheduler()
+    priority = CALL_PRIORITY.get(call, COUNSELLING) if priority is None else priority
+    estimated = estimate_tokens(request)
+    for attempt in itertools.count():
+        await scheduler.aacquire(priority, estimated)
+        try:
+            if request.get("stream"):
+                return await client.chat.completions.create(**request)
+            with metrics.llm_call(call):
+                response = await client.chat.completions.create(**request)
+            _settle(scheduler, call, estimated, response)
+            return response
+        except Exception as e:
+            delay = _backoff(e, attempt)
+            if delay is None or attempt >= scheduler.max_retries:
+                raise
+            RATE_LIMITED.labels(call).inc()
+            scheduler.pause(delay)
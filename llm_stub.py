@@ -0,0 +1,287 @@
+# 本地 OpenAI 兼容的对话补全模拟服务，用于测试 llm_scheduler / llm_resilience：
+# 可配置首 token 延迟、长尾慢请求比例、失败和 429 比例，支持流式（SSE）和非流式
+#
+# 用法:
+#   python llm_stub.py --port 8099 --delay 0.4 --tail-rate 0.05 --tail-delay 20
+#   LLM_FALLBACK_BASE_URL=http://127.0.0.1:8099/v1 python LLM_inter.py      # 作为备用服务
+#   python llm_stub.py --bench 200 --concurrency 8 --tail-rate 0.05          # 对比直接调用和对冲调用的首字延迟
+#
+# --bench 需要 openai 包：在进程内启动模拟服务，分别用 llm_scheduler（无对冲）和 llm_resilience
+# 发出流式请求，报告首段文字延迟的 p50/p95/p99、对冲次数和兜底次数
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+DEFAULT_REPLY = "我理解您现在的感受。我们先一起做几次深呼吸，然后您可以慢慢告诉我发生了什么。"
+
+
+class StubLLMServer:
+    """
+    模拟 /v1/chat/completions。
+
+    - delay: 收到请求到首个 token 的时间，按 ±jitter 比例随机
+    - tail_rate / tail_delay: 该比例的请求首 token 延迟为 tail_delay（模拟长尾）
+    - fail_rate: 返回 500 的比例；rate_limit_rate: 返回 429（Retry-After: retry_after）的比例
+    - chunk_delay: 流式输出时每段文字之间的间隔
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        delay: float = 0.3,
+        jitter: float = 0.3,
+        tail_rate: float = 0.0,
+        tail_delay: float = 15.0,
+        fail_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        chunk_delay: float = 0.02,
+        reply: str = DEFAULT_REPLY,
+        seed: Optional[int] = None,
+    ):
+        self.delay = delay
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_delay = tail_delay
+        self.fail_rate = fail_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.chunk_delay = chunk_delay
+        self.reply = reply
+        self.requests_served = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                outcome, delay = server._plan()
+                if outcome == "rate_limited":
+                    self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                                    {"Retry-After": str(server.retry_after)})
+                    return
+                time.sleep(delay)
+                if outcome == "error":
+                    self._send_json(500, {"error": {"message": "stub failure", "type": "server_error"}})
+                    return
+                try:
+                    if body.get("stream"):
+                        self._send_stream(body)
+                    else:
+                        self._send_json(200, server.completion(body))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端已放弃（对冲落败或超时）
+
+            def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, body: Dict[str, Any]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i, chunk in enumerate(server.chunks(body)):
+                    if i > 1:
+                        time.sleep(server.chunk_delay)
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    def _plan(self):
+        """决定本次请求的结果和首 token 延迟"""
+        with self._lock:
+            self.requests_served += 1
+            roll = self._rng.random()
+            if roll < self.rate_limit_rate:
+                return "rate_limited", 0.0
+            if roll < self.rate_limit_rate + self.fail_rate:
+                return "error", self.delay
+            if self._rng.random() < self.tail_rate:
+                return "ok", self.tail_delay
+            return "ok", self.delay * self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _usage(self, body: Dict[str, Any]) -> Dict[str, int]:
+        prompt = sum(len(m.get("content") or "") for m in body.get("messages") or []) // 2
+        completion = len(self.reply) // 2
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(body),
+        }
+
+    def chunks(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body.get("model", "stub")}
+        pieces = [self.reply[i:i + 8] for i in range(0, len(self.reply), 8)]
+        chunks = [dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])]
+        chunks += [dict(base, choices=[{"index": 0, "delta": {"content": p}, "finish_reason": None}]) for p in pieces]
+        chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        return chunks
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ---------- 首字延迟对比 ----------
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))], 3)
+
+
+async def _first_word(call, client) -> float:
+    started = time.perf_counter()
+    stream = await call(client, "consult", model="stub", stream=True,
+                        messages=[{"role": "user", "content": "我有点心慌"}], max_tokens=200)
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            break
+    elapsed = time.perf_counter() - started
+    await stream.close()
+    return elapsed
+
+
+async def _run_case(call, client, requests: int, concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await _first_word(call, client)
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def bench(args) -> List[Dict[str, Any]]:
+    from openai import AsyncOpenAI
+
+    import llm_resilience
+    import llm_scheduler
+
+    server = StubLLMServer(
+        delay=args.delay, jitter=args.jitter, tail_rate=args.tail_rate, tail_delay=args.tail_delay,
+        fail_rate=args.fail_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed,
+    ).start()
+    llm_resilience.DEADLINES["consult"] = args.deadline
+    # 只比较延迟，不让全局限速参与
+    llm_scheduler._scheduler = llm_scheduler.LLMScheduler(requests_per_minute=1e6, tokens_per_minute=1e9)
+    results = []
+    try:
+        for name, call in (("direct", llm_scheduler.acomplete), ("resilient", llm_resilience.acomplete)):
+            client = AsyncOpenAI(api_key="stub", base_url=server.base_url, max_retries=0, timeout=args.tail_delay + 5)
+            hedges = llm_resilience.HEDGES.labels("consult").value
+            canned = llm_resilience.FALLBACKS.labels("consult", "canned").value
+            served = server.requests_served
+            latencies = asyncio.run(_run_case(call, client, args.bench, args.concurrency))
+            results.append({
+                "case": name,
+                "requests": args.bench,
+                "upstream_requests": server.requests_served - served,
+                "p50_s": _percentile(latencies, 0.5),
+                "p95_s": _percentile(latencies, 0.95),
+                "p99_s": _percentile(latencies, 0.99),
+                "max_s": round(max(latencies), 3),
+                "hedged": int(llm_resilience.HEDGES.labels("consult").value - hedges),
+                "canned": int(llm_resilience.FALLBACKS.labels("consult", "canned").value - canned),
+            })
+    finally:
+        server.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--delay", type=float, default=0.3, help="首 token 延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.3, help="延迟随机浮动比例")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="长尾慢请求比例")
+    parser.add_argument("--tail-delay", type=float, default=15.0, help="长尾请求的首 token 延迟")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--bench", type=int, default=0, help="不提供服务，改为发出该数量的请求对比首字延迟")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--deadline", type=float, default=5.0, help="--bench 时 consult 的截止时间")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        results = bench(args)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        columns = ["case", "requests", "upstream_requests", "p50_s", "p95_s", "p99_s", "max_s", "hedged", "canned"]
+        print("  ".join(f"{c:>17}" for c in columns))
+        for r in results:
+            print("  ".join(f"{r[c]:>17}" for c in columns))
+        return
+
+    server = StubLLMServer(
+        args.host, args.port, delay=args.delay, jitter=args.jitter, tail_rate=args.tail_rate,
+        tail_delay=args.tail_delay, fail_rate=args.fail_rate, rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after, reply=args.reply, seed=args.seed,
+    )
+    print(f"模拟LLM服务: {server.base_url}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,31 @@ from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 import os
 import threading
-from openai import OpenAI
+import time
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
+import llm_resilience
+import metrics
+import tracing
+
 load_dotenv()
+
+# 干预服务使用的MCP服务器
+DEFAULT_SERVER_PATHS = [
+    '/home/admin1/tools/ais/mymcp/email_sender.py',
+    #'/home/admin1/tools/ais/mymcp/psychological_counseling.py'
+]
+
+# 工具列表缓存时间（秒），期间分诊不再逐个服务器调用 list_tools
+TOOLS_TTL = float(os.getenv("MCP_TOOLS_TTL", "300"))
+
+
+def build_triage_query(user_input: str, alert_data: Dict[str, Any]) -> str:
+    """把用户回复和告警信息拼成分诊查询"""
+    return f"用户心率: {alert_data.get('heart_rate', '未知')}, 用户回复: {user_input}"
+
+
 class MCPClientWrapper:
     def __init__(self):
         self.client = MCPClient()
@@ -24,11 +45,7 @@ class MCPClientWrapper:
 
     def _init_servers(self):
         # 这里假定服务器路径已配置好
-        server_paths = [
-            '/home/admin1/tools/ais/mymcp/email_sender.py',
-            #'/home/admin1/tools/ais/mymcp/psychological_counseling.py'
-        ]
-        fut = asyncio.run_coroutine_threadsafe(self.client.connect_to_servers(server_paths), self.loop)
+        fut = asyncio.run_coroutine_threadsafe(self.client.connect_to_servers(DEFAULT_SERVER_PATHS), self.loop)
         fut.result()
         self.ready.set()
 
@@ -37,21 +54,37 @@ class MCPClientWrapper:
         处理用户输入，返回AI建议
         """
         self.ready.wait()
-        query = f"用户心率: {alert_data.get('heart_rate', '未知')}, 用户回复: {user_input}"
-        fut = asyncio.run_coroutine_threadsafe(self.client.process_query(query), self.loop)
+        query = build_triage_query(user_input, alert_data)
+        # 在MCP事件循环中继续调用方的 trace
+        fut = asyncio.run_coroutine_threadsafe(tracing.bind(self.client.process_query(query)), self.loop)
         result = fut.result()
         # 这里假定AI返回的内容中包含是否需要疏导/发邮件/终止的建议
         # 实际可根据AI返回内容进一步解析
         return {"ai_response": result}
 
+    def prewarm(self, timeout: Optional[float] = None) -> bool:
+        """等待MCP服务器连接完成并刷新工具列表缓存，超时返回 False"""
+        if not self.ready.wait(timeout):
+            return False
+        fut = asyncio.run_coroutine_threadsafe(self.client.list_all_tools(), self.loop)
+        fut.result(timeout)
+        return True
+
 class MCPClient:
     def __init__(self):
         self.sessions: dict[str, ClientSession] = {}
         self.exit_stack = AsyncExitStack()
-        self.deepseek = OpenAI(
-            api_key="sk-995d742a30f34b1a8b86e17fd5be462e",
-            base_url="https://api.deepseek.com"
+        # 异步客户端：process_query 运行在事件循环中，不能用阻塞调用；
+        # 分诊按最高优先级经 llm_scheduler 调用，429 重试由调度器处理；
+        # llm_resilience 负责截止时间和对冲请求；分诊超时或失败时抛出，由干预会话的错误路径处理
+        self.deepseek = AsyncOpenAI(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            base_url="https://api.deepseek.com",
+            max_retries=0
         )
+        self.tools_ttl = TOOLS_TTL
+        self._tools: Optional[list] = None
+        self._tools_expires = 0.0
 
     async def connect_to_servers(self, server_paths: list[str]):
         """连接多个服务器"""
@@ -90,18 +123,20 @@ class MCPClient:
             print(f"Failed to connect to {server_script_path}: {str(e)}")
             return None
 
-    async def process_query(self, query: str) -> str:
-        """处理查询，聚合所有服务器的工具"""
-        if not self.sessions:
-            return "No servers connected. Please connect to servers first."
-
-        # 收集所有服务器的工具
+    async def list_all_tools(self) -> list:
+        """聚合所有服务器的工具（OpenAI tools 格式），全部获取成功时缓存 tools_ttl 秒"""
+        hit = self._tools is not None and time.monotonic() < self._tools_expires
+        metrics.record_cache("mcp_tools", hit)
+        if hit:
+            return self._tools
         all_tools = []
+        complete = True
         print(f"Available sessions: {list(self.sessions.keys())}")
         
         for session_name, session in self.sessions.items():
             try:
-                response = await session.list_tools()
+                with tracing.span("list_tools", server=session_name):
+                    response = await session.list_tools()
                 for tool in response.tools:
                     # 添加服务器标识以避免工具名冲突
                     tool_dict = {
@@ -115,14 +150,32 @@ class MCPClient:
                     all_tools.append(tool_dict)
             except Exception as e:
                 print(f"Error getting tools from {session_name}: {str(e)}")
+                complete = False
+        if complete:
+            # 有服务器出错时不缓存，下次分诊重新获取
+            self._tools = all_tools
+            self._tools_expires = time.monotonic() + self.tools_ttl
+        return all_tools
+
+    @tracing.traced("process_query")
+    async def process_query(self, query: str) -> str:
+        """处理查询，聚合所有服务器的工具"""
+        if not self.sessions:
+            return "No servers connected. Please connect to servers first."
+
+        all_tools = await self.list_all_tools()
 
         messages = [{"role": "user", "content": query}]
 
-        response = self.deepseek.chat.completions.create(
-            model='deepseek-chat',
-            messages=messages,
-            tools=all_tools if all_tools else None
-        )
+        with tracing.span("llm.completion", model='deepseek-chat', tools=len(all_tools)) as completion_span:
+            response = await llm_resilience.acomplete(
+                self.deepseek,
+                "triage",
+                model='deepseek-chat',
+                messages=messages,
+                tools=all_tools if all_tools else None
+            )
+            completion_span.set_attribute("tool_calls", len(response.choices[0].message.tool_calls or []))
 
         result_dict = {
             "raw_message": None,
@@ -152,7 +205,8 @@ class MCPClient:
                     if server_name in self.sessions:
                         # 执行工具调用
                         print(f"Calling tool {actual_tool_name} on server {server_name} with args {tool_args}")
-                        result = await self.sessions[server_name].call_tool(actual_tool_name, tool_args)
+                        with tracing.span("call_tool", server=server_name, tool=actual_tool_name):
+                            result = await self.sessions[server_name].call_tool(actual_tool_name, tool_args)
                         if result and hasattr(result, 'content') and result.content:
                             tool_result = result.content[0].text if result.content else "No result"
                             result_dict["tool_results"].append({
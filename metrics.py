@@ -0,0 +1,362 @@
+# 轻量的 Prometheus 指标：Counter / Gauge / Histogram 和文本格式导出，只依赖标准库。
+# 记录一次只是一次加锁的加法（直方图多一次二分查找），可以放在轮询热路径上。
+#
+# 各模块在导入时定义自己的指标，注册到全局 REGISTRY；服务在 /metrics 返回 REGISTRY.render()，
+# 没有 Web 框架的进程（心率监控）用 start_http_server(port) 单独开一个端口
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒；覆盖从毫秒级的设备拉取到数十秒的LLM调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> "_Metric":
+        """同名指标只注册一次；模块被重复导入时返回已有的指标"""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if existing.kind != metric.kind or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"指标 {metric.name} 已以不同类型或标签注册")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def get(self, name: str) -> Optional["_Metric"]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    """
+    指标基类。同一 registry 中同名同类型的指标只创建一次：
+    脚本既作为 __main__ 运行又被其他模块导入时，两处拿到的是同一个指标对象。
+    """
+
+    kind = ""
+
+    def __new__(cls, name: str, *args, registry: Registry = REGISTRY, **kwargs):
+        existing = registry.get(name)
+        if existing is not None and type(existing) is cls:
+            return existing
+        return super().__new__(cls)
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY, **options):
+        if getattr(self, "_registered", False):
+            return
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        self._setup(**options)
+        registry.register(self)
+        self._registered = True
+
+    def _setup(self):
+        pass
+
+    def labels(self, *values) -> "_Metric":
+        """按标签值取子指标；子指标可缓存下来重复使用，避免每次查字典"""
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], object]]:
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return list(self._children.items())
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """只增不减的计数，名字以 _total 结尾；速率（如每秒样本数）由 Prometheus 的 rate() 计算"""
+
+    kind = "counter"
+
+    def _setup(self):
+        self._value = _CounterValue()
+
+    def inc(self, amount: float = 1):
+        self._value.inc(amount)
+
+    @property
+    def value(self) -> float:
+        return self._value.value
+
+    def total(self) -> float:
+        """所有标签组合的合计"""
+        if not self.labelnames:
+            return self._value.value
+        return sum(child.value for _, child in self._items())
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def samples(self) -> List[str]:
+        items = [((), self._value)] if not self.labelnames else self._items()
+        return [f"{self.name}{_label_text(self.labelnames, k)} {_format_value(c.value)}" for k, c in items]
+
+
+class _GaugeValue:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = float(value)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    @contextmanager
+    def track_inprogress(self) -> Iterator[None]:
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Gauge(_Metric):
+    """
+    可增可减的当前值。
+
+    set_function(fn) 改为在导出时调用 fn 取值，适合队列长度、活动会话数这类已有计数的状态；
+    带标签的 Gauge 的 fn 返回 {标签值或标签值元组: 数值}。
+    """
+
+    kind = "gauge"
+
+    def _setup(self):
+        self._value = _GaugeValue()
+        self._function: Optional[Callable[[], object]] = None
+
+    def set(self, value: float):
+        self._value.set(value)
+
+    def inc(self, amount: float = 1):
+        self._value.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._value.dec(amount)
+
+    def track_inprogress(self):
+        return self._value.track_inprogress()
+
+    def set_function(self, fn: Callable[[], object]):
+        self._function = fn
+
+    @property
+    def value(self) -> float:
+        return self._value.value
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception:
+                return []  # 取值失败时本次不导出，不影响其他指标
+            if not self.labelnames:
+                return [f"{self.name} {_format_value(result)}"]
+            lines = []
+            for key, value in sorted(result.items(), key=lambda kv: str(kv[0])):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{self.name}{_label_text(self.labelnames, [str(k) for k in key])} {_format_value(value)}")
+            return lines
+        items = [((), self._value)] if not self.labelnames else self._items()
+        return [f"{self.name}{_label_text(self.labelnames, k)} {_format_value(g.value)}" for k, g in items]
+
+
+class _HistogramValue:
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个桶是 +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Histogram(_Metric):
+    """分桶统计（默认以秒为单位的延迟），导出累计桶、_sum 和 _count"""
+
+    kind = "histogram"
+
+    def _setup(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != math.inf))
+        self._value = _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._value.observe(value)
+
+    def time(self):
+        return self._value.time()
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def samples(self) -> List[str]:
+        items = [((), self._value)] if not self.labelnames else self._items()
+        lines = []
+        for key, hist in items:
+            counts, total = hist.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _label_text(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# ---------- 多个模块共用的指标 ----------
+
+# 缓存命中率 = hit / (hit + miss)
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+
+# call：triage（MCP分诊）、consult（疏导）、summary / summary_batch（会话摘要）
+LLM_LATENCY = Histogram("llm_request_seconds", "LLM API call latency by call site", ["call"])
+LLM_FIRST_TOKEN = Histogram("llm_first_token_seconds", "Time to first streamed LLM token", ["call"])
+LLM_ERRORS = Counter("llm_errors_total", "Failed LLM API calls by call site", ["call"])
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+@contextmanager
+def timed(histogram, errors=None) -> Iterator[None]:
+    """记录代码块耗时到 histogram（可以是带标签的子指标），抛出异常时 errors 加一"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc()
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+def llm_call(call: str):
+    """记录一次非流式LLM调用的耗时和失败"""
+    return timed(LLM_LATENCY.labels(call), LLM_ERRORS.labels(call))
+
+
+# ---------- 独立导出端口 ----------
+
+def start_http_server(port: int, addr: str = "0.0.0.0", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """在后台线程中提供 GET /metrics，返回服务器对象（shutdown() 停止）"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 抓取请求不写访问日志
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"metrics-{port}", daemon=True).start()
+    return server
@@ -0,0 +1,281 @@
+# 心率监控负载基准：用 fleet_sim.py 模拟不同规模的设备集群，让 HeartRateMonitor 在一个事件循环中
+# 轮询全部设备，报告每秒样本数、告警检测延迟、事件循环延迟、CPU 和内存，找出单进程的承载上限
+#
+# 用法:
+#   python monitor_bench.py                                   # 默认 100 500 1000 2000 5000 台
+#   python monitor_bench.py --sizes 1000 4000 --duration 60 --interval 2
+#   python monitor_bench.py --policy adaptive --json
+#
+# 每个规模使用新的模拟集群和独立的监控子进程，CPU 和峰值RSS只统计监控进程。
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 与 fleet_sim.DEFAULT_MIX 相同；主进程不导入 fleet_sim（需要aiohttp）
+DEFAULT_MIX = "resting=0.6,exercise=0.15,tachycardia=0.08,bradycardia=0.05,dropout=0.07,slow=0.05"
+
+DEFAULT_SIZES = [100, 500, 1000, 2000, 5000]
+# 达不到预期样本数的 90% 或事件循环延迟 p95 超过该值时视为饱和
+SATURATION_RATIO = 0.9
+SATURATION_LAG_MS = 100
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def rss_mb() -> float:
+    """当前RSS；没有 /proc 时退回峰值RSS"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ---------- 监控子进程 ----------
+
+async def measure_loop_lag(lags: List[float], stop: asyncio.Event, period: float = 0.1):
+    """周期性 sleep，记录实际唤醒比预期晚了多少毫秒"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(period)
+        lags.append((time.perf_counter() - start - period) * 1000)
+
+
+async def run_monitors(fleet_url: str, duration: float, interval: float, policy: str, max_connections: int) -> Dict[str, Any]:
+    import aiohttp
+
+    import device_transport
+    import motion_guard
+    from motion_guard import HeartRateMonitor
+    from poll_scheduler import PollPolicy, PollScheduler
+
+    with urllib.request.urlopen(f"{fleet_url}/fleet") as resp:
+        manifest = json.loads(resp.read())
+    devices = {d["device_id"]: d for d in manifest["devices"]}
+    first_alert: Dict[str, float] = {}
+    alert_count = {"event": 0, "other": 0}
+
+    def on_alert(device_id: str):
+        async def handle(alert_data: Dict[str, Any]):
+            now = time.time()
+            device = devices[device_id]
+            onset = device["onset_at"]
+            if onset is not None and onset <= now <= device["event_end_at"] + interval * 2:
+                alert_count["event"] += 1
+                first_alert.setdefault(device_id, now)
+            else:
+                alert_count["other"] += 1
+        return handle
+
+    bench_policy = PollPolicy(base_interval=interval) if policy == "adaptive" else PollPolicy.fixed(interval)
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    rss_before = rss_mb()
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=10)) as http:
+        monitors = {}
+        for device_id in devices:
+            monitor = HeartRateMonitor(f"{fleet_url}/devices/{device_id}", session=http)
+            monitor.alert_handler = on_alert(device_id)
+            monitor.prewarm_url = None
+            monitors[device_id] = monitor
+        scheduler = PollScheduler(
+            lambda device_id: monitors[device_id]._scheduled_poll(device_id), bench_policy, max_concurrency=max_connections
+        )
+        scheduler.add_devices(monitors)
+
+        samples_before = motion_guard.SAMPLES.value
+        errors_before = device_transport.FETCH_ERRORS.total()
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        lags: List[float] = []
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(lags, stop))
+        asyncio.get_running_loop().call_later(duration, scheduler.stop)
+        await scheduler.run()
+        stop.set()
+        await lag_task
+        wall = time.perf_counter() - started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    latencies = []
+    missed = 0
+    now = time.time()
+    for device_id, device in devices.items():
+        onset = device["onset_at"]
+        if onset is None or onset > now - interval * 2:
+            continue  # 非异常场景，或异常开始得太晚来不及检测
+        if device_id in first_alert:
+            latencies.append(first_alert[device_id] - onset)
+        else:
+            missed += 1
+
+    cpu = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+    samples = motion_guard.SAMPLES.value - samples_before
+    stats = scheduler.stats()
+    return {
+        "devices": len(devices),
+        "samples_per_s": round(samples / wall, 1),
+        "polls_per_s": round(stats["polls"] / wall, 1),
+        "expected_per_s": round(len(devices) / interval, 1) if policy == "fixed" else None,
+        "fetch_errors": int(device_transport.FETCH_ERRORS.total() - errors_before),
+        "events": len(latencies) + missed,
+        "missed_events": missed,
+        "detect_p50_s": round(percentile(latencies, 0.5), 2) if latencies else None,
+        "detect_p95_s": round(percentile(latencies, 0.95), 2) if latencies else None,
+        "other_alerts": alert_count["other"],
+        "loop_lag_p95_ms": round(percentile(lags, 0.95), 1) if lags else None,
+        "cpu_pct": round(cpu / wall * 100, 1),
+        "rss_mb": round(rss_mb(), 1),
+        "rss_growth_mb": round(rss_mb() - rss_before, 1),
+    }
+
+
+def run_size(args):
+    """子进程入口：对已启动的模拟集群跑一轮监控，输出一行JSON"""
+    sys.path.insert(0, HERE)
+    logging.basicConfig(level=logging.INFO)
+    for name in ("HeartRateMonitor", "DeviceTransport"):
+        logging.getLogger(name).setLevel(args.log_level)
+    try:
+        result = asyncio.run(run_monitors(args.fleet_url, args.duration, args.interval, args.policy, args.max_connections))
+    except Exception as e:
+        result = {"devices": args.run_size, "error": f"{type(e).__name__}: {e}"}
+    print(json.dumps(result))
+
+
+# ---------- 主进程 ----------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fleet(size: int, args) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    proc = subprocess.Popen(
+        [
+            sys.executable, os.path.join(HERE, "fleet_sim.py"),
+            "--devices", str(size), "--port", str(port), "--processes", str(args.fleet_processes),
+            "--mix", args.mix, "--seed", str(args.seed),
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/fleet/stats", timeout=1).read()
+            return proc, url
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("模拟集群未能启动")
+
+
+def spawn_size(size: int, args) -> Dict[str, Any]:
+    fleet, url = start_fleet(size, args)
+    try:
+        proc = subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__), "--run-size", str(size), "--fleet-url", url,
+                "--duration", str(args.duration), "--interval", str(args.interval), "--policy", args.policy,
+                "--max-connections", str(args.max_connections), "--log-level", args.log_level,
+            ],
+            capture_output=True, text=True, timeout=args.duration + 300,
+        )
+    finally:
+        fleet.terminate()
+        fleet.wait(10)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("{"):
+            result = json.loads(line)
+            break
+    else:
+        result = {"devices": size, "error": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+    result["saturated"] = saturated(result)
+    return result
+
+
+def saturated(result: Dict[str, Any]) -> Optional[bool]:
+    if "error" in result:
+        return None
+    if result.get("loop_lag_p95_ms") is not None and result["loop_lag_p95_ms"] > SATURATION_LAG_MS:
+        return True
+    expected = result.get("expected_per_s")
+    return bool(expected) and result["polls_per_s"] < expected * SATURATION_RATIO
+
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = [
+        "devices", "samples_per_s", "expected_per_s", "fetch_errors", "events", "missed_events",
+        "detect_p50_s", "detect_p95_s", "loop_lag_p95_ms", "cpu_pct", "rss_mb", "saturated",
+    ]
+    print("  ".join(f"{c:>15}" for c in columns))
+    for r in results:
+        if "error" in r:
+            print(f"{r['devices']:>15}  ERROR: {r['error']}")
+            continue
+        print("  ".join(f"{'-' if r.get(c) is None else r[c]:>15}" for c in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="心率监控负载基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="设备数量")
+    parser.add_argument("--duration", type=float, default=45, help="每个规模的运行秒数")
+    parser.add_argument("--interval", type=float, default=5, help="轮询间隔（fixed）或基础间隔（adaptive）")
+    parser.add_argument("--policy", choices=["fixed", "adaptive"], default="fixed")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="模拟集群的场景比例，见 fleet_sim.py")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fleet-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="模拟集群的服务进程数，避免模拟端先成为瓶颈")
+    parser.add_argument("--log-level", default="ERROR", help="监控日志级别；INFO 时每个样本一行日志")
+    parser.add_argument("--stop-when-saturated", action="store_true", help="某个规模饱和后不再测试更大的规模")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--fleet-url", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_size:
+        run_size(args)
+        return
+
+    results = []
+    for size in args.sizes:
+        result = spawn_size(size, args)
+        results.append(result)
+        if not args.json:
+            print(f"{size} 台设备: {'饱和' if result.get('saturated') else '正常'}", file=sys.stderr)
+        if args.stop_when_saturated and result.get("saturated"):
+            break
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"policy={args.policy} interval={args.interval}s duration={args.duration}s mix={args.mix}")
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
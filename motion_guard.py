@@ -1,21 +1,60 @@
 import asyncio
 import aiohttp
-import json
 import time
+import weakref
+from collections import Counter
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Awaitable, Callable, Dict, Any, Optional
 import logging
 
+import metrics
+import tracing
+from baseline import get_baseline_table
+from device_transport import MODE_POLL, PollingTransport, TransportUnavailable, make_transport
+from poll_scheduler import DeviceState, PollPolicy, PollScheduler
+
+SAMPLES = metrics.Counter("monitor_samples_total", "Heart-rate samples processed")
+ALERTS = metrics.Counter("monitor_alerts_total", "Alerts raised by risk level", ["risk_level"])
+INTERVENTION_REQUESTS = metrics.Counter(
+    "monitor_intervention_requests_total", "Intervention requests sent by the monitor", ["result"]
+)
+PREWARM_REQUESTS = metrics.Counter(
+    "monitor_prewarm_requests_total", "Pre-warm requests sent by the monitor", ["trigger", "result"]
+)
+DEVICES = metrics.Gauge("monitor_devices", "Monitored devices by current risk level", ["risk_level"])
+
+# 本进程中的所有监控实例，导出时按当前风险等级计数
+_monitors = weakref.WeakSet()
+DEVICES.set_function(lambda: Counter(m.get_current_status().get('risk_level', 'no_data') for m in list(_monitors)))
+
 
 class HeartRateMonitor:
-    def __init__(self, base_url: str = "http://192.168.1.104:8080"):
+    def __init__(
+        self,
+        base_url: str = "http://192.168.1.104:8080",
+        session: Optional[aiohttp.ClientSession] = None,
+        transport: str = MODE_POLL,
+    ):
         self.base_url = base_url
         self.heart_rate_endpoint = f"{base_url}/heart-rate"
         
+        # 设备传输：poll（HTTP轮询）/ sse / websocket（推送订阅）；
+        # 推送不可用时回退到轮询，stream_retry_after 秒后再尝试订阅
+        self.transport_mode = transport
+        self.stream_retry_after = 60
+        self.poller = PollingTransport(base_url, self.http_session)
+        self.stream = None if transport == MODE_POLL else make_transport(transport, base_url, self.http_session)
+        
         # 监控配置
-        self.monitoring_interval = 5  # 秒
+        self.monitoring_interval = 5  # 秒，平稳状态下的基础轮询间隔
+        self.adaptive_polling = True  # 按风险和趋势调整间隔；False 时固定为 monitoring_interval
+        self.poll_policy: Optional[PollPolicy] = None  # 默认按 monitoring_interval 创建
+        self.scheduler: Optional[PollScheduler] = None
         self.emergency_threshold = 120  # BPM紧急阈值
         self.warning_threshold = 100   # BPM警告阈值
+        self.bradycardia_threshold = 50  # BPM心动过缓阈值，低于该值按紧急处理
+        # 个人基线（baseline.py 生成）：有该设备的基线时按时段使用个人阈值，否则用上面的全局阈值
+        self.baseline = get_baseline_table()
         
         # 数据存储
         self.current_data: Optional[Dict] = None
@@ -25,56 +64,81 @@ class HeartRateMonitor:
         # 状态标志
         self.is_monitoring = False
         self.last_update_time = 0
+
+        # 干预服务
+        self.intervention_url = "http://127.0.0.1:5005/intervene"
+        self.intervention_callback_url: Optional[str] = None  # 可选：干预状态变化时由服务回调
+        self.active_intervention_job: Optional[str] = None
+        # 查不到上一次干预任务（404、服务不可达）时按仍在进行处理，超过该秒数才允许再次触发
+        self.intervention_unknown_timeout = 120
+        self._job_unknown_since: Optional[float] = None
+        # 设置后告警交给它处理（如分片进程上报协调进程），不再直接调用干预服务
+        self.alert_handler: Optional[Callable[[Dict], Awaitable[None]]] = None
+
+        # 告警预热：进入 warning 或心率快速上升时通知干预服务提前准备（见 prewarm.py），None 表示关闭
+        self.prewarm_url: Optional[str] = "http://127.0.0.1:5005/prewarm"
+        self.prewarm_slope = 15  # BPM/分钟，未达警告阈值但上升快于该值时也预热
+        self.prewarm_interval = 60  # 秒，两次预热请求的最小间隔（服务端另按 PREWARM_TTL 去重）
+        self.trend = DeviceState(base_url, self.monitoring_interval)
+        self._last_prewarm: Optional[float] = None
+        self._prewarm_task: Optional[asyncio.Task] = None
+
+        # 所有请求复用同一个连接池；外部传入的 session 由调用方负责关闭
+        self._http = session
+        self._owns_http = session is None
         
         # 设置日志
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger("HeartRateMonitor")
+        _monitors.add(self)
+
+    def http_session(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+            self._owns_http = True
+        return self._http
+
+    async def close(self):
+        if self._owns_http and self._http is not None and not self._http.closed:
+            await self._http.close()
 
+    @tracing.traced("fetch_heart_rate")
     async def fetch_heart_rate(self) -> Optional[Dict]:
         """从设备API获取心率数据"""
-        try:
-            timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(self.heart_rate_endpoint) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        data['received_timestamp'] = time.time()
-                        data['local_timestamp'] = datetime.now().isoformat()
-                        return data
-                    else:
-                        self.logger.error(f"API响应错误: {response.status}")
-                        return None
-                        
-        except aiohttp.ClientError as e:
-            self.logger.error(f"网络请求错误: {e}")
-            return None
-        except json.JSONDecodeError as e:
-            self.logger.error(f"JSON解析错误: {e}")
-            return None
+        return await self.poller.fetch()
 
+    @tracing.traced("analyze_heart_rate")
     def analyze_heart_rate(self, data: Dict) -> Dict[str, Any]:
         """分析心率数据并返回状态评估"""
         heart_rate = data.get('current_heart_rate', 0)
         status = data.get('status', 'unknown')
         
+        emergency, warning, bradycardia = self.emergency_threshold, self.warning_threshold, self.bradycardia_threshold
+        personal = None
+        if self.baseline is not None:
+            personal = self.baseline.lookup(data.get('device_id') or self.base_url, data.get('received_timestamp'))
+            if personal is not None:
+                emergency, warning, bradycardia = personal
+        
         analysis = {
             'heart_rate': heart_rate,
             'status': status,
             'risk_level': 'normal',
             'message': '',
-            'suggested_action': 'continue_monitoring'
+            'suggested_action': 'continue_monitoring',
+            'baseline': 'personal' if personal is not None else 'global'
         }
         
         # 风险评估逻辑
-        if heart_rate >= self.emergency_threshold:
+        if heart_rate >= emergency:
             analysis['risk_level'] = 'emergency'
             analysis['message'] = f'心率过高: {heart_rate} BPM'
             analysis['suggested_action'] = 'immediate_intervention'
-        elif heart_rate >= self.warning_threshold:
+        elif heart_rate >= warning:
             analysis['risk_level'] = 'warning'
             analysis['message'] = f'心率偏高: {heart_rate} BPM'
             analysis['suggested_action'] = 'gentle_intervention'
-        elif heart_rate < 50:  # 心动过缓
+        elif heart_rate < bradycardia:  # 心动过缓
             analysis['risk_level'] = 'emergency'
             analysis['message'] = f'心率过低: {heart_rate} BPM'
             analysis['suggested_action'] = 'immediate_intervention'
@@ -109,58 +173,205 @@ class HeartRateMonitor:
             'heart_rate': raw_data['current_heart_rate'],
             'risk_level': analysis['risk_level'],
             'message': analysis['message'],
-            'raw_data': raw_data
+            # 干预服务按设备关联用户的历史咨询记录
+            'device_id': raw_data.get('device_id') or self.base_url,
+            'raw_data': raw_data,
+            'incident_id': tracing.incident_id()
         }
         
+        ALERTS.labels(analysis['risk_level']).inc()
         # 触发LLM干预（后续扩展）
-        await self.trigger_llm_intervention(alert_data)
+        if self.alert_handler is not None:
+            await self.alert_handler(alert_data)
+        else:
+            await self.trigger_llm_intervention(alert_data)
 
+    @tracing.traced("trigger_llm_intervention")
     async def trigger_llm_intervention(self, alert_data: Dict):
-        """通过HTTP请求调用LLM_inter.py服务"""
+        """通过HTTP请求调用LLM_inter.py服务，服务立即返回任务ID，不再等待会话结束"""
+        if await self._intervention_in_progress():
+            INTERVENTION_REQUESTS.labels("skipped").inc()
+            self.logger.info(f"干预任务 {self.active_intervention_job} 仍在进行，跳过本次触发")
+            return
+
         self.logger.info("🚨 触发LLM情感干预（HTTP模式）")
-        url = "http://127.0.0.1:5005/intervene"
+        if self.intervention_callback_url:
+            alert_data['callback_url'] = self.intervention_callback_url
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=alert_data, timeout=600) as resp:
-                    result = await resp.json()
-                    self.logger.info(f"情感干预完成: {result}")
+            headers = tracing.inject({})
+            async with self.http_session().post(self.intervention_url, json=alert_data, headers=headers) as resp:
+                result = await resp.json()
+                tracing.current_span().set_attribute("http.status_code", resp.status)
+                if resp.status == 202:
+                    INTERVENTION_REQUESTS.labels("accepted").inc()
+                    self.active_intervention_job = result['job_id']
+                    self._job_unknown_since = None
+                    self.logger.info(f"情感干预已开始: 任务 {result['job_id']}")
+                else:
+                    INTERVENTION_REQUESTS.labels("rejected").inc()
+                    self.logger.error(f"情感干预请求被拒绝({resp.status}): {result}")
         except Exception as e:
+            INTERVENTION_REQUESTS.labels("error").inc()
             self.logger.error(f"情感干预过程中出错: {e}")
 
+    async def _intervention_in_progress(self) -> bool:
+        """
+        查询上一次干预任务是否仍在排队或进行中。
+        只有服务明确返回已结束时才认为结束；404 或查询失败时状态未知，
+        intervention_unknown_timeout 秒内按仍在进行处理，避免对同一告警重复干预。
+        """
+        if not self.active_intervention_job:
+            return False
+        url = f"{self.intervention_url}/{self.active_intervention_job}"
+        try:
+            async with self.http_session().get(url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                if resp.status == 200:
+                    job = await resp.json()
+                    self._job_unknown_since = None
+                    if job['status'] in ('queued', 'running'):
+                        return True
+                    self.active_intervention_job = None
+                    return False
+                self.logger.warning(f"查询干预任务 {self.active_intervention_job} 返回 {resp.status}，状态未知")
+        except Exception as e:
+            self.logger.error(f"查询干预任务状态出错: {e}")
+        now = time.monotonic()
+        if self._job_unknown_since is None:
+            self._job_unknown_since = now
+        if now - self._job_unknown_since < self.intervention_unknown_timeout:
+            return True
+        self.logger.warning(f"干预任务 {self.active_intervention_job} 超过 {self.intervention_unknown_timeout} 秒状态未知，允许重新触发")
+        self.active_intervention_job = None
+        self._job_unknown_since = None
+        return False
+
+    async def poll_once(self) -> Optional[Dict[str, Any]]:
+        """拉取并处理一次心率数据，返回分析结果；拉取失败时返回 None"""
+        # 每次轮询是一条 trace，触发告警时其 trace ID 即 incident ID
+        with tracing.span("monitor.poll", device=self.base_url):
+            # 获取数据
+            data = await self.fetch_heart_rate()
+            if not data:
+                return None
+            return await self.process_sample(data)
+
+    async def process_sample(self, data: Dict) -> Dict[str, Any]:
+        """分析、存储一个样本并在需要时告警，轮询和推送订阅共用"""
+        SAMPLES.inc()
+        # 分析数据
+        analysis = self.analyze_heart_rate(data)
+        
+        # 存储数据
+        self.store_data(data, analysis)
+        self.trend.record(data['current_heart_rate'], data.get('received_timestamp'))
+        
+        # 日志记录
+        self.logger.info(
+            f"心率: {data['current_heart_rate']:.1f} BPM | "
+            f"状态: {analysis['risk_level']} | "
+            f"设备状态: {data.get('status', 'N/A')}"
+        )
+        
+        # 可能升级时先预热干预服务，不等待结果
+        trigger = self._prewarm_trigger(analysis)
+        if trigger:
+            self._prewarm_task = asyncio.create_task(self.request_prewarm(trigger, analysis, data))
+
+        # 紧急情况处理
+        if analysis['risk_level'] in ['emergency', 'warning']:
+            await self.emergency_alert(analysis, data)
+        return analysis
+
+    def _prewarm_trigger(self, analysis: Dict) -> Optional[str]:
+        """需要预热时返回触发原因（warning / rising）"""
+        if self.prewarm_url is None:
+            return None
+        if self._last_prewarm is not None and time.monotonic() - self._last_prewarm < self.prewarm_interval:
+            return None
+        if analysis['risk_level'] == 'warning':
+            return 'warning'
+        # 趋势只在读数窗口填满后判断，避免两三个读数的抖动被当成快速上升
+        trend_ready = len(self.trend.readings) == self.trend.readings.maxlen
+        if analysis['risk_level'] == 'normal' and trend_ready and self.trend.slope() >= self.prewarm_slope:
+            return 'rising'
+        return None
+
+    async def request_prewarm(self, trigger: str, analysis: Dict, raw_data: Dict):
+        """通知干预服务预热，服务立即返回"""
+        self._last_prewarm = time.monotonic()
+        payload = {
+            'type': 'heart_rate_prewarm',
+            'trigger': trigger,
+            'device_id': raw_data.get('device_id') or self.base_url,
+            'heart_rate': raw_data['current_heart_rate'],
+            'risk_level': analysis['risk_level'],
+            'slope': round(self.trend.slope(), 1),
+        }
+        try:
+            async with self.http_session().post(
+                self.prewarm_url, json=payload, timeout=aiohttp.ClientTimeout(total=5)
+            ) as resp:
+                result = await resp.json()
+                if resp.status != 202:
+                    PREWARM_REQUESTS.labels(trigger, "rejected").inc()
+                elif result.get('prewarming'):
+                    PREWARM_REQUESTS.labels(trigger, "accepted").inc()
+                    self.logger.info(f"已请求预热干预服务（{trigger}，斜率 {payload['slope']} BPM/分钟）")
+                else:
+                    PREWARM_REQUESTS.labels(trigger, "deduplicated").inc()
+        except Exception as e:
+            PREWARM_REQUESTS.labels(trigger, "error").inc()
+            self.logger.error(f"预热请求出错: {e}")
+
+    async def _scheduled_poll(self, device_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.poll_once()
+        except Exception as e:
+            self.logger.error(f"监控循环错误: {e}")
+            return None  # 出错后按退避间隔继续
+
     async def monitoring_loop(self):
-        """主监控循环"""
+        """主监控循环：推送订阅逐个处理样本；轮询时由调度器按风险状态和心率趋势决定下一次拉取的时间"""
         self.is_monitoring = True
-        self.logger.info("开始心率监控...")
+        self.logger.info(f"开始心率监控（{self.transport_mode}）...")
         
+        if self.poll_policy is None:
+            self.poll_policy = (
+                PollPolicy(base_interval=self.monitoring_interval)
+                if self.adaptive_polling else PollPolicy.fixed(self.monitoring_interval)
+            )
+        try:
+            if self.stream is None:
+                await self._run_polling()
+            else:
+                await self._run_streaming()
+        finally:
+            await self.close()
+
+    async def _run_polling(self, duration: Optional[float] = None):
+        """按调度器轮询；指定 duration 时运行该秒数后返回"""
+        self.scheduler = PollScheduler(self._scheduled_poll, self.poll_policy)
+        self.scheduler.add_device(self.base_url, stagger=False)
+        if duration is not None:
+            asyncio.get_running_loop().call_later(duration, self.scheduler.stop)
+        await self.scheduler.run()
+        self.scheduler = None
+
+    async def _run_streaming(self):
         while self.is_monitoring:
             try:
-                # 获取数据
-                data = await self.fetch_heart_rate()
-                
-                if data:
-                    # 分析数据
-                    analysis = self.analyze_heart_rate(data)
-                    
-                    # 存储数据
-                    self.store_data(data, analysis)
-                    
-                    # 日志记录
-                    self.logger.info(
-                        f"心率: {data['current_heart_rate']:.1f} BPM | "
-                        f"状态: {analysis['risk_level']} | "
-                        f"设备状态: {data.get('status', 'N/A')}"
-                    )
-                    
-                    # 紧急情况处理
-                    if analysis['risk_level'] in ['emergency', 'warning']:
-                        await self.emergency_alert(analysis, data)
-                
-                # 等待下一次监控
-                await asyncio.sleep(self.monitoring_interval)
-                
-            except Exception as e:
-                self.logger.error(f"监控循环错误: {e}")
-                await asyncio.sleep(self.monitoring_interval)  # 出错后继续
+                async for data in self.stream.samples():
+                    if not self.is_monitoring:
+                        return
+                    # 推送的每个样本是一条 trace
+                    with tracing.span("monitor.sample", device=self.base_url, transport=self.transport_mode):
+                        try:
+                            await self.process_sample(data)
+                        except Exception as e:
+                            self.logger.error(f"处理样本出错: {e}")
+            except TransportUnavailable as e:
+                self.logger.warning(f"{e}，回退到HTTP轮询 {self.stream_retry_after} 秒")
+                await self._run_polling(self.stream_retry_after)
 
     def get_current_status(self) -> Dict:
         """获取当前状态摘要"""
@@ -182,11 +393,15 @@ class HeartRateMonitor:
     async def stop_monitoring(self):
         """停止监控"""
         self.is_monitoring = False
+        if self.scheduler is not None:
+            self.scheduler.stop()
         self.logger.info("心率监控已停止")
 
 # 使用示例
-async def main():
-    monitor = HeartRateMonitor()
+async def main(base_url: str = "http://192.168.1.104:8080", transport: str = MODE_POLL, metrics_port: Optional[int] = None):
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
+    monitor = HeartRateMonitor(base_url, transport=transport)
     
     try:
         # 启动监控
@@ -196,4 +411,12 @@ async def main():
         print("监控程序已退出")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="心率监控")
+    parser.add_argument("--device-url", default="http://192.168.1.104:8080")
+    parser.add_argument("--transport", choices=["poll", "sse", "websocket"], default=MODE_POLL,
+                        help="poll 为HTTP轮询；sse/websocket 为推送订阅，不可用时回退到轮询")
+    parser.add_argument("--metrics-port", type=int, default=None, help="在该端口提供 Prometheus /metrics")
+    args = parser.parse_args()
+    asyncio.run(main(args.device_url, args.transport, args.metrics_port))
@@ -0,0 +1,222 @@
+# 自适应轮询调度：按设备当前风险等级和心率趋势决定下一次拉取的间隔，
+# 用最小堆维护各设备的到期时间，加随机抖动避免大量设备同时请求
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+import metrics
+
+POLLS_IN_FLIGHT = metrics.Gauge("poll_scheduler_in_flight", "Device polls currently running")
+POLL_INTERVALS = metrics.Histogram(
+    "poll_scheduler_interval_seconds", "Intervals chosen for the next device poll",
+    buckets=(1, 2, 3, 5, 7.5, 10, 15, 20, 30, 60),
+)
+
+
+class PollPolicy:
+    """
+    轮询间隔策略（秒）。
+
+    emergency/warning 使用固定的短间隔；正常状态下心率快速上升时用 rising_interval，
+    连续 stable_after 次平稳读数后按 backoff 倍数逐步放宽到 max_interval。
+    拉取失败时按 backoff 从 base_interval 退避。
+    """
+
+    def __init__(
+        self,
+        base_interval: float = 5,
+        emergency_interval: float = 1,
+        warning_interval: float = 2,
+        rising_interval: float = 2,
+        max_interval: float = 30,
+        backoff: float = 1.5,
+        rising_slope: float = 10,
+        stable_slope: float = 3,
+        stable_after: int = 3,
+        jitter: float = 0.1,
+    ):
+        self.base_interval = base_interval
+        self.emergency_interval = emergency_interval
+        self.warning_interval = warning_interval
+        self.rising_interval = rising_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.rising_slope = rising_slope  # BPM/分钟
+        self.stable_slope = stable_slope
+        self.stable_after = stable_after
+        self.jitter = jitter
+
+    @classmethod
+    def fixed(cls, interval: float) -> "PollPolicy":
+        """固定间隔、不加抖动，等同于原来的定时轮询"""
+        return cls(interval, interval, interval, interval, interval, backoff=1, jitter=0)
+
+    def next_interval(self, device: "DeviceState", analysis: Optional[Dict[str, Any]]) -> float:
+        if analysis is None:
+            device.stable_count = 0
+            interval = min(max(device.interval, self.base_interval) * self.backoff, self.max_interval)
+        else:
+            risk = analysis.get("risk_level")
+            slope = device.slope()
+            if risk == "emergency":
+                device.stable_count = 0
+                interval = self.emergency_interval
+            elif risk == "warning":
+                device.stable_count = 0
+                interval = self.warning_interval
+            elif slope >= self.rising_slope:
+                device.stable_count = 0
+                interval = self.rising_interval
+            elif abs(slope) <= self.stable_slope:
+                device.stable_count += 1
+                if device.stable_count >= self.stable_after:
+                    interval = min(max(device.interval, self.base_interval) * self.backoff, self.max_interval)
+                else:
+                    interval = self.base_interval
+            else:
+                device.stable_count = 0
+                interval = self.base_interval
+        device.interval = interval
+        return self.with_jitter(interval)
+
+    def with_jitter(self, interval: float) -> float:
+        return max(0.05, interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+class DeviceState:
+    """单个设备的调度状态和最近读数"""
+
+    def __init__(self, device_id: str, interval: float, window: int = 6):
+        self.device_id = device_id
+        self.interval = interval
+        self.stable_count = 0
+        self.readings: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self.next_due = 0.0
+        self.polls = 0
+        self.failures = 0
+        self.last_analysis: Optional[Dict[str, Any]] = None
+
+    def record(self, heart_rate: float, at: Optional[float] = None):
+        self.readings.append((at if at is not None else time.time(), float(heart_rate)))
+
+    def slope(self) -> float:
+        """最近读数的最小二乘斜率，单位 BPM/分钟"""
+        if len(self.readings) < 2:
+            return 0.0
+        n = len(self.readings)
+        mean_t = sum(t for t, _ in self.readings) / n
+        mean_h = sum(h for _, h in self.readings) / n
+        var = sum((t - mean_t) ** 2 for t, _ in self.readings)
+        if var == 0:
+            return 0.0
+        cov = sum((t - mean_t) * (h - mean_h) for t, h in self.readings)
+        return cov / var * 60
+
+
+PollFunc = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class PollScheduler:
+    """
+    基于最小堆的多设备轮询调度器。
+
+    poll(device_id) 完成一次拉取和分析，返回包含 heart_rate、risk_level 的分析结果，
+    失败时返回 None。同时进行的拉取不超过 max_concurrency。
+    """
+
+    def __init__(self, poll: PollFunc, policy: Optional[PollPolicy] = None, max_concurrency: int = 100):
+        self.poll = poll
+        self.policy = policy or PollPolicy()
+        self.max_concurrency = max_concurrency
+        self.devices: Dict[str, DeviceState] = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+        self._tasks: set = set()
+
+    def add_device(self, device_id: str, stagger: bool = True):
+        """加入设备；stagger 时首次拉取在一个基础间隔内随机分布"""
+        if device_id in self.devices:
+            return
+        device = DeviceState(device_id, self.policy.base_interval)
+        delay = random.uniform(0, self.policy.base_interval) if stagger else 0.0
+        self.devices[device_id] = device
+        self._schedule(device, time.monotonic() + delay)
+
+    def add_devices(self, device_ids: Iterable[str], stagger: bool = True):
+        for device_id in device_ids:
+            self.add_device(device_id, stagger)
+
+    def remove_device(self, device_id: str):
+        # 堆中的旧条目在弹出时按 devices 字典过滤
+        self.devices.pop(device_id, None)
+
+    def stop(self):
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        intervals = [d.interval for d in self.devices.values()]
+        return {
+            "devices": len(self.devices),
+            "in_flight": len(self._tasks),
+            "polls": sum(d.polls for d in self.devices.values()),
+            "failures": sum(d.failures for d in self.devices.values()),
+            "mean_interval": sum(intervals) / len(intervals) if intervals else None,
+        }
+
+    async def run(self):
+        """运行直到 stop()；退出前等待进行中的拉取完成"""
+        self._running = True
+        self._wakeup = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        while self._running:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, device_id = heapq.heappop(self._heap)
+                device = self.devices.get(device_id)
+                if device is None or device.next_due != due:
+                    continue
+                task = asyncio.create_task(self._poll_device(device, semaphore))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            timeout = self._heap[0][0] - now if self._heap else self.policy.base_interval
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _poll_device(self, device: DeviceState, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            POLLS_IN_FLIGHT.inc()
+            try:
+                analysis = await self.poll(device.device_id)
+            except Exception:
+                analysis = None
+            finally:
+                POLLS_IN_FLIGHT.dec()
+        device.polls += 1
+        if analysis is None:
+            device.failures += 1
+        else:
+            device.record(analysis.get("heart_rate", 0))
+        device.last_analysis = analysis
+        if device.device_id in self.devices:
+            interval = self.policy.next_interval(device, analysis)
+            POLL_INTERVALS.observe(interval)
+            self._schedule(device, time.monotonic() + interval)
+
+    def _schedule(self, device: DeviceState, due: float):
+        device.next_due = due
+        heapq.heappush(self._heap, (due, next(self._seq), device.device_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
@@ -0,0 +1,146 @@
+# 告警预热：设备进入 warning 或心率快速上升时，监控端调用干预服务的 /prewarm，
+# 在告警升级为紧急干预之前连接MCP服务器并缓存工具列表、创建LLM客户端、合成开场白语音、
+# 加载用户的历史记忆索引。紧急干预开始时这些都已就绪，不再依次等待
+#
+# 用法:
+#   curl -X POST http://127.0.0.1:5005/prewarm -d '{"device_id": "watch-1", "heart_rate": 105}' -H 'Content-Type: application/json'
+#   PREWARM_TTL=60 python LLM_inter.py
+#
+# 预热结果只保留 PREWARM_TTL 秒：期间没有升级，预合成的开场白语音被丢弃，同一设备之后可以再次预热。
+# 同一设备 TTL 内的重复预热请求直接跳过，监控端不需要自己去重
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger("Prewarm")
+
+PREWARM_TTL = float(os.environ.get("PREWARM_TTL", "120"))
+
+PREWARMS = metrics.Counter("intervention_prewarms_total", "Pre-warm requests received by result", ["result"])
+STEP_SECONDS = metrics.Histogram(
+    "intervention_prewarm_step_seconds", "Time spent in each pre-warm step", ["step"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+STEP_ERRORS = metrics.Counter("intervention_prewarm_errors_total", "Pre-warm steps that failed", ["step"])
+
+Step = Callable[[Dict[str, Any]], Any]
+
+
+def prewarm_key(alert_data: Dict[str, Any]) -> str:
+    """预热去重的粒度：设备，其次是用户"""
+    raw = alert_data.get('raw_data') or {}
+    return str(
+        alert_data.get('device_id') or raw.get('device_id') or alert_data.get('user_id')
+        or alert_data.get('user_name') or "default"
+    )
+
+
+def warm_user_context(alert_data: Dict[str, Any]):
+    """
+    构建该用户的历史记忆检索索引（SessionMemory 按用户缓存）。
+    用户标识与干预会话相同（intervention_session.alert_user_id），无法识别用户时不加载任何历史。
+    """
+    from intervention_session import alert_user_id
+    from session_memory import get_session_memory
+
+    user_id = alert_user_id(alert_data)
+    if user_id is not None:
+        get_session_memory().index_for(user_id)
+
+
+class Prewarmer:
+    """
+    按 key 去重并执行预热步骤。
+
+    steps 为 {名称: step(alert_data)}，各步骤相互独立、并行执行，单个步骤失败不影响其它步骤。
+    submit 在后台线程中执行，asubmit 在当前事件循环中执行（同步步骤放到线程池）。
+    """
+
+    def __init__(self, steps: Dict[str, Step], ttl: float = PREWARM_TTL):
+        self.steps = steps
+        self.ttl = ttl
+        self._expires: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # 事件循环只保留任务的弱引用，这里持有到任务结束
+        self._tasks = set()
+
+    def claim(self, alert_data: Dict[str, Any]) -> bool:
+        """TTL 内没有预热过该设备时登记并返回 True"""
+        key = prewarm_key(alert_data)
+        now = time.monotonic()
+        with self._lock:
+            for stale in [k for k, expires in self._expires.items() if expires <= now]:
+                del self._expires[stale]
+            if key in self._expires:
+                PREWARMS.labels("deduplicated").inc()
+                return False
+            self._expires[key] = now + self.ttl
+        PREWARMS.labels("started").inc()
+        return True
+
+    def active(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for expires in self._expires.values() if expires > now)
+
+    def _run_step(self, name: str, step: Step, alert_data: Dict[str, Any]):
+        with metrics.timed(STEP_SECONDS.labels(name), STEP_ERRORS.labels(name)):
+            result = step(alert_data)
+            if inspect.iscoroutine(result):
+                # 同步执行时异步步骤在预热线程中独立运行
+                result = asyncio.run(result)
+            return result
+
+    def run(self, alert_data: Dict[str, Any]) -> Dict[str, str]:
+        """执行所有步骤，返回 {失败的步骤: 错误}"""
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(self.steps)), thread_name_prefix="prewarm") as pool:
+            futures = {name: pool.submit(self._run_step, name, step, alert_data) for name, step in self.steps.items()}
+            for name, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    errors[name] = str(e)
+        if errors:
+            logger.warning(f"预热 {prewarm_key(alert_data)} 部分失败: {errors}")
+        return errors
+
+    def submit(self, alert_data: Dict[str, Any]) -> bool:
+        """去重后在后台线程中预热，不阻塞调用方；重复请求返回 False"""
+        if not self.claim(alert_data):
+            return False
+        threading.Thread(target=self.run, args=(alert_data,), name="prewarm", daemon=True).start()
+        return True
+
+    async def _arun_step(self, name: str, step: Step, alert_data: Dict[str, Any]):
+        with metrics.timed(STEP_SECONDS.labels(name), STEP_ERRORS.labels(name)):
+            if inspect.iscoroutinefunction(step):
+                return await step(alert_data)
+            return await asyncio.get_running_loop().run_in_executor(None, step, alert_data)
+
+    async def arun(self, alert_data: Dict[str, Any]) -> Dict[str, str]:
+        """run 的异步版本"""
+        names = list(self.steps)
+        results = await asyncio.gather(
+            *(self._arun_step(name, self.steps[name], alert_data) for name in names), return_exceptions=True
+        )
+        errors = {name: str(r) for name, r in zip(names, results) if isinstance(r, Exception)}
+        if errors:
+            logger.warning(f"预热 {prewarm_key(alert_data)} 部分失败: {errors}")
+        return errors
+
+    def asubmit(self, alert_data: Dict[str, Any]) -> Optional[asyncio.Task]:
+        """去重后在当前事件循环中创建预热任务；重复请求返回 None"""
+        if not self.claim(alert_data):
+            return None
+        task = asyncio.get_running_loop().create_task(self.arun(alert_data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
@@ -0,0 +1,159 @@
+# 咨询会话日志：每轮对话追加一行JSONL，进程崩溃也不会丢失已完成的轮次；
+# 会话结束时压缩为一个完整的JSON记录，读取端可统一遍历两种格式
+#
+# 记录格式（每行一个JSON对象）:
+#   {"type": "start", "session_id": ..., "user_info": {...}, "start_time": ...}
+#   {"type": "turn", "timestamp": ..., "user": ..., "assistant": ...}
+#   {"type": "end", "end_time": ..., "total_turns": N}
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+LOG_DIR = os.environ.get("CONSULTING_LOG_DIR", ".")
+FILE_PREFIX = "consulting_session_"
+
+
+def session_basename(start_time: datetime, session_id: str) -> str:
+    """微秒级时间戳加会话ID前缀，同一秒内开始的会话也不会互相覆盖"""
+    return f"{FILE_PREFIX}{start_time.strftime('%Y%m%d_%H%M%S_%f')}_{session_id[:8]}"
+
+
+class SessionLogWriter:
+    """
+    追加写入的会话日志。
+
+    每条记录写入后立即 flush 到操作系统；fsync 按批进行——累计 fsync_every 条
+    或距上次 fsync 超过 fsync_interval 秒时才落盘，结束记录总是立即落盘。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        session_id: str,
+        user_info: Dict[str, Any],
+        start_time: datetime,
+        fsync_every: int = 8,
+        fsync_interval: float = 1.0,
+    ):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.turns = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._file = open(path, "a", encoding="utf-8")
+        self._write({
+            "type": "start",
+            "session_id": session_id,
+            "user_info": user_info,
+            "start_time": start_time.isoformat(),
+        }, sync=True)
+
+    def append_turn(self, turn: Dict[str, Any]):
+        with self._lock:
+            self.turns += 1
+            self._write(dict(turn, type="turn"))
+
+    def close(self, end_time: Optional[datetime] = None):
+        with self._lock:
+            if self.closed:
+                return
+            self._write({
+                "type": "end",
+                "end_time": (end_time or datetime.now()).isoformat(),
+                "total_turns": self.turns,
+            }, sync=True)
+            self._file.close()
+            self.closed = True
+
+    def _write(self, record: Dict[str, Any], sync: bool = False):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._pending += 1
+        if sync or self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+            self._last_sync = time.monotonic()
+
+
+def read_records(path: str) -> List[Dict[str, Any]]:
+    """读取JSONL日志；崩溃时写了一半的最后一行会被忽略"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+def build_session(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把日志记录还原为与 save_session_log 相同结构的会话记录"""
+    start = next((r for r in records if r.get("type") == "start"), {})
+    end = next((r for r in records if r.get("type") == "end"), None)
+    history = [{k: v for k, v in r.items() if k != "type"} for r in records if r.get("type") == "turn"]
+    return {
+        "session_id": start.get("session_id"),
+        "user_info": start.get("user_info", {}),
+        "start_time": start.get("start_time"),
+        "end_time": end["end_time"] if end else None,
+        "session_history": history,
+        "total_turns": len(history),
+        "complete": end is not None,
+    }
+
+
+def compact(log_path: str, json_path: Optional[str] = None, remove_log: bool = True) -> str:
+    """把JSONL日志压缩为最终的JSON记录（先写临时文件再替换），返回JSON文件路径"""
+    if json_path is None:
+        json_path = os.path.splitext(log_path)[0] + ".json"
+    session = build_session(read_records(log_path))
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(session, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, json_path)
+    if remove_log and os.path.abspath(json_path) != os.path.abspath(log_path):
+        os.remove(log_path)
+    return json_path
+
+
+def read_session(path: str) -> Dict[str, Any]:
+    """读取单个会话，支持压缩后的JSON和未压缩（进行中或崩溃遗留）的JSONL"""
+    if path.endswith(".jsonl"):
+        return build_session(read_records(path))
+    with open(path, encoding="utf-8") as f:
+        session = json.load(f)
+    session.setdefault("complete", True)
+    return session
+
+
+def iter_sessions(directory: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """按开始时间顺序遍历目录下的所有会话；已压缩的会话只读取JSON"""
+    directory = directory or LOG_DIR
+    paths = {}
+    for path in glob.glob(os.path.join(directory, f"{FILE_PREFIX}*.json*")):
+        stem, ext = os.path.splitext(path)
+        if ext == ".json" or (ext == ".jsonl" and stem not in paths):
+            paths[stem] = path
+    for stem in sorted(paths):
+        try:
+            session = read_session(paths[stem])
+        except (OSError, json.JSONDecodeError):
+            continue
+        session["path"] = paths[stem]
+        yield session
+
+
+def recover(directory: Optional[str] = None) -> List[str]:
+    """压缩崩溃遗留的未结束日志，返回生成的JSON文件路径"""
+    directory = directory or LOG_DIR
+    return [compact(path) for path in sorted(glob.glob(os.path.join(directory, f"{FILE_PREFIX}*.jsonl")))]
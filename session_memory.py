@@ -0,0 +1,127 @@
+# 跨会话记忆检索：对用户的历史对话和摘要建立字符二元组TF-IDF索引，
+# 每轮只把与当前输入最相关的 top-k 条放进提示词，提示词长度不随历史增长
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import metrics
+from session_store import SessionStore, get_session_store
+
+# 中文按相邻两字切分，字母数字按整词
+TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for run in TOKEN_PATTERN.findall((text or "").lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class TfidfIndex:
+    """小型倒排TF-IDF索引，文档向量做L2归一化，查询得分即余弦相似度"""
+
+    def __init__(self, documents: List[Dict[str, Any]]):
+        self.documents = documents
+        counts = [Counter(tokenize(doc["text"])) for doc in documents]
+        df = Counter(term for c in counts for term in c)
+        n = len(documents)
+        self.idf = {term: math.log((n + 1) / (freq + 1)) + 1 for term, freq in df.items()}
+        self.postings: Dict[str, List[tuple]] = {}
+        for doc_id, c in enumerate(counts):
+            weights = {term: (1 + math.log(tf)) * self.idf[term] for term, tf in c.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, w in weights.items():
+                self.postings.setdefault(term, []).append((doc_id, w / norm))
+
+    def query(self, text: str, k: int = 4, min_score: float = 0.1) -> List[Dict[str, Any]]:
+        q = Counter(t for t in tokenize(text) if t in self.idf)
+        if not q:
+            return []
+        q_weights = {term: (1 + math.log(tf)) * self.idf[term] for term, tf in q.items()}
+        q_norm = math.sqrt(sum(w * w for w in q_weights.values()))
+        scores: Dict[int, float] = {}
+        for term, qw in q_weights.items():
+            for doc_id, dw in self.postings[term]:
+                scores[doc_id] = scores.get(doc_id, 0.0) + qw * dw / q_norm
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [dict(self.documents[doc_id], score=round(score, 4)) for doc_id, score in best if score >= min_score]
+
+
+class SessionMemory:
+    """
+    按用户缓存检索索引。
+
+    索引从 SessionStore 中该用户的历史轮次和会话摘要构建；用户有新会话或新摘要时重建。
+    """
+
+    def __init__(self, store: SessionStore, k: int = 4, min_score: float = 0.1, max_chars: int = 300):
+        self.store = store
+        self.k = k
+        self.min_score = min_score
+        self.max_chars = max_chars
+        self._indexes: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def index_for(self, user: str) -> TfidfIndex:
+        version = self.store.user_version(user)
+        with self._lock:
+            cached = self._indexes.get(user)
+            hit = cached is not None and cached[0] == version
+        metrics.record_cache("session_memory_index", hit)
+        if hit:
+            return cached[1]
+        index = TfidfIndex(self._documents(user))
+        with self._lock:
+            self._indexes[user] = (version, index)
+        return index
+
+    def retrieve(self, user: str, query: str, k: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.index_for(user).query(query, k or self.k, self.min_score)
+
+    def prompt_section(self, user: str, query: str, k: Optional[int] = None) -> Optional[str]:
+        """生成放入提示词的记忆段落，没有相关记忆时返回 None"""
+        items = self.retrieve(user, query, k)
+        if not items:
+            return None
+        lines = ["# 与当前话题相关的历史咨询记忆（仅供参考）"]
+        for item in items:
+            date = (item.get("start_time") or "")[:10]
+            lines.append(f"- [{date} {item['kind']}] {self._clip(item['text'])}")
+        return "\n".join(lines)
+
+    def _documents(self, user: str) -> List[Dict[str, Any]]:
+        docs = []
+        for summary in self.store.past_summaries(user, limit=1000):
+            docs.append({"kind": "摘要", "text": summary["summary"], "start_time": summary["start_time"]})
+        for turn in self.store.user_turns(user):
+            docs.append({
+                "kind": "对话",
+                "text": f"用户：{turn['user']}\n咨询师：{turn['assistant']}",
+                "start_time": turn["start_time"],
+            })
+        return docs
+
+    def _clip(self, text: str) -> str:
+        text = " ".join((text or "").split())
+        return text if len(text) <= self.max_chars else text[:self.max_chars] + "…"
+
+
+_memory: Optional[SessionMemory] = None
+_memory_lock = threading.Lock()
+
+
+def get_session_memory() -> SessionMemory:
+    """进程内共享的记忆检索，基于共享的会话索引库"""
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = SessionMemory(get_session_store())
+        return _memory
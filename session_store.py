@@ -0,0 +1,300 @@
+# 咨询会话索引库（SQLite）：按用户、时间、主题建索引，对话内容全文检索，
+# 新会话开始时从这里读取用户的历次咨询次数和摘要
+#
+# 用法:
+#   python session_store.py import [日志目录]
+#   python session_store.py user 小明
+#   python session_store.py search 女朋友 --user 小明
+#   python session_store.py report <会话ID>
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+import session_log
+
+STORE_PATH = os.environ.get("SESSION_STORE_PATH", os.path.join(session_log.LOG_DIR, "consulting_sessions.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_key TEXT NOT NULL,
+    topic TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    total_turns INTEGER NOT NULL DEFAULT 0,
+    summary TEXT,
+    user_info TEXT,
+    path TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_time ON sessions (user_key, start_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_topic_time ON sessions (topic, start_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_time ON sessions (start_time);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp TEXT,
+    user TEXT,
+    assistant TEXT,
+    UNIQUE (session_id, seq)
+);
+"""
+
+# trigram 分词器按3字切分，中文不需要分词也能做子串检索（SQLite >= 3.34）
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    user, assistant, content='turns', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS turns_ai AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts(rowid, user, assistant) VALUES (new.id, new.user, new.assistant);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_ad AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts(turns_fts, rowid, user, assistant) VALUES ('delete', old.id, old.user, old.assistant);
+END;
+"""
+
+
+def user_key(user_info: Dict[str, Any]) -> Optional[str]:
+    """
+    用户标识，只用稳定的 user_id；没有时返回 None。
+    昵称不唯一（默认都是“用户”），按昵称关联会把其他人的历史放进当前用户的提示词。
+    """
+    user_id = user_info.get("user_id")
+    return str(user_id) if user_id else None
+
+
+class SessionStore:
+    """线程安全的会话索引；连接在多个线程间共享，写操作串行"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or STORE_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # 没有 FTS5/trigram 时退回 LIKE 扫描
+            self.fts = False
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add_session(self, session: Dict[str, Any], summary: Optional[str] = None, path: Optional[str] = None):
+        """写入（或覆盖）一个会话，session 为 session_log.read_session 的结构"""
+        user_info = session.get("user_info", {})
+        session_id = session.get("session_id") or path or session.get("path")
+        with self._lock, self._conn:
+            if summary is None:
+                row = self._conn.execute("SELECT summary FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                summary = row["summary"] if row else None
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    session_id,
+                    # 没有 user_id 的会话单独成组，不与任何人的历史合并
+                    user_key(user_info) or f"anonymous:{session_id}",
+                    user_info.get("topic"),
+                    session.get("start_time"),
+                    session.get("end_time"),
+                    len(session.get("session_history", [])),
+                    summary,
+                    json.dumps(user_info, ensure_ascii=False),
+                    path or session.get("path"),
+                ),
+            )
+            self._conn.executemany(
+                "INSERT INTO turns (session_id, seq, timestamp, user, assistant) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (session_id, seq, turn.get("timestamp"), turn.get("user"), turn.get("assistant"))
+                    for seq, turn in enumerate(session.get("session_history", []))
+                ],
+            )
+        return session_id
+
+    def import_directory(self, directory: Optional[str] = None, include_incomplete: bool = False) -> int:
+        """把目录中的会话文件导入索引，返回导入数量"""
+        count = 0
+        for session in session_log.iter_sessions(directory):
+            if session.get("complete", True) or include_incomplete:
+                self.add_session(session)
+                count += 1
+        return count
+
+    def set_summary(self, session_id: str, summary: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE sessions SET summary = ? WHERE session_id = ?", (summary, session_id))
+
+    def get_summary(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row["summary"] if row else None
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取完整会话（含全部轮次）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            turns = self._conn.execute(
+                "SELECT timestamp, user, assistant FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        session = self._session_dict(row)
+        session["session_history"] = [dict(t) for t in turns]
+        return session
+
+    def sessions_for_user(
+        self, user: str, limit: int = 20, since: Optional[str] = None, until: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """用户的会话列表（不含轮次），按开始时间倒序"""
+        return self._list("user_key = ?", (user,), limit, since, until)
+
+    def sessions_by_topic(
+        self, topic: str, limit: int = 20, since: Optional[str] = None, until: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        return self._list("topic = ?", (topic,), limit, since, until)
+
+    def session_count(self, user: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions WHERE user_key = ?", (user,)).fetchone()[0]
+
+    def past_summaries(self, user: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """用户最近几次有摘要的会话，按时间正序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT start_time, topic, summary FROM sessions "
+                "WHERE user_key = ? AND summary IS NOT NULL ORDER BY start_time DESC LIMIT ?",
+                (user, limit),
+            ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+    def user_version(self, user: str) -> tuple:
+        """用户会话数和摘要数，任一变化说明该用户的历史有更新"""
+        with self._lock:
+            return tuple(self._conn.execute(
+                "SELECT COUNT(*), COUNT(summary) FROM sessions WHERE user_key = ?", (user,)
+            ).fetchone())
+
+    def user_turns(self, user: str) -> List[Dict[str, Any]]:
+        """用户所有历史轮次，按时间正序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT t.session_id, t.seq, t.timestamp, t.user, t.assistant, s.topic, s.start_time "
+                "FROM turns t JOIN sessions s ON s.session_id = t.session_id "
+                "WHERE s.user_key = ? ORDER BY s.start_time, t.seq",
+                (user,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def search(self, query: str, user: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """在对话内容中全文检索，返回匹配的轮次"""
+        params: List[Any] = []
+        if self.fts and len(query) >= 3:
+            sql = (
+                "SELECT t.session_id, t.seq, t.timestamp, t.user, t.assistant, s.user_key, s.topic "
+                "FROM turns_fts f JOIN turns t ON t.id = f.rowid JOIN sessions s ON s.session_id = t.session_id "
+                "WHERE turns_fts MATCH ?"
+            )
+            params.append('"' + query.replace('"', '""') + '"')
+        else:
+            sql = (
+                "SELECT t.session_id, t.seq, t.timestamp, t.user, t.assistant, s.user_key, s.topic "
+                "FROM turns t JOIN sessions s ON s.session_id = t.session_id "
+                "WHERE (t.user LIKE ? OR t.assistant LIKE ?)"
+            )
+            params += [f"%{query}%", f"%{query}%"]
+        if user is not None:
+            sql += " AND s.user_key = ?"
+            params.append(user)
+        sql += " ORDER BY t.timestamp DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [dict(r) for r in self._conn.execute(sql, params).fetchall()]
+
+    def seed_user_info(self, user_info: Dict[str, Any], summaries: int = 3) -> Dict[str, Any]:
+        """补全新会话的咨询次数和历次摘要；没有 user_id 时按首次咨询处理"""
+        user = user_key(user_info)
+        seeded = dict(user_info)
+        if user is None:
+            seeded.setdefault("session_count", 1)
+            seeded["past_summaries"] = []
+            return seeded
+        seeded["session_count"] = self.session_count(user) + 1
+        seeded["past_summaries"] = self.past_summaries(user, summaries)
+        return seeded
+
+    def _list(self, where: str, params: tuple, limit: int, since: Optional[str], until: Optional[str]):
+        sql = f"SELECT * FROM sessions WHERE {where}"
+        if since is not None:
+            sql += " AND start_time >= ?"
+            params += (since,)
+        if until is not None:
+            sql += " AND start_time < ?"
+            params += (until,)
+        sql += " ORDER BY start_time DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + (limit,)).fetchall()
+        return [self._session_dict(r) for r in rows]
+
+    @staticmethod
+    def _session_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        session = dict(row)
+        session["user_info"] = json.loads(session["user_info"] or "{}")
+        return session
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """进程内共享的会话索引"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="咨询会话索引")
+    parser.add_argument("--db", default=None, help="索引库路径")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="导入会话日志目录")
+    p_import.add_argument("directory", nargs="?", default=None)
+    p_user = sub.add_parser("user", help="列出用户的会话")
+    p_user.add_argument("user")
+    p_user.add_argument("--limit", type=int, default=20)
+    p_report = sub.add_parser("report", help="显示会话的咨询报告")
+    p_report.add_argument("session_id")
+    p_search = sub.add_parser("search", help="全文检索对话内容")
+    p_search.add_argument("query")
+    p_search.add_argument("--user", default=None)
+    p_search.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    store = SessionStore(args.db)
+    if args.command == "import":
+        print(f"已导入 {store.import_directory(args.directory)} 个会话")
+    elif args.command == "user":
+        for s in store.sessions_for_user(args.user, args.limit):
+            print(f"{s['start_time']}  {s['topic']}  {s['total_turns']}轮  {s['session_id']}")
+    elif args.command == "report":
+        print(store.get_summary(args.session_id) or "报告尚未生成")
+    else:
+        for r in store.search(args.query, args.user, args.limit):
+            print(f"{r['timestamp']}  [{r['user_key']}] 用户: {r['user']}\n    咨询师: {r['assistant']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# 多进程分片监控：按设备地址哈希把设备分到多个工作进程，每个进程一个事件循环、一个连接池，
+# 告警和状态快照经 multiprocessing 队列（管道）回传给协调进程，分片进程崩溃后自动重启
+#
+# 用法:
+#   python sharded_monitor.py --devices-file devices.txt --shards 8
+#   python device_stub.py --port 8080 &
+#   python sharded_monitor.py --stub-url http://127.0.0.1:8080 --count 2000 --no-interventions
+import argparse
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger("ShardedMonitor")
+
+MSG_READY = "ready"
+MSG_ALERT = "alert"
+MSG_SNAPSHOT = "snapshot"
+
+# 协调进程导出的汇总指标；各分片进程的详细指标在 metrics_port + 1 + 分片号 上
+SHARDS_ALIVE = metrics.Gauge("monitor_shards_alive", "Shard worker processes currently running")
+SHARD_RESTARTS = metrics.Counter("monitor_shard_restarts_total", "Shard worker processes restarted after exiting")
+FLEET_ALERTS = metrics.Counter("monitor_fleet_alerts_total", "Alerts reported by all shards")
+FLEET_DEVICES = metrics.Gauge("monitor_fleet_devices", "Devices in the latest shard snapshots by risk level", ["risk_level"])
+
+
+# 分片连续运行这么久后，下次异常退出重新从1秒开始退避
+STABLE_SECONDS = 60
+
+
+def shard_for(device_url: str, shards: int) -> int:
+    """稳定哈希：同一设备在重启前后总是落到同一个分片"""
+    return zlib.crc32(device_url.encode("utf-8")) % shards
+
+
+def run_shard(shard_id: int, device_urls: List[str], config: Dict[str, Any], channel, stop_event):
+    """分片进程入口"""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_shard_main(shard_id, device_urls, config, channel, stop_event))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _shard_main(shard_id: int, device_urls: List[str], config: Dict[str, Any], channel, stop_event):
+    import aiohttp
+
+    from motion_guard import HeartRateMonitor
+    from poll_scheduler import PollPolicy, PollScheduler
+
+    logging.getLogger("HeartRateMonitor").setLevel(config["log_level"])
+    if config["metrics_port"]:
+        metrics.start_http_server(config["metrics_port"] + 1 + shard_id)
+    connector = aiohttp.TCPConnector(limit=config["max_connections"])
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=10)) as http:
+        monitors = {}
+        for url in device_urls:
+            monitor = HeartRateMonitor(url, session=http, transport=config["transport"])
+            monitor.intervention_url = config["intervention_url"]
+            monitor.prewarm_url = (
+                config["intervention_url"].rsplit("/", 1)[0] + "/prewarm" if config["trigger_interventions"] else None
+            )
+            monitor.poll_policy = PollPolicy(base_interval=config["interval"])
+            monitor.alert_handler = _alert_forwarder(monitor, shard_id, channel, config["trigger_interventions"])
+            monitors[url] = monitor
+
+        # 轮询模式下整个分片共用一个调度器；推送模式下每个设备一个订阅协程
+        scheduler = None
+        tasks = []
+        if config["transport"] == "poll":
+            scheduler = PollScheduler(
+                lambda device_id: monitors[device_id]._scheduled_poll(device_id),
+                PollPolicy(base_interval=config["interval"]),
+                max_concurrency=config["max_connections"],
+            )
+            scheduler.add_devices(monitors)
+            tasks.append(asyncio.create_task(scheduler.run()))
+        else:
+            for monitor in monitors.values():
+                tasks.append(asyncio.create_task(monitor.monitoring_loop()))
+        channel.put((MSG_READY, shard_id, os.getpid(), len(monitors)))
+
+        next_snapshot = time.monotonic() + config["snapshot_interval"]
+        while not stop_event.is_set():
+            await asyncio.sleep(0.2)
+            if time.monotonic() >= next_snapshot:
+                next_snapshot += config["snapshot_interval"]
+                statuses = {url: m.get_current_status() for url, m in monitors.items()}
+                channel.put((MSG_SNAPSHOT, shard_id, statuses, scheduler.stats() if scheduler else None))
+
+        if scheduler is not None:
+            scheduler.stop()
+        for monitor in monitors.values():
+            await monitor.stop_monitoring()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=5)
+            for task in pending:
+                task.cancel()
+
+
+def _alert_forwarder(monitor, shard_id: int, channel, trigger: bool):
+    async def handle(alert_data: Dict[str, Any]):
+        channel.put((MSG_ALERT, shard_id, monitor.base_url, alert_data))
+        if trigger:
+            await monitor.trigger_llm_intervention(alert_data)
+    return handle
+
+
+class ShardedMonitor:
+    """
+    分片监控的协调进程。
+
+    on_alert(device_url, alert_data) 在协调进程的读取线程中回调；status() 汇总各分片最近一次快照。
+    分片进程异常退出后按 1, 2, 4 … 30 秒退避重启；连续运行 STABLE_SECONDS 秒后退避重置。
+    """
+
+    def __init__(
+        self,
+        device_urls: List[str],
+        shards: Optional[int] = None,
+        transport: str = "poll",
+        interval: float = 5,
+        intervention_url: str = "http://127.0.0.1:5005/intervene",
+        trigger_interventions: bool = True,
+        snapshot_interval: float = 5,
+        max_connections: int = 200,
+        log_level: str = "WARNING",
+        metrics_port: Optional[int] = None,
+        on_alert: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
+    ):
+        self.shards = shards or os.cpu_count() or 1
+        self.config = {
+            "transport": transport,
+            "interval": interval,
+            "intervention_url": intervention_url,
+            "trigger_interventions": trigger_interventions,
+            "snapshot_interval": snapshot_interval,
+            "max_connections": max_connections,
+            "log_level": log_level,
+            "metrics_port": metrics_port,
+        }
+        self.on_alert = on_alert
+        self.assignments: List[List[str]] = [[] for _ in range(self.shards)]
+        for url in dict.fromkeys(device_urls):
+            self.assignments[shard_for(url, self.shards)].append(url)
+
+        # spawn：子进程不继承父进程的事件循环和线程
+        self._ctx = mp.get_context("spawn")
+        self._channel = self._ctx.Queue()
+        self._stop_event = self._ctx.Event()
+        self._processes: Dict[int, Any] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._started_at: Dict[int, float] = {}
+        # 连续异常退出次数，决定退避时长；restarts 是累计重启次数
+        self._failures: Counter = Counter()
+        self._lock = threading.Lock()
+        self._running = False
+
+        self.restarts: Counter = Counter()
+        self.snapshots: Dict[int, Dict[str, Any]] = {}
+        self.shard_stats: Dict[int, Optional[Dict[str, Any]]] = {}
+        self.alerts: deque = deque(maxlen=1000)
+        self.alert_count = 0
+
+    def start(self):
+        self._running = True
+        SHARDS_ALIVE.set_function(lambda: sum(p.is_alive() for p in list(self._processes.values())))
+        FLEET_DEVICES.set_function(self._risk_counts)
+        for shard_id, urls in enumerate(self.assignments):
+            if urls:
+                self._spawn(shard_id)
+        threading.Thread(target=self._read_loop, name="shard-reader", daemon=True).start()
+        threading.Thread(target=self._supervise, name="shard-supervisor", daemon=True).start()
+        logger.info(f"已启动 {len(self._processes)} 个分片，共 {sum(map(len, self.assignments))} 台设备")
+
+    def stop(self, timeout: float = 10):
+        self._running = False
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            processes = list(self._processes.values())
+        for proc in processes:
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                proc.terminate()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            alive = sum(1 for p in self._processes.values() if p.is_alive())
+            polls = sum((s or {}).get("polls", 0) for s in self.shard_stats.values())
+            alerts = self.alert_count
+            restarts = sum(self.restarts.values())
+        risk_levels = self._risk_counts()
+        return {
+            "shards": len(self._processes),
+            "alive": alive,
+            "devices": sum(map(len, self.assignments)),
+            "reporting": sum(risk_levels.values()),
+            "risk_levels": risk_levels,
+            "polls": polls,
+            "alerts": alerts,
+            "restarts": restarts,
+        }
+
+    def _risk_counts(self) -> Dict[str, int]:
+        with self._lock:
+            snapshots = [s for snapshot in self.snapshots.values() for s in snapshot.values()]
+        return dict(Counter(s.get("risk_level") for s in snapshots if s.get("status") == "active"))
+
+    def _spawn(self, shard_id: int):
+        proc = self._ctx.Process(
+            target=run_shard,
+            args=(shard_id, self.assignments[shard_id], self.config, self._channel, self._stop_event),
+            name=f"monitor-shard-{shard_id}",
+            daemon=True,
+        )
+        proc.start()
+        with self._lock:
+            self._processes[shard_id] = proc
+            self._started_at[shard_id] = time.monotonic()
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                message = self._channel.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            kind, shard_id = message[0], message[1]
+            if kind == MSG_READY:
+                logger.info(f"分片 {shard_id} 就绪 (pid={message[2]}, {message[3]} 台设备)")
+            elif kind == MSG_SNAPSHOT:
+                with self._lock:
+                    self.snapshots[shard_id] = message[2]
+                    self.shard_stats[shard_id] = message[3]
+            elif kind == MSG_ALERT:
+                device_url, alert_data = message[2], message[3]
+                with self._lock:
+                    self.alert_count += 1
+                    self.alerts.append((device_url, alert_data))
+                FLEET_ALERTS.inc()
+                if self.on_alert is not None:
+                    try:
+                        self.on_alert(device_url, alert_data)
+                    except Exception as e:
+                        logger.error(f"告警回调出错: {e}")
+
+    def _supervise(self):
+        while self._running:
+            time.sleep(1)
+            now = time.monotonic()
+            with self._lock:
+                dead = [(i, p) for i, p in self._processes.items() if not p.is_alive()]
+                for shard_id, started in self._started_at.items():
+                    if self._failures[shard_id] and now - started >= STABLE_SECONDS and self._processes[shard_id].is_alive():
+                        self._failures[shard_id] = 0
+            for shard_id, proc in dead:
+                if not self._running:
+                    return
+                if shard_id not in self._restart_at:
+                    delay = min(2 ** self._failures[shard_id], 30)
+                    self._restart_at[shard_id] = now + delay
+                    logger.error(f"分片 {shard_id} 异常退出 (exitcode={proc.exitcode})，{delay} 秒后重启")
+                elif now >= self._restart_at[shard_id]:
+                    del self._restart_at[shard_id]
+                    with self._lock:
+                        self._failures[shard_id] += 1
+                        self.restarts[shard_id] += 1
+                    SHARD_RESTARTS.inc()
+                    self._spawn(shard_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多进程分片心率监控")
+    parser.add_argument("--devices-file", help="每行一个设备地址")
+    parser.add_argument("--stub-url", help="device_stub.py 地址，与 --count 一起生成 /devices/<i> 设备")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--shards", type=int, default=None, help="默认等于CPU核数")
+    parser.add_argument("--transport", choices=["poll", "sse", "websocket"], default="poll")
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--no-interventions", action="store_true", help="只上报告警，不调用干预服务")
+    parser.add_argument("--status-every", type=float, default=5)
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="协调进程在该端口提供 /metrics，分片 i 使用该端口 + 1 + i")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.devices_file:
+        with open(args.devices_file, encoding="utf-8") as f:
+            urls = [line.strip() for line in f if line.strip()]
+    elif args.stub_url:
+        urls = [f"{args.stub_url.rstrip('/')}/devices/{i}" for i in range(args.count)]
+    else:
+        parser.error("需要 --devices-file 或 --stub-url")
+
+    supervisor = ShardedMonitor(
+        urls,
+        shards=args.shards,
+        transport=args.transport,
+        interval=args.interval,
+        trigger_interventions=not args.no_interventions,
+        snapshot_interval=args.status_every,
+        metrics_port=args.metrics_port,
+    )
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+    supervisor.start()
+    try:
+        while True:
+            time.sleep(args.status_every)
+            print(supervisor.status(), flush=True)
+    except KeyboardInterrupt:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# 启动耗时基准：在独立子进程中导入各服务模块，统计导入耗时、加载了哪些重依赖、启动了多少线程
+#
+# 用法:
+#   python startup_bench.py
+#   python startup_bench.py --modules LLM_inter emotional_consulting --repeat 10 --top 8
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MODULES = [
+    "LLM_inter",
+    "intervention_asgi",
+    "emotional_consulting",
+    "mcp_client_servers",
+    "intervention_session",
+    "audio_output",
+    "motion_guard",
+]
+
+# 导入阶段不应该被加载的重依赖
+HEAVY_MODULES = ["tkinter", "pydub", "playsound", "pyaudio", "numpy", "mcp", "openai", "requests", "aiohttp"]
+
+PROBE = """
+import json, sys, threading, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_ms": round(elapsed * 1000, 1),
+    "threads": threading.active_count(),
+    "heavy_loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def probe(module):
+    """在新解释器中导入模块一次，返回测量结果和 -X importtime 输出"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=HERE, capture_output=True, text=True, timeout=120,
+    )
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        return {"error": (errors or ["no output"])[-1]}, ""
+    return json.loads(lines[-1]), proc.stderr
+
+
+def top_imports(importtime_output, module, top):
+    """按累计耗时列出被测模块最慢的直接依赖"""
+    # importtime 先输出子模块再输出父模块，缩进1是顶层导入，缩进3是其直接依赖
+    rows, pending = [], []
+    for line in importtime_output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        depth, name = len(match.group(3)), match.group(4)
+        if depth == 3:
+            pending.append((int(match.group(2)) / 1000, name))
+        elif depth == 1:
+            if name == module:
+                rows = pending
+            pending = []
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for ms, name in sorted(rows, reverse=True)[:top]]
+
+
+def bench(module, repeat, top):
+    runs = []
+    importtime_output = ""
+    for _ in range(repeat):
+        result, importtime_output = probe(module)
+        if "error" in result:
+            return {"module": module, "error": result["error"]}
+        runs.append(result)
+    times = [r["import_ms"] for r in runs]
+    return {
+        "module": module,
+        "import_ms_median": round(statistics.median(times), 1),
+        "import_ms_min": min(times),
+        "threads_after_import": runs[-1]["threads"],
+        "heavy_loaded": runs[-1]["heavy_loaded"],
+        "slowest_imports": top_imports(importtime_output, module, top),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="服务模块启动耗时基准")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="列出最慢的前N个依赖")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = [bench(module, args.repeat, args.top) for module in args.modules]
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    for r in results:
+        if "error" in r:
+            print(f"{r['module']:<22} ERROR: {r['error']}")
+            continue
+        print(
+            f"{r['module']:<22} {r['import_ms_median']:>8.1f} ms (min {r['import_ms_min']:.1f})  "
+            f"threads={r['threads_after_import']}  heavy={','.join(r['heavy_loaded']) or '-'}"
+        )
+        for item in r["slowest_imports"]:
+            print(f"{'':<24}{item['cumulative_ms']:>8.1f} ms  {item['module']}")
+
+
+if __name__ == "__main__":
+    main()
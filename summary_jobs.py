@@ -0,0 +1,201 @@
+# 后台会话摘要：会话结束或上下文压缩时只提交任务，由后台线程把多个会话合并成一次LLM调用，
+# 结果写入会话索引库或回调给仍在进行的会话，用户结束会话时不用等待摘要生成
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import llm_scheduler
+import metrics
+
+logger = logging.getLogger("SummaryJobs")
+
+KIND_CONTEXT = "context"  # 会话进行中压缩上下文用的摘要
+KIND_REPORT = "report"    # 会话结束后的咨询报告，保存到会话索引库
+
+PROMPTS = {
+    KIND_CONTEXT: "请用300字左右总结当前咨询会话的核心内容，包括用户的主要问题、情绪状态、重要事件和已讨论的解决方案。保持客观专业。",
+    KIND_REPORT: """作为情感咨询师，请用专业且温暖的语言总结：
+1. 当前咨询的主要进展和突破
+2. 用户的核心情感问题和模式
+3. 已经讨论的有效解决方案
+4. 下一步的具体咨询建议和行动计划
+
+请以咨询报告的形式呈现，保持条理清晰。""",
+}
+
+MAX_TRANSCRIPT_CHARS = 6000
+
+PENDING = metrics.Gauge("summary_jobs_pending", "Session summaries waiting for the background worker")
+BATCH_SIZE = metrics.Histogram("summary_batch_size", "Summary jobs taken by the worker per batch", buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+JOB_DELAY = metrics.Histogram(
+    "summary_job_delay_seconds", "Time from submitting a summary job to delivering the summary",
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+
+
+def transcript(history: List[Dict[str, Any]], max_chars: int = MAX_TRANSCRIPT_CHARS) -> str:
+    """把会话记录整理成对话文本，过长时保留最近的部分"""
+    text = "\n".join(f"用户：{turn['user']}\n咨询师：{turn['assistant']}" for turn in history)
+    return text if len(text) <= max_chars else "…" + text[-max_chars:]
+
+
+def summarize(client, kind: str, text: str, max_tokens: int = 800) -> str:
+    """同步生成单个会话的摘要（不写入会话上下文）"""
+    response = llm_scheduler.complete(
+        client,
+        "summary",
+        model="deepseek-chat",
+        messages=[
+            {"role": "system", "content": "你是资深心理咨询师，负责整理咨询记录。"},
+            {"role": "user", "content": f"{PROMPTS[kind]}\n\n# 咨询记录\n{text}"},
+        ],
+        temperature=0.3,
+        max_tokens=max_tokens,
+    )
+    return response.choices[0].message.content
+
+
+class SummaryJob:
+    def __init__(self, kind: str, session_id: str, text: str, callback: Optional[Callable[[str], None]] = None):
+        self.kind = kind
+        self.session_id = session_id
+        self.text = text
+        self.callback = callback
+        self.created_at = time.time()
+
+
+class SummaryJobQueue:
+    """
+    后台摘要队列。
+
+    单个工作线程取出任务后再等待最多 batch_wait 秒凑够 batch_size 个，同类任务合并为一次
+    JSON 输出的LLM调用；合并结果缺失的会话单独补做。报告类摘要写入 store，
+    其它结果交给任务的 callback。
+    """
+
+    def __init__(
+        self,
+        store=None,
+        client_getter: Optional[Callable[[], Any]] = None,
+        batch_size: int = 4,
+        batch_wait: float = 2.0,
+    ):
+        self.store = store
+        self.client_getter = client_getter
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue: "queue.Queue[Optional[SummaryJob]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name="summary-jobs", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, session_id: str, history: List[Dict[str, Any]], callback=None) -> SummaryJob:
+        job = SummaryJob(kind, session_id, transcript(history), callback)
+        self._queue.put(job)
+        return job
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None):
+        """处理完已提交的任务后退出"""
+        self._queue.put(None)
+        if wait:
+            self._thread.join(timeout)
+
+    def _client(self):
+        if self.client_getter is None:
+            from emotional_consulting import get_client
+            self.client_getter = get_client
+        return self.client_getter()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            stop = False
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    job = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            for kind in {j.kind for j in batch}:
+                self._run_batch([j for j in batch if j.kind == kind])
+            if stop:
+                return
+
+    def _run_batch(self, jobs: List[SummaryJob]):
+        BATCH_SIZE.observe(len(jobs))
+        results: Dict[int, str] = {}
+        if len(jobs) > 1:
+            try:
+                results = self._summarize_many(jobs)
+            except Exception as e:
+                logger.warning(f"批量摘要失败，改为逐个生成: {e}")
+        for i, job in enumerate(jobs):
+            summary = results.get(i)
+            if not summary:
+                try:
+                    summary = summarize(self._client(), job.kind, job.text)
+                except Exception as e:
+                    logger.error(f"会话 {job.session_id} 摘要失败: {e}")
+                    continue
+            self._deliver(job, summary)
+
+    def _summarize_many(self, jobs: List[SummaryJob]) -> Dict[int, str]:
+        """一次调用为多个会话生成摘要，返回 {任务下标: 摘要}"""
+        sections = "\n\n".join(f"## 会话{i}\n{job.text}" for i, job in enumerate(jobs))
+        response = llm_scheduler.complete(
+            self._client(),
+            "summary_batch",
+            model="deepseek-chat",
+            messages=[
+                {"role": "system", "content": "你是资深心理咨询师，负责整理咨询记录。"},
+                {
+                    "role": "user",
+                    "content": (
+                        f"下面有{len(jobs)}个互不相关的咨询会话。请对每个会话分别完成以下要求：\n{PROMPTS[jobs[0].kind]}\n\n"
+                        f"以JSON对象输出，键为会话编号（如 \"0\"），值为该会话的总结文本。\n\n{sections}"
+                    ),
+                },
+            ],
+            temperature=0.3,
+            max_tokens=min(8000, 800 * len(jobs)),
+            response_format={"type": "json_object"},
+        )
+        data = json.loads(response.choices[0].message.content)
+        return {int(k): v for k, v in data.items() if str(k).isdigit() and isinstance(v, str) and int(k) < len(jobs)}
+
+    def _deliver(self, job: SummaryJob, summary: str):
+        JOB_DELAY.observe(time.time() - job.created_at)
+        try:
+            if job.kind == KIND_REPORT and self.store is not None:
+                self.store.set_summary(job.session_id, summary)
+            if job.callback is not None:
+                job.callback(summary)
+        except Exception as e:
+            logger.error(f"保存会话 {job.session_id} 摘要失败: {e}")
+
+
+_queue: Optional[SummaryJobQueue] = None
+_queue_lock = threading.Lock()
+PENDING.set_function(lambda: _queue.pending() if _queue is not None else 0)
+
+
+def get_summary_queue() -> SummaryJobQueue:
+    """进程内共享的摘要队列，结果写入共享的会话索引库"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            from session_store import get_session_store
+            _queue = SummaryJobQueue(get_session_store())
+        return _queue
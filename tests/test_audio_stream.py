@@ -0,0 +1,61 @@
+# 流式PCM写WAV：跨块拼接半个采样、关闭时回填文件头长度
+import os
+import wave
+
+import pytest
+
+pytest.importorskip("requests")
+
+import audio
+from tts_client import CHANNELS, SAMPLE_RATE, SAMPLE_WIDTH
+
+FRAME = SAMPLE_WIDTH * CHANNELS
+
+
+def pcm(frames):
+    return bytes(i % 251 for i in range(frames * FRAME))
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as wav:
+        return wav.getparams(), wav.readframes(wav.getnframes())
+
+
+def test_header_is_patched_with_the_streamed_length(tmp_path):
+    data = pcm(1000)
+    path = str(tmp_path / "out.wav")
+    with audio.StreamingWavWriter(path) as writer:
+        # 块边界故意落在采样中间
+        for i in range(0, len(data), 333):
+            writer.write(data[i:i + 333])
+
+    params, frames = read_wav(path)
+    assert writer.frames_written == 1000
+    assert (params.nchannels, params.sampwidth, params.framerate, params.nframes) == (CHANNELS, SAMPLE_WIDTH, SAMPLE_RATE, 1000)
+    assert frames == data
+    assert os.path.getsize(path) == 44 + len(data)
+
+
+def test_trailing_partial_sample_is_dropped(tmp_path):
+    path = str(tmp_path / "out.wav")
+    with audio.StreamingWavWriter(path) as writer:
+        writer.write(pcm(10) + b"\x01")
+
+    params, frames = read_wav(path)
+    assert params.nframes == 10
+    assert frames == pcm(10)
+
+
+def test_save_stream_response_writes_every_chunk(tmp_path):
+    data = pcm(500)
+
+    class Response:
+        def iter_content(self, chunk_size):
+            yield data[:7]
+            yield b""
+            yield data[7:]
+
+    audio.save_stream_response(Response(), str(tmp_path))
+
+    _, frames = read_wav(str(tmp_path / "audio_stream.wav"))
+    assert frames == data
@@ -0,0 +1,109 @@
+# 推送订阅的续传、缺口检测和设备重启后的序号重置，使用 device_stub 模拟设备
+import asyncio
+import contextlib
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+
+import device_stub
+import device_transport
+
+
+@contextlib.asynccontextmanager
+async def stub_device(rate=50.0):
+    runner = web.AppRunner(device_stub.DeviceStubServer(rate).app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            yield f"http://127.0.0.1:{port}", session
+    finally:
+        await runner.cleanup()
+
+
+async def collect(transport, until, timeout=10):
+    """读取样本直到 until(样本列表) 为真"""
+    received = []
+    samples = transport.samples()
+    try:
+        async def run():
+            async for data in samples:
+                received.append(data)
+                if await until(received):
+                    return
+        await asyncio.wait_for(run(), timeout)
+    finally:
+        await samples.aclose()
+    return received
+
+
+@pytest.mark.parametrize("mode", [device_transport.MODE_SSE, device_transport.MODE_WEBSOCKET])
+def test_reconnect_after_device_restart(mode):
+    async def scenario():
+        async with stub_device() as (base_url, session):
+            transport = device_transport.make_transport(mode, base_url, lambda: session, reconnect_delay=0.01)
+            restarted = False
+
+            async def until(received):
+                nonlocal restarted
+                if not restarted and received[-1]['seq'] >= 10:
+                    restarted = True
+                    async with session.post(f"{base_url}/control", json={"restart": True}) as resp:
+                        assert resp.status == 200
+                return transport.resets and received[-1]['seq'] >= 5
+
+            received = await collect(transport, until)
+            return transport, [data['seq'] for data in received]
+
+    transport, seqs = asyncio.run(scenario())
+    assert transport.resets == 1
+    assert transport.reconnects >= 1
+    restart_at = next(i for i in range(1, len(seqs)) if seqs[i] < seqs[i - 1])
+    # 重启后的样本没有被当作重复丢弃，且新序号连续
+    after = seqs[restart_at:]
+    assert after[-1] >= 5
+    assert after == sorted(after)
+    assert transport.last_seq == seqs[-1]
+
+
+def test_gap_detection():
+    async def scenario():
+        async with stub_device() as (base_url, session):
+            gaps = []
+            transport = device_transport.SSETransport(base_url, lambda: session, on_gap=lambda a, b: gaps.append((a, b)))
+            async with session.post(f"{base_url}/control", json={"drop_every": 5}) as resp:
+                assert resp.status == 200
+
+            async def until(received):
+                return len(gaps) >= 3
+
+            await collect(transport, until)
+            return transport, gaps
+
+    transport, gaps = asyncio.run(scenario())
+    assert all(first == last and first % 5 == 0 for first, last in gaps)
+    assert transport.gaps == len(gaps)
+    assert transport.missed == len(gaps)
+    assert transport.resets == 0
+
+
+def test_accept_duplicates_and_resets():
+    transport = device_transport.SSETransport("http://device", lambda: None, reset_threshold=100)
+    assert transport._accept({'seq': 500})
+    assert not transport._accept({'seq': 500})
+    # 同一连接内的小幅倒退是重复样本
+    assert not transport._accept({'seq': 450})
+    # 大幅倒退视为设备重启
+    assert transport._accept({'seq': 3})
+    assert transport.resets == 1
+    assert transport.last_seq == 3
+    # 重连后的第一个样本小于 last_seq 也视为重置
+    assert transport._accept({'seq': 10})
+    transport._new_connection = True
+    assert transport._accept({'seq': 2})
+    assert transport.resets == 2
+    assert transport.gaps == 1
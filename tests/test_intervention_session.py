@@ -0,0 +1,124 @@
+# 与界面无关的干预会话引擎：分诊 → 心理疏导 → 结束，分诊和咨询系统用假对象代替
+import asyncio
+
+import pytest
+
+import intervention_session
+from intervention_session import STATE_COUNSELLING, STATE_ENDED, STATE_TRIAGE, TOOL_COUNSELLING, TOOL_EMAIL
+
+
+class FakeConsulting:
+    def __init__(self, user_info):
+        self.user_info = user_info
+        self.session_id = "consult-1"
+        self.turns = []
+        self.saved = 0
+
+    async def aconsult(self, text):
+        self.turns.append(text)
+        return f"回复：{text}"
+
+    def get_session_progress(self):
+        return "咨询报告正在后台生成"
+
+    def save_session_log(self):
+        self.saved += 1
+        return "已保存"
+
+
+def triage_with(*tool_names, text="我在，请慢慢说。"):
+    calls = []
+
+    async def triage(user_input, alert_data):
+        calls.append(user_input)
+        return {
+            "result_str": text,
+            "tool_results": [{"tool_name": name, "result": "ok"} for name in tool_names],
+        }
+
+    triage.calls = calls
+    return triage
+
+
+def make_session(triage, alert_data=None):
+    consultants = []
+
+    def factory(user_info):
+        consultants.append(FakeConsulting(user_info))
+        return consultants[-1]
+
+    session = intervention_session.InterventionSession(
+        alert_data or {"heart_rate": 130, "user_id": "u1"}, triage=triage, consulting_factory=factory
+    )
+    return session, consultants
+
+
+def test_triage_hands_over_to_counselling_and_ends_on_end_word():
+    session, consultants = make_session(triage_with(TOOL_EMAIL, TOOL_COUNSELLING))
+
+    async def scenario():
+        start = await session.start()
+        first = await session.send_message("我心跳得好快")
+        assert session.state == STATE_COUNSELLING
+        second = await session.send_message("好多了，谢谢")
+        last = await session.send_message("结束吧")
+        return start, first, second, last
+
+    start, first, second, last = asyncio.run(scenario())
+    assert "130" in start[0]["text"]
+    assert any(e["kind"] == "notice" and "邮件" in e["text"] for e in first)
+    consulting = consultants[0]
+    assert consulting.user_info["user_id"] == "u1"
+    assert consulting.turns == ["好多了，谢谢", "结束吧"]
+    assert [e["text"] for e in second if e["role"] == "counsellor"] == ["回复：好多了，谢谢"]
+    assert session.state == STATE_ENDED
+    assert consulting.saved == 1
+    assert session.result["counselling"] is True
+    assert session.result["consulting_session_id"] == "consult-1"
+
+
+def test_triage_without_tools_stays_in_triage():
+    triage = triage_with()
+    session, consultants = make_session(triage)
+
+    asyncio.run(session.send_message("还好"))
+
+    assert session.state == STATE_TRIAGE
+    assert consultants == []
+    assert triage.calls == ["还好"]
+
+
+def test_triage_error_propagates_and_session_can_retry():
+    attempts = []
+
+    async def triage(user_input, alert_data):
+        attempts.append(user_input)
+        if len(attempts) == 1:
+            raise TimeoutError("LLM调用 triage 超过截止时间")
+        return {"result_str": "我在", "tool_results": [{"tool_name": TOOL_COUNSELLING, "result": "ok"}]}
+
+    session, _ = make_session(triage)
+
+    async def scenario():
+        with pytest.raises(TimeoutError):
+            await session.send_message("救命")
+        assert session.state == STATE_TRIAGE
+        await session.send_message("救命")
+
+    asyncio.run(scenario())
+    assert session.state == STATE_COUNSELLING
+    assert attempts == ["救命", "救命"]
+
+
+def test_end_saves_an_open_counselling_session():
+    session, consultants = make_session(triage_with(TOOL_COUNSELLING))
+
+    async def scenario():
+        await session.send_message("难受")
+        return await session.end()
+
+    events = asyncio.run(scenario())
+    assert session.ended
+    assert consultants[0].saved == 1
+    assert any("已保存" in e["text"] for e in events)
+    assert asyncio.run(session.send_message("还在吗")) == []
@@ -0,0 +1,136 @@
+# 对冲请求和截止时间后的降级，主服务和备用服务都用 llm_stub 模拟
+import asyncio
+import itertools
+import time
+from concurrent import futures
+
+import pytest
+
+openai = pytest.importorskip("openai")
+
+import llm_resilience
+import llm_scheduler
+import llm_stub
+import metrics
+
+MESSAGES = [{"role": "user", "content": "我心跳很快"}]
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    """每个测试使用独立的调度器和延迟样本，不配置备用服务"""
+    monkeypatch.setattr(llm_scheduler, "_scheduler", llm_scheduler.LLMScheduler())
+    monkeypatch.setattr(llm_resilience, "LATENCIES", llm_resilience.LatencyWindow())
+    monkeypatch.setattr(llm_resilience, "FALLBACK_BASE_URL", None)
+    monkeypatch.setattr(llm_resilience, "_fallback_clients", {})
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(delays=(0.0,), reply=llm_stub.DEFAULT_REPLY):
+        """delays 依次作为每个请求的首 token 延迟，用完后重复最后一个"""
+        server = llm_stub.StubLLMServer(reply=reply)
+        planned = itertools.chain(delays, itertools.repeat(delays[-1]))
+
+        def plan():
+            with server._lock:
+                server.requests_served += 1
+                return "ok", next(planned)
+
+        server._plan = plan
+        servers.append(server.start())
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def call(asynchronous, base_url, name, **request):
+    request = dict(model="stub", messages=MESSAGES, **request)
+    if asynchronous:
+        async def run():
+            client = openai.AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=0)
+            try:
+                return await llm_resilience.acomplete(client, name, **request)
+            finally:
+                await client.close()
+        return asyncio.run(run())
+    client = openai.OpenAI(api_key="stub", base_url=base_url, max_retries=0)
+    return llm_resilience.complete(client, name, **request)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True], ids=["sync", "async"])
+def test_hedge_wins_over_slow_primary(monkeypatch, stub, asynchronous):
+    monkeypatch.setitem(llm_resilience.DEADLINES, "consult", 2.0)
+    server = stub(delays=(5.0, 0.0))
+    wins = llm_resilience.HEDGE_WINS.labels("consult").value
+
+    started = time.monotonic()
+    response = call(asynchronous, server.base_url, "consult")
+    elapsed = time.monotonic() - started
+
+    assert response.choices[0].message.content == llm_stub.DEFAULT_REPLY
+    # 没有延迟样本时在截止时间的一半发出对冲
+    assert 0.9 <= elapsed < 2.0
+    assert server.requests_served == 2
+    assert llm_resilience.HEDGE_WINS.labels("consult").value == wins + 1
+
+
+@pytest.mark.parametrize("asynchronous", [False, True], ids=["sync", "async"])
+def test_deadline_falls_back_to_canned_consult_reply(monkeypatch, stub, asynchronous):
+    monkeypatch.setitem(llm_resilience.DEADLINES, "consult", 0.6)
+    server = stub(delays=(5.0,))
+    errors = metrics.LLM_ERRORS.labels("consult").value
+    canned = llm_resilience.FALLBACKS.labels("consult", "canned").value
+
+    response = call(asynchronous, server.base_url, "consult")
+
+    assert response.choices[0].message.content == llm_resilience.CANNED["consult"]
+    assert llm_resilience.FALLBACKS.labels("consult", "canned").value == canned + 1
+    assert metrics.LLM_ERRORS.labels("consult").value == errors + 1
+
+
+@pytest.mark.parametrize("asynchronous", [False, True], ids=["sync", "async"])
+def test_triage_deadline_raises_instead_of_canned_reply(monkeypatch, stub, asynchronous):
+    monkeypatch.setitem(llm_resilience.DEADLINES, "triage", 0.6)
+    server = stub(delays=(5.0,))
+    errors = metrics.LLM_ERRORS.labels("triage").value
+
+    with pytest.raises(TimeoutError):
+        call(asynchronous, server.base_url, "triage", tools=None)
+
+    assert metrics.LLM_ERRORS.labels("triage").value == errors + 1
+
+
+def test_deadline_falls_back_to_secondary_endpoint(monkeypatch, stub):
+    monkeypatch.setitem(llm_resilience.DEADLINES, "triage", 0.6)
+    primary = stub(delays=(5.0,))
+    secondary = stub(reply="备用服务的回复")
+    monkeypatch.setattr(llm_resilience, "FALLBACK_BASE_URL", secondary.base_url)
+    fallbacks = llm_resilience.FALLBACKS.labels("triage", "secondary").value
+
+    response = call(True, primary.base_url, "triage")
+
+    assert response.choices[0].message.content == "备用服务的回复"
+    assert secondary.requests_served == 1
+    assert llm_resilience.FALLBACKS.labels("triage", "secondary").value == fallbacks + 1
+
+
+def test_hung_attempts_release_the_pool(monkeypatch, stub):
+    """卡住的请求在截止时间后超时结束，线程池不会被占满"""
+    monkeypatch.setattr(llm_resilience, "_executor", futures.ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setitem(llm_resilience.DEADLINES, "consult", 1.0)
+    # 第一次调用的主请求和对冲请求都卡住30秒，占满两个线程
+    server = stub(delays=(30.0, 30.0, 0.0))
+
+    first = call(False, server.base_url, "consult")
+    assert first.choices[0].message.content == llm_resilience.CANNED["consult"]
+    assert server.requests_served == 2
+
+    time.sleep(0.2)
+    second = call(False, server.base_url, "consult")
+    assert second.choices[0].message.content == llm_stub.DEFAULT_REPLY
+    assert server.requests_served == 3
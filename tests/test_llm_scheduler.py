@@ -0,0 +1,88 @@
+# 调度器按优先级放行、取消时退还额度；端到端请求发往 llm_stub 模拟服务
+import asyncio
+
+import pytest
+
+import llm_scheduler
+from llm_scheduler import COUNSELLING, EMERGENCY, SUMMARY
+
+
+def one_at_a_time(rate=10):
+    """请求桶容量为1且为空：每 1/rate 秒只放行一个请求，放行顺序即排队顺序"""
+    scheduler = llm_scheduler.LLMScheduler()
+    scheduler.requests = llm_scheduler.TokenBucket(rate, 1)
+    scheduler.requests.level = 0
+    return scheduler
+
+
+def test_priority_ordering(monkeypatch):
+    openai = pytest.importorskip("openai")
+    import llm_stub
+
+    scheduler = one_at_a_time()
+    monkeypatch.setattr(llm_scheduler, "_scheduler", scheduler)
+    server = llm_stub.StubLLMServer(delay=0, jitter=0).start()
+    try:
+        async def scenario():
+            client = openai.AsyncOpenAI(api_key="stub", base_url=server.base_url, max_retries=0)
+            finished = []
+
+            async def call(name, priority):
+                await llm_scheduler.acomplete(client, "consult", priority=priority, model="stub",
+                                              messages=[{"role": "user", "content": name}], max_tokens=50)
+                finished.append(name)
+
+            tasks = []
+            for name, priority in [("summary-1", SUMMARY), ("consult", COUNSELLING), ("summary-2", SUMMARY), ("triage", EMERGENCY)]:
+                tasks.append(asyncio.create_task(call(name, priority)))
+                await asyncio.sleep(0)
+            await asyncio.wait_for(asyncio.gather(*tasks), 10)
+            await client.close()
+            return finished
+
+        finished = asyncio.run(scenario())
+    finally:
+        server.stop()
+    assert finished == ["triage", "consult", "summary-1", "summary-2"]
+    assert server.requests_served == 4
+
+
+def test_cancel_after_grant_refunds():
+    scheduler = one_at_a_time(rate=0.001)
+
+    async def scenario():
+        task = asyncio.create_task(scheduler.aacquire(COUNSELLING, 1000))
+        await asyncio.sleep(0)
+        assert scheduler.queued()["counselling"] == 1
+        # 额度在别处分配给了该等待者，但调用方在醒来之前被取消
+        scheduler.requests.level = 1
+        scheduler._retry_dispatch()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    tokens_before = scheduler.tokens.level
+    asyncio.run(scenario())
+    assert scheduler.requests.level == pytest.approx(1, abs=0.01)
+    assert scheduler.tokens.level == pytest.approx(tokens_before, abs=1)
+    assert scheduler.queued()["counselling"] == 0
+
+
+def test_refund_releases_the_next_waiter():
+    scheduler = one_at_a_time(rate=0.001)
+
+    async def scenario():
+        first = asyncio.create_task(scheduler.aacquire(COUNSELLING, 100))
+        second = asyncio.create_task(scheduler.aacquire(COUNSELLING, 100))
+        await asyncio.sleep(0)
+        scheduler.requests.level = 1
+        scheduler._retry_dispatch()
+        first.cancel()
+        # 退还的额度立即分给排在后面的等待者，不用等桶重新补充
+        await asyncio.wait_for(second, 1)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(scenario())
+    assert scheduler.requests.level == pytest.approx(0, abs=0.01)
+    assert scheduler.queued()["counselling"] == 0
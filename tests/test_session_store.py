@@ -0,0 +1,88 @@
+# 会话索引库：按用户隔离、trigram 全文检索（含无 FTS5 时的 LIKE 回退）、覆盖写入和报告读取
+import pytest
+
+import session_store
+
+
+def session(session_id, user_id=None, start="2025-01-01T10:00:00", turns=(), topic="情感咨询"):
+    user_info = {"name": "用户", "topic": topic}
+    if user_id:
+        user_info["user_id"] = user_id
+    return {
+        "session_id": session_id,
+        "user_info": user_info,
+        "start_time": start,
+        "end_time": start,
+        "session_history": [
+            {"timestamp": f"{start}.{i}", "user": user, "assistant": assistant}
+            for i, (user, assistant) in enumerate(turns)
+        ],
+    }
+
+
+@pytest.fixture(params=[True, False], ids=["fts5", "like"])
+def store(request, tmp_path):
+    store = session_store.SessionStore(str(tmp_path / "sessions.db"))
+    if not request.param:
+        store.fts = False
+    yield store
+    store.close()
+
+
+def test_trigram_search_finds_chinese_substrings(store):
+    store.add_session(session("a", "u1", turns=[("我和女朋友吵架了", "发生了什么？"), ("工作压力很大", "慢慢说")]))
+    store.add_session(session("b", "u2", turns=[("女朋友不理我", "你们多久没联系了？")]))
+
+    hits = store.search("女朋友")
+    assert {(h["session_id"], h["seq"]) for h in hits} == {("a", 0), ("b", 0)}
+    assert [h["session_id"] for h in store.search("女朋友", user="u2")] == ["b"]
+    # 少于3个字时 trigram 无法匹配，退回 LIKE
+    assert [(h["session_id"], h["seq"]) for h in store.search("压力")] == [("a", 1)]
+    assert store.search("没有出现过的话") == []
+
+
+def test_search_escapes_quotes(store):
+    store.add_session(session("a", "u1", turns=[('他说"别管我"然后走了', "嗯")]))
+    assert [h["session_id"] for h in store.search('"别管我"')] == ["a"]
+
+
+def test_re_adding_a_session_replaces_its_turns(store):
+    store.add_session(session("a", "u1", turns=[("第一轮的内容", "好")]), summary="摘要")
+    store.add_session(session("a", "u1", turns=[("改写后的内容", "好"), ("第二轮的内容", "好")]))
+
+    assert store.search("第一轮") == []
+    assert len(store.search("第二轮")) == 1
+    saved = store.get("a")
+    assert [t["user"] for t in saved["session_history"]] == ["改写后的内容", "第二轮的内容"]
+    # 覆盖写入不带摘要时保留原有摘要
+    assert saved["summary"] == "摘要"
+
+
+def test_sessions_without_user_id_are_never_grouped(store):
+    store.add_session(session("a", turns=[("匿名一", "嗯")]), summary="A")
+    store.add_session(session("b", turns=[("匿名二", "嗯")]), summary="B")
+
+    assert store.get("a")["user_key"] != store.get("b")["user_key"]
+    seeded = store.seed_user_info({"name": "用户"})
+    assert seeded["session_count"] == 1
+    assert seeded["past_summaries"] == []
+
+
+def test_past_summaries_and_session_count(store):
+    store.add_session(session("a", "u1", start="2025-01-01T10:00:00"), summary="第一次")
+    store.add_session(session("b", "u1", start="2025-01-02T10:00:00"))
+    store.add_session(session("c", "u1", start="2025-01-03T10:00:00"), summary="第三次")
+    store.add_session(session("d", "u2", start="2025-01-04T10:00:00"), summary="别人的")
+
+    seeded = store.seed_user_info({"user_id": "u1"}, summaries=3)
+    assert seeded["session_count"] == 4
+    assert [s["summary"] for s in seeded["past_summaries"]] == ["第一次", "第三次"]
+    assert [s["session_id"] for s in store.sessions_for_user("u1", since="2025-01-02")] == ["c", "b"]
+
+
+def test_background_report_is_readable_once_set(store):
+    store.add_session(session("a", "u1"))
+    assert store.get_summary("a") is None
+    store.set_summary("a", "咨询报告")
+    assert store.get_summary("a") == "咨询报告"
+    assert store.get_summary("missing") is None
@@ -0,0 +1,143 @@
+# 后台摘要队列：合并请求、JSON回复缺失或无效时逐个补做、关闭时处理完已提交的任务
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_scheduler
+import summary_jobs
+
+HISTORY = [{"user": "最近睡不好", "assistant": "我们聊聊睡前都在想什么"}]
+
+
+class FakeClient:
+    """按请求类型返回：批量请求（JSON模式）用 batch_reply(任务数)，单个请求返回 single:<序号>"""
+
+    def __init__(self, batch_reply, delay=0.0):
+        self.batch_reply = batch_reply
+        self.delay = delay
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        time.sleep(self.delay)
+        self.requests.append(request)
+        if request.get("response_format"):
+            content = self.batch_reply(request["messages"][1]["content"].count("## 会话"))
+        else:
+            content = f"single:{len(self.requests)}"
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    def batches(self):
+        return [r for r in self.requests if r.get("response_format")]
+
+    def singles(self):
+        return [r for r in self.requests if not r.get("response_format")]
+
+
+class FakeStore:
+    def __init__(self):
+        self.summaries = {}
+
+    def set_summary(self, session_id, summary):
+        self.summaries[session_id] = summary
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "_scheduler", llm_scheduler.LLMScheduler())
+
+
+def make_queue(client, store=None, **kwargs):
+    kwargs.setdefault("batch_wait", 0.3)
+    return summary_jobs.SummaryJobQueue(store, client_getter=lambda: client, **kwargs)
+
+
+def test_jobs_are_batched_into_one_json_request():
+    client = FakeClient(lambda n: json.dumps({str(i): f"报告{i}" for i in range(n)}, ensure_ascii=False))
+    store = FakeStore()
+    queue = make_queue(client, store)
+    for i in range(3):
+        queue.submit(summary_jobs.KIND_REPORT, f"s{i}", HISTORY)
+    queue.shutdown(wait=True, timeout=5)
+
+    assert len(client.batches()) == 1
+    assert client.singles() == []
+    assert store.summaries == {"s0": "报告0", "s1": "报告1", "s2": "报告2"}
+
+
+def test_batch_size_and_kinds_split_requests():
+    client = FakeClient(lambda n: json.dumps({str(i): f"摘要{i}" for i in range(n)}, ensure_ascii=False))
+    store = FakeStore()
+    delivered = []
+    queue = make_queue(client, store, batch_size=3)
+    queue.submit(summary_jobs.KIND_CONTEXT, "c0", HISTORY, delivered.append)
+    queue.submit(summary_jobs.KIND_REPORT, "r0", HISTORY)
+    queue.submit(summary_jobs.KIND_REPORT, "r1", HISTORY)
+    queue.submit(summary_jobs.KIND_REPORT, "r2", HISTORY)
+    queue.shutdown(wait=True, timeout=5)
+
+    # 第一批 3 个任务按类型拆成上下文（单个）和报告（两个合并），剩下的报告单独一批
+    assert len(client.batches()) == 1
+    assert len(client.singles()) == 2
+    assert delivered and delivered[0].startswith("single:")
+    assert set(store.summaries) == {"r0", "r1", "r2"}
+
+
+def test_partial_json_reply_retries_missing_sessions():
+    client = FakeClient(lambda n: json.dumps({"0": "报告0", "7": "越界", "x": "无效键"}, ensure_ascii=False))
+    store = FakeStore()
+    queue = make_queue(client, store)
+    queue.submit(summary_jobs.KIND_REPORT, "s0", HISTORY)
+    queue.submit(summary_jobs.KIND_REPORT, "s1", HISTORY)
+    queue.shutdown(wait=True, timeout=5)
+
+    assert len(client.batches()) == 1
+    assert len(client.singles()) == 1
+    assert store.summaries["s0"] == "报告0"
+    assert store.summaries["s1"].startswith("single:")
+
+
+def test_malformed_json_reply_falls_back_to_single_requests():
+    client = FakeClient(lambda n: "这不是JSON")
+    store = FakeStore()
+    queue = make_queue(client, store)
+    queue.submit(summary_jobs.KIND_REPORT, "s0", HISTORY)
+    queue.submit(summary_jobs.KIND_REPORT, "s1", HISTORY)
+    queue.shutdown(wait=True, timeout=5)
+
+    assert len(client.singles()) == 2
+    assert set(store.summaries) == {"s0", "s1"}
+
+
+def test_shutdown_drains_submitted_jobs():
+    client = FakeClient(lambda n: json.dumps({str(i): f"报告{i}" for i in range(n)}), delay=0.1)
+    store = FakeStore()
+    queue = make_queue(client, store, batch_size=2, batch_wait=0.05)
+    for i in range(5):
+        queue.submit(summary_jobs.KIND_REPORT, f"s{i}", HISTORY)
+    queue.shutdown(wait=True, timeout=10)
+
+    assert set(store.summaries) == {f"s{i}" for i in range(5)}
+    assert queue.pending() == 0
+    assert not queue._thread.is_alive()
+
+
+def test_shutdown_timeout_returns_while_worker_is_busy():
+    release = threading.Event()
+    client = FakeClient(lambda n: "{}")
+    client.create = lambda **request: release.wait(5) and None
+    client.chat.completions.create = client.create
+    queue = make_queue(client, batch_wait=0.0)
+    queue.submit(summary_jobs.KIND_REPORT, "s0", HISTORY)
+
+    started = time.monotonic()
+    queue.shutdown(wait=True, timeout=0.2)
+    assert time.monotonic() - started < 1
+    assert queue._thread.is_alive()
+    release.set()
+    queue._thread.join(5)
+    assert not queue._thread.is_alive()
@@ -0,0 +1,61 @@
+# text2mp3 单条合成的返回值和错误处理，TTS服务用假客户端代替
+import importlib.machinery
+import importlib.util
+import io
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip("requests")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def text2mp3():
+    # 脚本没有 .py 扩展名，按源文件加载
+    loader = importlib.machinery.SourceFileLoader("text2mp3", os.path.join(ROOT, "text2mp3"))
+    spec = importlib.util.spec_from_loader("text2mp3", loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def archive(*names):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name in names:
+            zf.writestr(name, b"audio:" + name.encode())
+    return buffer.getvalue()
+
+
+class FakeClient:
+    def __init__(self, content):
+        self.content = content
+        self.calls = 0
+
+    def synthesize(self, text, speed=None):
+        self.calls += 1
+        return self.content
+
+
+@pytest.mark.parametrize("member", ["0.mp3", "0.wav"])
+def test_returns_written_path_for_any_format(monkeypatch, tmp_path, text2mp3, member):
+    client = FakeClient(archive(member))
+    monkeypatch.setattr(text2mp3, "get_default_client", lambda: client)
+
+    path = text2mp3.text_to_speech("你好", str(tmp_path))
+
+    assert path == os.path.join(str(tmp_path), text2mp3.content_name("你好") + os.path.splitext(member)[1])
+    assert os.path.exists(path)
+    # 再次合成同一文本直接返回已有文件
+    assert text2mp3.text_to_speech("你好", str(tmp_path)) == path
+    assert client.calls == 1
+
+
+@pytest.mark.parametrize("content", [b"not a zip", archive("0.mp3", "1.mp3")], ids=["bad-zip", "count-mismatch"])
+def test_invalid_archive_returns_none(monkeypatch, tmp_path, text2mp3, content):
+    monkeypatch.setattr(text2mp3, "get_default_client", lambda: FakeClient(content))
+
+    assert text2mp3.text_to_speech("你好", str(tmp_path)) is None
@@ -0,0 +1,305 @@
+# 端到端延迟追踪：与 OpenTelemetry 兼容的 span（trace/span ID、W3C traceparent 传播、OTel 字段名），
+# 导出到本地 JSONL 文件。一次告警对应一条 trace，trace ID 即 incident ID，
+# 覆盖 心率拉取 → 分析 → 触发干预 → MCP分诊 → 疏导 → 语音播放 的完整链路
+#
+# 设置 TRACE_FILE=traces.jsonl 开启导出；查看某次告警的耗时分布:
+#   python tracing.py traces.jsonl --incident <incident_id>
+import argparse
+import contextvars
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME") or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+HEX32_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# 跨进程传来的父 span，只有 ID
+SpanContext = namedtuple("SpanContext", ["trace_id", "span_id"])
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+        start_ns: Optional[int] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.events: List[Dict[str, Any]] = []
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "UNSET"
+        self.status_message: Optional[str] = None
+
+    @property
+    def incident_id(self) -> str:
+        return self.trace_id
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({"name": name, "timeUnixNano": time.time_ns(), "attributes": attributes})
+
+    def record_exception(self, exc: BaseException):
+        self.status = "ERROR"
+        self.status_message = f"{type(exc).__name__}: {exc}"
+        self.add_event("exception", **{"exception.type": type(exc).__name__, "exception.message": str(exc)})
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self.status == "UNSET":
+            self.status = "OK"
+        if _exporter is not None:
+            _exporter.export(self)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": self.duration_ms,
+            "attributes": dict(self.attributes, **{"incident.id": self.trace_id}),
+            "events": self.events,
+            "status": {"code": self.status, "message": self.status_message},
+            "resource": {"service.name": SERVICE_NAME, "process.pid": os.getpid()},
+        }
+
+
+class FileExporter:
+    """每个结束的 span 追加一行JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+_exporter: Optional[FileExporter] = FileExporter(os.environ["TRACE_FILE"]) if os.environ.get("TRACE_FILE") else None
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+_INHERIT = object()
+
+
+def configure(path: Optional[str] = None, service_name: Optional[str] = None):
+    """指定导出文件（None 关闭导出）和服务名"""
+    global _exporter, SERVICE_NAME
+    _exporter = FileExporter(path) if path else None
+    if service_name:
+        SERVICE_NAME = service_name
+
+
+def new_incident_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def incident_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+def extract(traceparent: Optional[str]) -> Optional[SpanContext]:
+    """解析 W3C traceparent 头"""
+    match = TRACEPARENT_PATTERN.match((traceparent or "").strip().lower())
+    return SpanContext(match.group(1), match.group(2)) if match else None
+
+
+def inject(headers: Dict[str, str]) -> Dict[str, str]:
+    """把当前 span 写入请求头，供下游服务继续同一条 trace"""
+    span = _current.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+
+def parent_from(data: Dict[str, Any]):
+    """从告警数据恢复父 span：优先 traceparent，其次只有 incident_id 时以它作为 trace ID"""
+    parent = extract(data.get("traceparent"))
+    if parent is None and HEX32_PATTERN.match(str(data.get("incident_id") or "")):
+        parent = SpanContext(data["incident_id"], None)
+    return parent
+
+
+def start_span(name: str, parent=_INHERIT, incident_id: Optional[str] = None, **attributes) -> Span:
+    """
+    创建 span 但不设为当前 span，需要手动调用 end()。
+    用于跨 yield 的流式生成器和跨线程的场景。
+    """
+    if parent is _INHERIT:
+        parent = _current.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+    trace_id = incident_id if incident_id and HEX32_PATTERN.match(incident_id) else new_incident_id()
+    return Span(name, trace_id, None, attributes)
+
+
+@contextmanager
+def span(name: str, parent=_INHERIT, incident_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+    """在当前上下文（线程或协程）中创建子 span，异常会记录到 span 上再抛出"""
+    s = start_span(name, parent, incident_id, **attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+def record_span(name: str, start: float, end: float, parent=_INHERIT, **attributes) -> Span:
+    """事后补记一个 span，start/end 为 time.time() 秒数"""
+    s = start_span(name, parent, **attributes)
+    s.start_ns = int(start * 1e9)
+    s.end(int(end * 1e9))
+    return s
+
+
+def traced(name: Optional[str] = None, **attributes):
+    """函数装饰器，支持普通函数和协程函数"""
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def wrap(func: Callable) -> Callable:
+    """绑定当前上下文，供 run_in_executor / 线程池调用时保留父 span"""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, func)
+
+
+def bind(coro, parent=_INHERIT):
+    """让提交到其他事件循环（run_coroutine_threadsafe）的协程继承调用方的 span"""
+    if parent is _INHERIT:
+        parent = _current.get()
+
+    async def runner():
+        token = _current.set(parent)
+        try:
+            return await coro
+        finally:
+            _current.reset(token)
+
+    return runner()
+
+
+# ---------- 查看导出的 trace ----------
+
+def load_spans(path: str, incident: Optional[str] = None) -> List[Dict[str, Any]]:
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if incident is None or record["traceId"] == incident:
+                spans.append(record)
+    return spans
+
+
+def format_trace(spans: List[Dict[str, Any]]) -> str:
+    """按父子关系缩进输出一条 trace，显示相对 trace 起点的开始时间和耗时"""
+    if not spans:
+        return ""
+    ids = {s["spanId"] for s in spans}
+    children: Dict[str, List[Dict[str, Any]]] = {}
+    for s in spans:
+        parent = s["parentSpanId"] if s["parentSpanId"] in ids else ""
+        children.setdefault(parent, []).append(s)
+    t0 = min(s["startTimeUnixNano"] for s in spans)
+    lines = []
+
+    def walk(parent: str, depth: int):
+        for s in sorted(children.get(parent, []), key=lambda x: x["startTimeUnixNano"]):
+            offset = (s["startTimeUnixNano"] - t0) / 1e6
+            flag = " !" if s["status"]["code"] == "ERROR" else ""
+            lines.append(
+                f"{offset:>10.1f} ms {s['durationMs'] or 0:>10.1f} ms  "
+                f"{'  ' * depth}{s['name']} [{s['resource']['service.name']}]{flag}"
+            )
+            walk(s["spanId"], depth + 1)
+
+    walk("", 0)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查看导出的 trace")
+    parser.add_argument("files", nargs="+", help="各服务导出的 JSONL 文件")
+    parser.add_argument("--incident", default=None, help="只显示该 incident ID")
+    parser.add_argument("--last", type=int, default=5, help="未指定 incident 时显示最近几条含告警的 trace")
+    args = parser.parse_args(argv)
+
+    spans = [s for path in args.files for s in load_spans(path, args.incident)]
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    for s in spans:
+        traces.setdefault(s["traceId"], []).append(s)
+    if args.incident is None:
+        alerted = [t for t in traces.values() if any(s["name"] == "trigger_llm_intervention" for s in t)]
+        selected = sorted(alerted or list(traces.values()), key=lambda t: min(s["startTimeUnixNano"] for s in t))
+        selected = selected[-args.last:]
+    else:
+        selected = list(traces.values())
+    for trace in selected:
+        print(f"incident {trace[0]['traceId']}")
+        print(format_trace(trace))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+# TTS 延迟/吞吐基准测试：本地模拟 /generate_voice 服务 + 各调用路径的计时
+#
+# 用法:
+#   python tts_bench.py                          # 全部用例，默认延迟/带宽
+#   python tts_bench.py --delay 0.5 --throughput 96000 --repeat 5
+#   python tts_bench.py --cases audio_stream play_voice --json
+#
+# 每个用例在独立子进程中运行，峰值RSS互不影响。
+import argparse
+import json
+import math
+import os
+import resource
+import runpy
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+SAMPLE_RATE = 24000
+SAMPLE_WIDTH = 2
+BYTES_PER_SECOND = SAMPLE_RATE * SAMPLE_WIDTH
+
+CASES = ["tts_script", "audio_zip", "audio_stream", "stream_player", "play_voice"]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------- 模拟服务 ----------
+
+def synth_pcm(seconds: float) -> bytes:
+    """生成指定时长的440Hz正弦波PCM"""
+    n = int(seconds * SAMPLE_RATE)
+    one_period = [int(8000 * math.sin(2 * math.pi * 440 * i / SAMPLE_RATE)) for i in range(SAMPLE_RATE // 440)]
+    samples = (one_period * (n // len(one_period) + 1))[:n]
+    return struct.pack(f"<{n}h", *samples)
+
+
+def pcm_to_wav(pcm: bytes) -> bytes:
+    buf = BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buf.getvalue()
+
+
+class StubTTSServer:
+    """
+    模拟 ChatTTS 的 /generate_voice。
+
+    - delay: 收到请求到发出首字节的时间（模拟推理首包延迟）
+    - throughput: 音频字节输出速率（字节/秒，0 表示不限速）
+    - seconds_per_char: 每个字符对应的音频时长
+    zip 模式返回 {序号}.wav，流式模式以 chunked 编码输出裸PCM。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.2, throughput=0, seconds_per_char=0.2, chunk_size=8192):
+        self.delay = delay
+        self.throughput = throughput
+        self.seconds_per_char = seconds_per_char
+        self.chunk_size = chunk_size
+        self.requests_served = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if self.path != "/generate_voice":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                server.requests_served += 1
+                texts = body.get("text") or [""]
+                pcms = [synth_pcm(max(len(t), 1) * server.seconds_per_char) for t in texts]
+                time.sleep(server.delay)
+                if body.get("stream"):
+                    self._send_stream(b"".join(pcms))
+                else:
+                    self._send_zip(pcms)
+
+            def _pace(self, nbytes):
+                if server.throughput:
+                    time.sleep(nbytes / server.throughput)
+
+            def _send_zip(self, pcms):
+                buf = BytesIO()
+                with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+                    for i, pcm in enumerate(pcms):
+                        zf.writestr(f"{i}.wav", pcm_to_wav(pcm))
+                payload = buf.getvalue()
+                # zip需要整体生成后才能发送
+                self._pace(len(payload))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/zip")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_stream(self, pcm):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i in range(0, len(pcm), server.chunk_size):
+                    chunk = pcm[i:i + server.chunk_size]
+                    self._pace(len(chunk))
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/generate_voice"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ---------- 子进程内的用例 ----------
+
+class Timings:
+    """子进程内的计时点，全部相对于用例开始时间"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_byte = None
+        self.first_audio = None
+        self.audio_bytes = 0
+
+    def restart(self):
+        """导入完成后重新计时，只统计请求与音频处理本身"""
+        self.start = time.perf_counter()
+
+    def mark_first_byte(self):
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter()
+
+    def mark_first_audio(self):
+        if self.first_audio is None:
+            self.first_audio = time.perf_counter()
+
+    def report(self, end):
+        def rel(t):
+            return None if t is None else round(t - self.start, 4)
+
+        total = end - self.start
+        return {
+            "total_s": round(total, 4),
+            "ttfb_s": rel(self.first_byte),
+            "ttfa_s": rel(self.first_audio),
+            "audio_s": round(self.audio_bytes / BYTES_PER_SECOND, 3),
+            "throughput_x_realtime": round(self.audio_bytes / BYTES_PER_SECOND / total, 2) if total else None,
+            # Linux 下 ru_maxrss 单位为KB
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def instrument_first_byte(timings):
+    """响应头到达时 HTTPAdapter.send 返回，以此作为首字节时间"""
+    from requests.adapters import HTTPAdapter
+
+    original = HTTPAdapter.send
+
+    def send(self, *args, **kwargs):
+        response = original(self, *args, **kwargs)
+        timings.mark_first_byte()
+        return response
+
+    HTTPAdapter.send = send
+
+
+def wav_audio_bytes(paths):
+    total = 0
+    for path in paths:
+        with wave.open(path, "rb") as wav:
+            total += wav.getnframes() * wav.getsampwidth()
+    return total
+
+
+def case_tts_script(timings, workdir):
+    os.chdir(workdir)
+    timings.restart()
+    runpy.run_path(os.path.join(HERE, "TTS.py"), run_name="__main__")
+    paths = [os.path.join(root, f) for root, _, files in os.walk("output") for f in files if f.endswith(".wav")]
+    timings.mark_first_audio()
+    timings.audio_bytes = wav_audio_bytes(paths)
+
+
+def case_audio_zip(timings, workdir):
+    import audio
+
+    timings.restart()
+    audio.test_api(stream_mode=False)
+    out_dir = "./output_stream_False/"
+    timings.mark_first_audio()
+    timings.audio_bytes = wav_audio_bytes([os.path.join(out_dir, f) for f in os.listdir(out_dir) if f.endswith(".wav")])
+
+
+def case_audio_stream(timings, workdir):
+    import audio
+
+    original_write = audio.StreamingWavWriter.write
+
+    def write(self, chunk):
+        timings.mark_first_audio()
+        timings.audio_bytes += len(chunk)
+        original_write(self, chunk)
+
+    audio.StreamingWavWriter.write = write
+    timings.restart()
+    audio.test_api(stream_mode=True)
+
+
+def case_stream_player(timings, workdir):
+    import audio_player
+
+    class RecordingPlayer:
+        """替代声卡播放器，只记录音频何时可以开始播放"""
+
+        current_audio_data = None
+
+        def set_audio_data(self, audio_data):
+            timings.mark_first_audio()
+            timings.audio_bytes += len(audio_data) * SAMPLE_WIDTH
+
+        def cleanup(self):
+            pass
+
+    client = audio_player.TTSStreamClient.__new__(audio_player.TTSStreamClient)
+    client.player = RecordingPlayer()
+    client.tts = audio_player.TTSClient(manual_seed=12345678)
+    client.is_running = False
+    timings.restart()
+    client.request_and_play("欢迎使用实时语音合成系统。这是一个流式音频播放演示。")
+
+
+def case_play_voice(timings, workdir):
+    import LLM_inter
+    from audio_output import NullSink, get_audio_output
+
+    sink = NullSink(realtime=False)
+    get_audio_output(sink=sink, tts_params=LLM_inter.PLAY_VOICE_PARAMS)
+    timings.restart()
+    request = LLM_inter.play_voice("您好，我注意到您的心率异常，请问您现在感觉如何？")
+    request.wait(timeout=120)
+    if request.first_audio_at is not None:
+        # first_audio_at 为 time.time()，换算到 perf_counter 时间轴
+        timings.first_audio = timings.start + (request.first_audio_at - request.created_at)
+    timings.audio_bytes = sink.bytes_written
+
+
+def run_case(name):
+    """子进程入口：运行单个用例并输出一行JSON"""
+    sys.path.insert(0, HERE)
+    timings = Timings()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        result = {"case": name}
+        try:
+            instrument_first_byte(timings)
+            globals()[f"case_{name}"](timings, workdir)
+            result.update(timings.report(time.perf_counter()))
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        os.chdir(HERE)
+    print(json.dumps(result))
+
+
+# ---------- 主进程 ----------
+
+def spawn_case(name, server):
+    env = dict(os.environ, CHATTTS_SERVICE_HOST=server.host, CHATTTS_SERVICE_PORT=str(server.port))
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", name],
+        env=env, capture_output=True, text=True, timeout=600,
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line)
+    return {"case": name, "error": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+
+
+def summarize(runs):
+    """多次运行取中位数"""
+    ok = [r for r in runs if "error" not in r]
+    if not ok:
+        return runs[-1]
+    summary = {"case": ok[0]["case"], "runs": len(ok)}
+    for key in ("total_s", "ttfb_s", "ttfa_s", "audio_s", "throughput_x_realtime", "peak_rss_mb"):
+        values = [r[key] for r in ok if r.get(key) is not None]
+        summary[key] = round(statistics.median(values), 4) if values else None
+    return summary
+
+
+def print_table(results):
+    columns = ["case", "total_s", "ttfb_s", "ttfa_s", "audio_s", "throughput_x_realtime", "peak_rss_mb"]
+    print("  ".join(f"{c:>22}" if i else f"{c:<14}" for i, c in enumerate(columns)))
+    for r in results:
+        if "error" in r:
+            print(f"{r['case']:<14}  ERROR: {r['error']}")
+            continue
+        cells = [f"{r['case']:<14}"] + [f"{'-' if r.get(c) is None else r[c]:>22}" for c in columns[1:]]
+        print("  ".join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TTS 延迟/吞吐基准测试")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--delay", type=float, default=0.2, help="模拟服务首字节延迟（秒）")
+    parser.add_argument("--throughput", type=int, default=4 * BYTES_PER_SECOND, help="模拟服务输出速率（字节/秒，0不限速）")
+    parser.add_argument("--seconds-per-char", type=float, default=0.2, help="每个字符对应的音频时长")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        run_case(args.run_case)
+        return
+
+    server = StubTTSServer(
+        delay=args.delay, throughput=args.throughput, seconds_per_char=args.seconds_per_char
+    ).start()
+    try:
+        results = [summarize([spawn_case(name, server) for _ in range(args.repeat)]) for name in args.cases]
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"stub: delay={args.delay}s throughput={args.throughput}B/s seconds_per_char={args.seconds_per_char}")
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
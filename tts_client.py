@@ -0,0 +1,218 @@
+# 统一的 ChatTTS 客户端：共享请求体构造 + 长连接池，提供同步/异步、批量、zip/流式两种响应模式
+import os
+import threading
+import zipfile
+from io import BytesIO
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+CHATTTS_SERVICE_HOST = os.environ.get("CHATTTS_SERVICE_HOST", "localhost")
+CHATTTS_SERVICE_PORT = os.environ.get("CHATTTS_SERVICE_PORT", "8000")
+CHATTTS_URL = f"http://{CHATTTS_SERVICE_HOST}:{CHATTTS_SERVICE_PORT}/generate_voice"
+
+# 流式模式下服务端返回的PCM格式
+SAMPLE_RATE = 24000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+
+Texts = Union[str, List[str]]
+
+# zip 模式为整个请求的耗时，stream 模式为收到响应头（开始出音频）的耗时
+TTS_LATENCY = metrics.Histogram("tts_request_seconds", "ChatTTS request latency by response mode", ["mode"])
+TTS_ERRORS = metrics.Counter("tts_errors_total", "Failed ChatTTS requests by response mode", ["mode"])
+
+
+def _timed(stream: bool):
+    mode = "stream" if stream else "zip"
+    return metrics.timed(TTS_LATENCY.labels(mode), TTS_ERRORS.labels(mode))
+
+
+def build_request_body(
+    texts: Texts,
+    stream: bool = False,
+    speed: int = 2,
+    top_k: int = 20,
+    refine_top_p: float = 0.7,
+    show_tqdm: bool = True,
+    manual_seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """生成ChatTTS请求体，text 可以是单条文本或文本列表"""
+    if isinstance(texts, str):
+        texts = [texts]
+    params_infer_code = {
+        "prompt": f"[speed_{speed}]",
+        "top_P": 0.1,
+        "top_K": top_k,
+        "temperature": 0.01,
+        "repetition_penalty": 1.05,
+        "max_new_token": 2048,
+        "min_new_token": 0,
+        "show_tqdm": show_tqdm,
+        "ensure_non_empty": True,
+        "stream_batch": True,
+        "spk_emb": None,
+    }
+    if manual_seed is not None:
+        params_infer_code["manual_seed"] = manual_seed
+    return {
+        "text": list(texts),
+        "stream": stream,
+        "lang": None,
+        "skip_refine_text": True,
+        "refine_text_only": False,
+        "use_decoder": True,
+        "do_text_normalization": True,
+        "do_homophone_replacement": False,
+        "params_refine_text": {
+            "prompt": "",
+            "top_P": refine_top_p,
+            "top_K": top_k,
+            "temperature": 0.01,
+            "repetition_penalty": 1,
+            "max_new_token": 384,
+            "min_new_token": 0,
+            "show_tqdm": show_tqdm,
+            "ensure_non_empty": True,
+            "stream_batch": 24,
+        },
+        "params_infer_code": params_infer_code,
+    }
+
+
+def sorted_audio_members(zip_ref: zipfile.ZipFile) -> List[str]:
+    """按文本顺序返回zip中的音频文件名（服务端以序号命名）"""
+    names = [n for n in zip_ref.namelist() if n.endswith(".mp3") or n.endswith(".wav")]
+
+    def order(name: str):
+        stem = os.path.splitext(os.path.basename(name))[0]
+        return (0, int(stem), name) if stem.isdigit() else (1, 0, name)
+
+    return sorted(names, key=order)
+
+
+def extract_zip(content: bytes, out_dir: str) -> List[str]:
+    """解压zip响应到目录，返回按文本顺序排列的音频文件路径"""
+    os.makedirs(out_dir, exist_ok=True)
+    with zipfile.ZipFile(BytesIO(content), "r") as zip_ref:
+        zip_ref.extractall(out_dir)
+        return [os.path.join(out_dir, n) for n in sorted_audio_members(zip_ref)]
+
+
+class TTSClient:
+    """
+    带连接池的ChatTTS客户端。
+
+    同步接口基于 requests.Session（keep-alive 复用连接），异步接口基于 aiohttp，
+    两者都接受单条文本或文本列表，一次请求即可合成多条语音。
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        pool_size: int = 8,
+        timeout: float = 60,
+        **body_defaults: Any,
+    ):
+        self.url = url or CHATTTS_URL
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # 调用方的默认合成参数（speed、top_k等），可在每次请求时覆盖
+        self.body_defaults = body_defaults
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._async_session = None
+
+    def build_body(self, texts: Texts, stream: bool = False, **overrides: Any) -> Dict[str, Any]:
+        """合并默认参数与本次参数生成请求体"""
+        params = dict(self.body_defaults)
+        params.update(overrides)
+        return build_request_body(texts, stream=stream, **params)
+
+    # ---------- 同步接口 ----------
+
+    def post(self, texts: Texts, stream: bool = False, **overrides: Any) -> requests.Response:
+        """发送请求并返回原始响应（已检查HTTP状态）"""
+        body = self.build_body(texts, stream=stream, **overrides)
+        with _timed(stream):
+            response = self.session.post(self.url, json=body, stream=stream, timeout=self.timeout)
+            response.raise_for_status()
+        return response
+
+    def synthesize(self, texts: Texts, **overrides: Any) -> bytes:
+        """zip模式：返回包含每条文本音频的zip内容"""
+        return self.post(texts, stream=False, **overrides).content
+
+    def synthesize_to_dir(self, texts: Texts, out_dir: str, **overrides: Any) -> List[str]:
+        """zip模式：解压到目录，返回与输入文本一一对应的音频路径"""
+        return extract_zip(self.synthesize(texts, **overrides), out_dir)
+
+    def iter_stream(self, texts: Texts, chunk_size: int = 8192, **overrides: Any) -> Iterator[bytes]:
+        """流式模式：逐块产出PCM数据（24kHz、16bit、单声道）"""
+        with self.post(texts, stream=True, **overrides) as response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield chunk
+
+    def close(self):
+        self.session.close()
+
+    # ---------- 异步接口 ----------
+
+    async def _get_async_session(self):
+        # aiohttp会话必须在运行中的事件循环里创建，因此延迟到第一次异步调用
+        import aiohttp
+
+        if self._async_session is None or self._async_session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self._async_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._async_session
+
+    async def asynthesize(self, texts: Texts, **overrides: Any) -> bytes:
+        """异步zip模式"""
+        session = await self._get_async_session()
+        body = self.build_body(texts, stream=False, **overrides)
+        with _timed(False):
+            async with session.post(self.url, json=body) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def aiter_stream(self, texts: Texts, chunk_size: int = 8192, **overrides: Any) -> AsyncIterator[bytes]:
+        """异步流式模式"""
+        session = await self._get_async_session()
+        body = self.build_body(texts, stream=True, **overrides)
+        with _timed(True):
+            response = await session.post(self.url, json=body)
+            response.raise_for_status()
+        async with response:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                if chunk:
+                    yield chunk
+
+    async def aclose(self):
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+
+
+_default_client: Optional[TTSClient] = None
+_lock = threading.Lock()
+
+
+def get_default_client() -> TTSClient:
+    """进程内共享的默认客户端，所有调用方复用同一个连接池"""
+    global _default_client
+    with _lock:
+        if _default_client is None:
+            _default_client = TTSClient()
+        return _default_client